@@ -0,0 +1,229 @@
+
+'''
+Generate adsorbate placements on a host structure
+
+:py:func:`placements` extends :py:func:`asetools.asetools.attach_molecule`
+to many anchor atoms and a grid of angles and distances. The adsorbate
+positions of all grid points of an anchor are computed at once and checked
+for clashes with the host through a
+:py:class:`NeighborIndex <asetools.neighbors.NeighborIndex>` built once, the
+structures are only assembled for the accepted placements and yielded
+lazily. :py:func:`write_placements` streams them to a trajectory file
+and/or the database.
+
+Example::
+
+    candidates = placements(zeolite, al_indices, molecule('CH3OH'),
+                            thetas=range(0, 360, 30),
+                            distances=[2.0, 2.5, 3.0], mindist=1.6)
+    write_placements(candidates, traj='candidates.traj')
+'''
+
+from __future__ import print_function, division, absolute_import
+
+import itertools
+from collections import namedtuple
+
+import numpy as np
+
+from .neighbors import NeighborIndex
+
+
+Placement = namedtuple('Placement', ['anchor', 'theta', 'distance',
+                                     'elevation', 'contact', 'atoms'])
+
+
+def placement_positions(center, adsorbate, thetas, distances,
+                        elevations=(0.0,)):
+    '''
+    Return the adsorbate positions for the grid of angles and distances
+    around `center`
+
+    The center of mass of the adsorbate is put at the `distance` from
+    `center` along the direction given by the azimuthal angle `theta` in the
+    xy plane and the `elevation` above it (both in degrees), the adsorbate
+    is not rotated as in :py:func:`asetools.asetools.attach_molecule`.
+
+    Args:
+      center : array_like
+        Cartesian position of the anchor
+      adsorbate : ase.Atoms
+        Adsorbate to place
+      thetas : list of float
+        Azimuthal angles in degrees
+      distances : list of float
+        Distances of the center of mass from `center`
+      elevations : list of float
+        Angles above the xy plane in degrees
+
+    Returns:
+      grid : list of tuple
+        The ``(theta, distance, elevation)`` of every placement
+      positions : numpy.array
+        Positions with shape (len(grid), len(adsorbate), 3)
+    '''
+
+    grid = list(itertools.product(thetas, distances, elevations))
+    if not grid:
+        return grid, np.zeros((0, len(adsorbate), 3))
+
+    values = np.array(grid, dtype=float)
+    theta = np.radians(values[:, 0])
+    dist = values[:, 1]
+    elev = np.radians(values[:, 2])
+
+    shifts = dist[:, np.newaxis] * np.column_stack(
+        (np.cos(elev) * np.cos(theta), np.cos(elev) * np.sin(theta),
+         np.sin(elev)))
+
+    local = adsorbate.get_positions() - adsorbate.get_center_of_mass()
+    positions = np.asarray(center, dtype=float) + shifts[:, np.newaxis] + \
+        local[np.newaxis]
+    return grid, positions
+
+
+def placements(atoms, anchors, adsorbate, thetas, distances,
+               elevations=(0.0,), mindist=1.5, index=None):
+    '''
+    Generate the structures with the `adsorbate` placed around every anchor
+    atom, skipping those with any adsorbate atom closer than `mindist` to
+    the host atoms
+
+    Args:
+      atoms : ase.Atoms
+        Host structure, not modified
+      anchors : list of int
+        Indices of the anchor atoms
+      adsorbate : ase.Atoms
+        Adsorbate to place, not modified
+      thetas : list of float
+        Azimuthal angles in degrees, see :py:func:`placement_positions`
+      distances : list of float
+        Distances of the adsorbate center of mass from the anchor
+      elevations : list of float
+        Angles above the xy plane in degrees
+      mindist : float
+        Smallest distance in Angstrom allowed between an adsorbate and a
+        host atom (minimum image), `None` disables the clash detection
+      index : NeighborIndex
+        Prebuilt index of `atoms`, to reuse over many calls
+
+    Yields:
+      placement : Placement
+        Named tuple with the `anchor`, `theta`, `distance`, `elevation`,
+        the shortest adsorbate-host distance (`contact`) and the combined
+        `atoms`
+    '''
+
+    if mindist is not None and index is None:
+        index = NeighborIndex(atoms)
+
+    host = atoms.get_positions()
+    nads = len(adsorbate)
+
+    for anchor in anchors:
+        grid, positions = placement_positions(host[anchor], adsorbate,
+                                              thetas, distances, elevations)
+        if not grid:
+            continue
+
+        if mindist is None:
+            contacts = np.full(len(grid), np.inf)
+        else:
+            dist, _ = index.nearest(positions.reshape(-1, 3), k=1)
+            contacts = dist[:, 0].reshape(len(grid), nads).min(axis=1)
+
+        for (theta, distance, elevation), contact, adspos in zip(
+                grid, contacts, positions):
+            if mindist is not None and contact < mindist:
+                continue
+
+            molecule = adsorbate.copy()
+            molecule.set_positions(adspos)
+            yield Placement(anchor, theta, distance, elevation, contact,
+                            atoms + molecule)
+
+
+def write_placements(candidates, traj=None, session=None,
+                     name='{anchor:d}-{theta:g}-{distance:g}',
+                     topology=None, notes=None, packed=False,
+                     batch_size=500):
+    '''
+    Write the placements to a trajectory file and/or the database
+
+    Args:
+      candidates : iterable of Placement
+        Placements, e.g. from :py:func:`placements`, consumed lazily
+      traj : str
+        Name of the trajectory file
+      session : session
+        Database session, the systems are added in batches of `batch_size`
+        with :py:func:`add_systems <asetools.db.dbinterface.add_systems>`
+        and committed after every batch
+      name : str
+        Format string for the system names, filled with the fields of
+        :py:class:`Placement`
+      topology : str
+        Three letter framework topology code of the systems
+      notes : dict
+        Additional properties stored with every system next to the
+        `anchor`, `theta`, `distance` and `elevation`
+      packed : bool
+        Store the atoms as packed arrays instead of one row per atom
+      batch_size : int
+        Number of systems added per commit
+
+    Returns:
+      n : int
+        Number of placements written
+    '''
+
+    if traj is None and session is None:
+        raise ValueError('Either traj or session is required')
+
+    if session is not None:
+        from .db.dbinterface import add_systems, atoms2system
+
+    writer = None
+    if traj is not None:
+        from ase.io.trajectory import Trajectory
+        writer = Trajectory(traj, 'w')
+
+    batch = []
+
+    def flush():
+        add_systems(session, [system for system, _ in batch],
+                    [atoms for _, atoms in batch])
+        session.commit()
+        del batch[:]
+
+    count = 0
+    try:
+        for placement in candidates:
+            if writer is not None:
+                writer.write(placement.atoms)
+
+            if session is not None:
+                sysnotes = dict(notes or {})
+                sysnotes.update(anchor=int(placement.anchor),
+                                theta=float(placement.theta),
+                                distance=float(placement.distance),
+                                elevation=float(placement.elevation))
+                system = atoms2system(
+                    placement.atoms,
+                    name=name.format(**placement._asdict()),
+                    topology=topology, notes=sysnotes, packed=packed,
+                    bulk=True)
+                batch.append((system, placement.atoms))
+                if len(batch) >= batch_size:
+                    flush()
+
+            count += 1
+
+        if batch:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return count
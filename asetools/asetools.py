@@ -10,11 +10,13 @@ from builtins import (bytes, dict, int, list, object, range, str,
 import os
 import sys
 import math
+import weakref
 from collections import Counter
 from string import Template
 import numpy as np
 from scipy.constants import value
 from ase import Atom
+from ase.data import atomic_numbers, chemical_symbols
 
 
 N_A = value('Avogadro constant')
@@ -44,6 +46,14 @@ class AseTemplate(Template):
             keys[k] = [x[v - 1] for x in match if x[v - 1] != '']
         return keys
 
+    def compile(self):
+        '''
+        Parse the template once and return its
+        :py:class:`CompiledTemplate` that can be rendered repeatedly
+        without scanning the template string again'''
+
+        return CompiledTemplate(self)
+
     def render_and_write(self, subs, output='input.py', safe=True):
         '''
         Write a file rendered template to a file.
@@ -111,6 +121,96 @@ class AseTemplate(Template):
                                                                     p=path))
 
 
+class CompiledTemplate(object):
+    '''
+    Parsed form of an :py:class:`AseTemplate`, the template string is split
+    into literal text and placeholders so that rendering is a single join
+
+    Args:
+      template : AseTemplate
+        Template to compile
+    '''
+
+    def __init__(self, template):
+
+        self.template = template.template
+        # list of (literal, key, placeholder) tuples, `key` is `None` for
+        # the trailing text
+        self.segments = []
+        named = []
+        self.invalid = False
+
+        pos = 0
+        literal = []
+        for mo in template.pattern.finditer(template.template):
+            literal.append(template.template[pos:mo.start()])
+            pos = mo.end()
+            key = mo.group('named') or mo.group('braced')
+            if mo.group('escaped') is not None:
+                literal.append(template.delimiter)
+            elif key is not None:
+                self.segments.append((''.join(literal), key, mo.group()))
+                literal = []
+                if mo.group('named') is not None and key not in named:
+                    named.append(key)
+            else:
+                self.invalid = True
+                literal.append(mo.group())
+        literal.append(template.template[pos:])
+        self.segments.append((''.join(literal), None, ''))
+
+        self.named = tuple(named)
+        self.keys = frozenset(s[1] for s in self.segments if s[1] is not None)
+
+    def render(self, subs, safe=True):
+        '''
+        Return the rendered template, string values are quoted the same way
+        as in :py:meth:`AseTemplate.render_and_write`
+
+        Args:
+          subs : dict
+            Subsitution to be made in the template string
+          safe : bool
+            Leave the placeholders without substitution in place instead of
+            raising `KeyError`
+        '''
+
+        if not safe and self.invalid:
+            raise ValueError('Invalid placeholder in the template')
+
+        out = []
+        for literal, key, placeholder in self.segments:
+            out.append(literal)
+            if key is None:
+                continue
+            if key in subs:
+                value = subs[key]
+                if isinstance(value, str):
+                    out.append("'{0:s}'".format(value))
+                else:
+                    out.append('%s' % (value,))
+            elif safe:
+                out.append(placeholder)
+            else:
+                raise KeyError(key)
+
+        return ''.join(out)
+
+    def render_and_write(self, subs, output='input.py', safe=True):
+        '''
+        Write a file rendered template to a file.
+
+        Args:
+          subs : dict
+            Subsitution to be made in the template string
+          output : str
+            Name of the file to be written
+        '''
+
+        with open(output, 'w') as fout:
+            fout.write(self.render(subs, safe=safe))
+
+
 def eV_to_kJmol(energy):
     '''
     Convert the energy from eV to kJ/mol
@@ -238,6 +338,72 @@ def move_atom(atoms, i, j):
     return a
 
 
+# symbol -> indices maps of the Atoms objects by id, see symbol_indices
+_SYMBOL_INDICES = {}
+
+
+def symbol_indices(atoms):
+    '''
+    Return a dictionary with the chemical symbols present in `atoms` as keys
+    and sorted arrays of the indices of the atoms with that symbol as values
+
+    The map is cached per Atoms object and rebuilt when the atomic numbers
+    change, so repeated selections on large structures only cost a
+    comparison of the numbers.
+
+    Args:
+      atoms : ase.atoms.Atoms
+        System of atoms as ase Atoms instance
+
+    Returns:
+      out : dict
+        Indices of the atoms for every symbol, do not modify
+    '''
+
+    numbers = atoms.numbers
+    key = id(atoms)
+    cached = _SYMBOL_INDICES.get(key)
+    if cached is not None and cached[0]() is atoms and \
+            np.array_equal(cached[1], numbers):
+        return cached[2]
+
+    unique, inverse = np.unique(numbers, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1]
+    out = {chemical_symbols[z]: idx
+           for z, idx in zip(unique, np.split(order, bounds))}
+
+    # Atoms are not hashable, the entry is dropped with the object
+    ref = weakref.ref(atoms, lambda _: _SYMBOL_INDICES.pop(key, None))
+    _SYMBOL_INDICES[key] = (ref, numbers.copy(), out)
+    return out
+
+
+def select_by_symbols(atoms, symbollist, mode='include'):
+    '''
+    Return a sorted array with the indices of the atoms with (or without) the
+    symbols in `symbollist`, see :py:func:`get_indices_by_symbols`
+    '''
+
+    if isinstance(symbollist, str):
+        symbollist = [symbollist]
+
+    if mode not in ('include', 'exclude'):
+        raise ValueError('wrong mode: {}, allowed values we: "include" and "exclude"'.format(mode))
+
+    indices = symbol_indices(atoms)
+    found = [indices[symbol] for symbol in set(symbollist) if symbol in indices]
+    selected = np.sort(np.concatenate(found)) if found \
+        else np.zeros(0, dtype=int)
+
+    if mode == 'include':
+        return selected
+
+    mask = np.ones(len(atoms), dtype=bool)
+    mask[selected] = False
+    return np.flatnonzero(mask)
+
+
 def get_indices_by_symbols(atoms, symbollist, mode='include'):
     '''
     Function that given an Atoms object and a list of atom symbols returns a
@@ -247,8 +413,8 @@ def get_indices_by_symbols(atoms, symbollist, mode='include'):
     Args:
       atoms : ase.atoms.Atoms
         System of atoms as ase Atoms instance
-      symbollist : list
-        List of atomic symbols to be included/excluded
+      symbollist : list or str
+        List of atomic symbols to be included/excluded or a single symbol
       mode : str
         Return either a list of indices for atoms in the ``symbollist``
         or indices of other other than those in ``symbollist``
@@ -258,12 +424,7 @@ def get_indices_by_symbols(atoms, symbollist, mode='include'):
         List of indices
     '''
 
-    if mode == 'include':
-        return [atom.index for atom in atoms if atom.symbol in symbollist]
-    elif mode == 'exclude':
-        return [atom.index for atom in atoms if atom.symbol not in symbollist]
-    else:
-        raise ValueError('wrong mode: {}, allowed values we: "include" and "exclude"'.format(mode))
+    return select_by_symbols(atoms, symbollist, mode=mode).tolist()
 
 
 def remove_atom_by_symbols(atoms, symbollist):
@@ -272,7 +433,7 @@ def remove_atom_by_symbols(atoms, symbollist):
     object.
     '''
 
-    del atoms[[atom.index for atom in atoms if atom.symbol in symbollist]]
+    del atoms[select_by_symbols(atoms, symbollist)]
 
 
 def substitute_atom(atoms, a1, a2):
@@ -280,10 +441,10 @@ def substitute_atom(atoms, a1, a2):
     Funtion that given an Atoms object and two symbols a1 and a2, substitutes
     a1 for a2.
     '''
-    indices = get_indices_by_symbols(atoms, a1)
-    for i in indices:
-        atoms[i].symbol = a2
-    return
+
+    numbers = atoms.get_atomic_numbers()
+    numbers[select_by_symbols(atoms, a1)] = atomic_numbers[a2]
+    atoms.set_atomic_numbers(numbers)
 
 
 def attach_atom(atoms, ind, symbol='H', theta=-45.0, r=1.5):
@@ -389,15 +550,16 @@ def set_init_magmoms(atoms, magset):
     '''sets initial magmoms for elements specified in magset. E.g. ('Ni',1.0)
     will set the initial magnetic moment of all Ni atoms to 1.0'''
 
-    indxs = []
+    magmoms = np.zeros(len(atoms), dtype=float)
+    found = False
     for name, magmom in magset:
-        idxs = get_indices_by_symbols(atoms, name)
-        magvals = [magmom] * len(idxs)
-        indxs += zip(idxs, magvals)
-    if indxs == [] and magset != []:
+        idxs = select_by_symbols(atoms, name)
+        magmoms[idxs] = magmom
+        found = found or len(idxs) > 0
+    if not found and magset != []:
         raise ValueError('Error: no elements of specified type present. Exiting...')
     else:
-        set_init_magmoms_from_indxs(atoms, indxs)
+        atoms.set_initial_magnetic_moments(magmoms)
 
 
 def set_init_magmoms_from_indxs(atoms, indxs):
@@ -411,10 +573,13 @@ def set_init_magmoms_from_indxs(atoms, indxs):
     atoms.set_initial_magnetic_moments(new_magmoms)
 
 
-def find_closest(atoms, reference, symbol=None, n=1):
+def find_closest(atoms, reference, symbol=None, n=1, index=None):
     '''
     Return a list of indices of atoms closest to the reference atom
 
+    The distances follow the minimum image convention along the periodic
+    directions of `atoms`, see :py:class:`asetools.neighbors.NeighborIndex`.
+
     Args:
       atoms : ase.Atoms
         ASE Atoms object
@@ -425,6 +590,8 @@ def find_closest(atoms, reference, symbol=None, n=1):
         nearest to the refence
       n : int
         Number of nearest atoms to be returned
+      index : NeighborIndex
+        Index of `atoms` to reuse over many calls, built if not given
 
     Returns:
       out : np.array
@@ -432,19 +599,21 @@ def find_closest(atoms, reference, symbol=None, n=1):
         symbol and distance to reference atoms
     '''
 
-    pos = atoms.get_positions()
-    d = np.sqrt(np.power(pos - pos[reference], 2).sum(axis=1))
+    from .neighbors import NeighborIndex
 
-    out = np.array(zip(range(len(atoms)), atoms.get_chemical_symbols(), d),
-            dtype=[('idx', int), ('symbol', '|S2'), ('dist', float)])
+    if index is None:
+        index = NeighborIndex(atoms)
 
-    out = out[out['idx'] != reference]
-    out = np.sort(out, order='dist')
+    dist, idx = index.nearest([reference], k=n, symbols=symbol or None)
+    found = idx[0] >= 0
 
-    if symbol:
-        out = out[out['symbol'] == symbol]
+    out = np.zeros(int(found.sum()),
+                   dtype=[('idx', int), ('symbol', 'U2'), ('dist', float)])
+    out['idx'] = idx[0][found]
+    out['symbol'] = index.symbols[idx[0][found]]
+    out['dist'] = dist[0][found]
 
-    return out[:n]
+    return out
 
 
 def get_indices_of_duplicates(lst):
@@ -472,17 +641,30 @@ def get_indices_of_duplicates(lst):
     return vals, res
 
 
-def nearest_neighbors_kd_tree(x, y, k):
+def nearest_neighbors_kd_tree(x, y, k, cell=None, pbc=False,
+                              method='greedy'):
     '''
     Find unique pairs using KDTree method
 
     Args:
         x : numpy.array
-            points in 3D
+            points in 3D, or a batch of frames with shape (nframes, n, 3)
         y : numpy.array
             points in 3D
         k : int
-            number of nearest neighbors to use
+            initial number of nearest neighbors to use, widened for the
+            points of `x` left without a partner
+        cell : numpy.array
+            unit cell for the minimum image distances
+        pbc : bool or list of bool
+            periodic directions of the `cell`
+        method : str
+            ``'greedy'`` or ``'optimal'``, see
+            :py:func:`asetools.neighbors.match_points`
+
+    Returns:
+        index of the partner in `y` for every point of `x`, -1 only when `x`
+        has more points than `y`
 
     .. seealso::
 
@@ -490,21 +672,9 @@ def nearest_neighbors_kd_tree(x, y, k):
 
     '''
 
-    from scipy.spatial import cKDTree
+    from .neighbors import match_points
 
-    x, y = map(np.asarray, (x, y))
-    tree = cKDTree(y)
-    ordered_neighbors = tree.query(x, k)[1]
-    nearest_neighbor = np.empty((len(x),), dtype=np.intp)
-    nearest_neighbor.fill(-1)
-    used_y = set()
-    for j, neigh_j in enumerate(ordered_neighbors):
-        for k in neigh_j:
-            if k not in used_y:
-                nearest_neighbor[j] = k
-                used_y.add(k)
-                break
-    return nearest_neighbor
+    return match_points(x, y, k=k, cell=cell, pbc=pbc, method=method)
 
 
 def rmsd(a, b, relative=True):
@@ -564,9 +734,10 @@ def assign_magnetic_moments_by_symbols(atoms, magdict, clear=False):
     else:
         magmoms = atoms.get_initial_magnetic_moments()
 
+    indices = symbol_indices(atoms)
     for symbol, magm in magdict.items():
-        mask = np.array([s == symbol for s in atoms.get_chemical_symbols()])
-        magmoms[mask] = magm
-        atoms.set_initial_magnetic_moments(magmoms)
-        if sum(mask) == 0:
+        if symbol in indices:
+            magmoms[indices[symbol]] = magm
+        else:
             print("couldn't find <{}> in atoms".format(symbol))
+    atoms.set_initial_magnetic_moments(magmoms)
@@ -3,6 +3,7 @@ from __future__ import print_function
 
 import argparse
 import os
+import sys
 import numpy as np
 
 import ase.io
@@ -11,6 +12,7 @@ from ase.geometry import cell_to_cellpar
 
 from .asetools import AseTemplate, rmsd
 from .io import write_biosym_car
+from .similarity import rmsd_matrix, rmsd_to_reference
 
 
 def trajextract():
@@ -171,15 +173,65 @@ def get_cell():
 
 
 def rmsdcli():
+    '''
+    A CLI to calculate the RMSD between two structures, of every frame
+    against the first structure or the matrix between all structures, see
+    :py:mod:`asetools.similarity`
+    '''
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('atomsA')
-    parser.add_argument('atomsB')
+    parser.add_argument('files', nargs='+',
+                        help='structure or trajectory files, the first '
+                             'structure is the reference')
+    parser.add_argument('-i', '--index', default='-1',
+                        help='frames to read from every file, e.g. ":" for '
+                             'all, default is the last one')
+    parser.add_argument('-m', '--matrix', action='store_true',
+                        help='RMSD between all pairs of structures')
+    parser.add_argument('-a', '--align', action='store_true',
+                        help='superimpose the structures first')
+    parser.add_argument('--mic', action='store_true',
+                        help='use the minimum image displacements')
+    parser.add_argument('-p', '--permute', action='store_true',
+                        help='match the atoms of the same element by '
+                             'distance instead of the atom order')
+    parser.add_argument('-o', '--output',
+                        help='save the values to a text file')
     parser.add_argument('-r', '--relative', action='store_true',
                         help='use positions relative to the unit cell')
     args = parser.parse_args()
 
-    a = ase.io.read(args.atomsA)
-    b = ase.io.read(args.atomsB)
-
-    print('RMSD: {0:.6f}'.format(rmsd(a, b, args.relative)))
+    structures = []
+    for fname in args.files:
+        frames = ase.io.read(fname, index=args.index)
+        structures.extend(frames if isinstance(frames, list) else [frames])
+
+    if len(structures) < 2:
+        parser.error('at least two structures are needed')
+
+    if args.relative and (args.matrix or args.align or args.mic or
+                          args.permute):
+        parser.error('--relative cannot be combined with the other options')
+
+    if args.matrix:
+        values = rmsd_matrix(structures, align=args.align, mic=args.mic,
+                             permute=args.permute)
+        if args.output is None:
+            np.savetxt(sys.stdout, values, fmt='%10.6f')
+    elif args.relative:
+        values = np.array([rmsd(structures[0], atoms, True)
+                           for atoms in structures[1:]])
+    else:
+        values = rmsd_to_reference(structures[1:], structures[0],
+                                   align=args.align, mic=args.mic,
+                                   permute=args.permute)
+
+    if not args.matrix and args.output is None:
+        if len(values) == 1:
+            print('RMSD: {0:.6f}'.format(values[0]))
+        else:
+            for i, value in enumerate(values, start=1):
+                print('{0:6d} {1:12.6f}'.format(i, value))
+
+    if args.output is not None:
+        np.savetxt(args.output, np.atleast_1d(values), fmt='%.6f')
@@ -3,3 +3,5 @@
 from .model import *
 from .dbinterface import *
 from .jobmanager import JobManager
+from .cache import AtomsCache
+from .asyncjobmanager import AsyncJobManager
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+'''
+asyncio front end of the :py:class:`JobManager <asetools.db.jobmanager.JobManager>`
+
+The database work is serialized on a single thread (or run through
+``AsyncSession.run_sync`` when an async SQLAlchemy session is given) while
+the scheduler calls, submissions and output file reads of many jobs are
+overlapped with each other and with the database writes, the number of
+operations in flight is bounded by `concurrency`.
+'''
+
+import asyncio
+import logging
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+try:
+    from sqlalchemy.ext.asyncio import AsyncSession
+except ImportError:
+    AsyncSession = None
+
+from ..asetools import get_config
+from ..scheduler import PARTIAL_EXIT, scheduler_calls
+from ..submit import main as sub
+from .dbinterface import jobs_by_name
+from .jobmanager import (JobManager, filter_digests, filter_outputs,
+                         read_output, stat_output)
+from .utils import file_digest
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class AsyncJobManager(object):
+    '''
+    Database oriented job manager with coroutine methods
+
+    Example::
+
+        async with AsyncJobManager(session, concurrency=64) as ajm:
+            await ajm.submit_jobs(systems, 'relax')
+            changed = await ajm.sync_status(jobname='relax')
+            report = await ajm.harvest_geoms(systems, 'relax')
+
+    Args:
+        session : Session or AsyncSession
+            Session object instance, with an
+            ``sqlalchemy.ext.asyncio.AsyncSession`` the database work is run
+            with ``run_sync`` on its async connection
+        concurrency : int
+            Maximal number of subprocesses and file operations in flight
+        workers : int
+            Number of processes reading the output trajectories, the reads
+            are done in threads if smaller than 2
+        cachesize : int
+            See :py:class:`JobManager <asetools.db.jobmanager.JobManager>`
+        cachedir : str
+            See :py:class:`JobManager <asetools.db.jobmanager.JobManager>`
+    '''
+
+    def __init__(self, session, concurrency=32, workers=4, cachesize=256,
+                 cachedir=None):
+
+        self.session = session
+        self.is_async = AsyncSession is not None and \
+            isinstance(session, AsyncSession)
+        syncsession = session.sync_session if self.is_async else session
+
+        self.manager = JobManager(syncsession, cachesize=cachesize,
+                                  cachedir=cachedir)
+        self.concurrency = concurrency
+        self.workers = workers
+
+        self._dbexecutor = ThreadPoolExecutor(max_workers=1)
+        self._ioexecutor = ThreadPoolExecutor(max_workers=concurrency)
+        self._procexecutor = None
+        # created in the running loop
+        self._limit = None
+        self._dblock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        'Shut down the executors'
+
+        self._dbexecutor.shutdown()
+        self._ioexecutor.shutdown()
+        if self._procexecutor is not None:
+            self._procexecutor.shutdown()
+            self._procexecutor = None
+
+    @property
+    def limit(self):
+        'Semaphore bounding the number of operations in flight'
+
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        return self._limit
+
+    async def db(self, func, *args, **kwargs):
+        '''
+        Run `func` using the synchronous session, one call at a time, and
+        return its result
+        '''
+
+        call = partial(func, *args, **kwargs)
+        if self.is_async:
+            if self._dblock is None:
+                self._dblock = asyncio.Lock()
+            async with self._dblock:
+                return await self.session.run_sync(lambda _: call())
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._dbexecutor, call)
+
+    async def io(self, func, *args, **kwargs):
+        'Run the blocking `func` in a thread within the concurrency limit'
+
+        loop = asyncio.get_running_loop()
+        async with self.limit:
+            return await loop.run_in_executor(self._ioexecutor,
+                                              partial(func, *args, **kwargs))
+
+    async def run(self, cmd, cwd=None, check=True):
+        '''
+        Run the command `cmd` within the concurrency limit and return its
+        standard output
+
+        Raises:
+          subprocess.CalledProcessError:
+            when the command exits with non zero status and `check` is True
+        '''
+
+        async with self.limit:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, cwd=cwd, stdout=asyncio.subprocess.PIPE)
+            output, _ = await proc.communicate()
+
+        if check and proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+        return output.decode('utf-8', 'replace')
+
+    async def call(self, name, *args, **kwargs):
+        '''
+        Run any :py:class:`JobManager <asetools.db.jobmanager.JobManager>`
+        method `name` without blocking the event loop, e.g.
+        ``await ajm.call('write_jobs', systems, 'relax')``
+        '''
+
+        return await self.db(getattr(self.manager, name), *args, **kwargs)
+
+    async def submit_jobs(self, systems, jobname, subargs=None, array=False,
+                          commit=True, **kwargs):
+        '''
+        Submit the jobs concurrently, see
+        :py:meth:`JobManager.submit_jobs <asetools.db.jobmanager.JobManager.submit_jobs>`
+
+        An array job (`array=True`) is a single submission and is delegated
+        to the synchronous manager together with the `kwargs`.
+
+        Returns:
+            errors : dict
+                Submission errors with the system names as keys, the jobs
+                submitted successfully are recorded regardless
+        '''
+
+        if array:
+            await self.db(self.manager.submit_jobs, systems, jobname,
+                          subargs, array=True, commit=commit, **kwargs)
+            return {}
+
+        if subargs is None:
+            subargs = ['-t', '120:00:00', '-n', '2']
+
+        # the ORM attributes are only read on the database thread
+        def load():
+            jobs = jobs_by_name(self.manager.session, systems, jobname)
+            return jobs, [(system.name, job.abspath, job.inpname)
+                          for system, job in zip(systems, jobs)]
+
+        jobs, paths = await self.db(load)
+
+        results = await asyncio.gather(
+            *[self.io(sub, [inpname] + subargs, workdir=path)
+              for _, path, inpname in paths],
+            return_exceptions=True)
+
+        errors = {}
+        submitted = []
+        for (name, _, _), job, result in zip(paths, jobs, results):
+            if isinstance(result, Exception):
+                errors[name] = '{0}: {1}'.format(result.__class__.__name__,
+                                                 result)
+                log.warning('failed to submit {0}: {1}'.format(
+                    name, errors[name]))
+            else:
+                submitted.append((job, result))
+
+        await self.db(self.manager._record_submission,
+                      [job for job, _ in submitted],
+                      [taskid for _, taskid in submitted], commit=commit)
+
+        return errors
+
+    async def sync_status(self, systems=None, jobname=None, batch=None,
+                          command=None, commit=True):
+        '''
+        Update the status of the submitted jobs from the batch system with
+        the scheduler queries run concurrently, see
+        :py:meth:`JobManager.sync_status <asetools.db.jobmanager.JobManager.sync_status>`
+        '''
+
+        if batch is None:
+            batch = get_config()['batch']
+
+        tracked = await self.db(self.manager._tracked_jobs, systems, jobname)
+        if not tracked:
+            return {}
+
+        calls = scheduler_calls(sorted(set(row.batchid for row in tracked)),
+                                batch=batch, command=command)
+        # unknown job ids make some schedulers exit with non zero status
+        check = batch.lower() not in PARTIAL_EXIT
+        outputs = await asyncio.gather(*[self.run(cmd, check=check)
+                                         for cmd, _ in calls])
+
+        states = {}
+        for (_, parser), output in zip(calls, outputs):
+            states.update(parser(output))
+
+        return await self.db(self.manager._apply_states, tracked, states,
+                             commit=commit)
+
+    async def harvest_geoms(self, systems, jobname, jobstatus='finished',
+                            packed=None, batch_size=200, use_hash=False,
+                            force=False, commit=True):
+        '''
+        Asynchronous version of
+        :py:meth:`JobManager.harvest_geoms <asetools.db.jobmanager.JobManager.harvest_geoms>`,
+        the outputs are read while the previous batches are being written to
+        the database
+
+        Returns:
+            report : dict
+                Names of the systems that were `updated`, `unchanged`,
+                `missing` (no output file) and `failed` (dict with errors)
+        '''
+
+        report = {'updated': [], 'unchanged': [], 'missing': [], 'failed': {}}
+
+        def load():
+            jobs = jobs_by_name(self.manager.session, systems, jobname)
+            return jobs, [job.outpath for job in jobs]
+
+        jobs, outpaths = await self.db(load)
+
+        stats = await asyncio.gather(*[self.io(stat_output, path)
+                                       for path in outpaths])
+        candidates = await self.db(filter_outputs, systems, jobs, stats,
+                                   report, force=force)
+
+        if use_hash and candidates:
+            paths = await self.db(lambda: [c[1].outpath for c in candidates])
+            digests = await asyncio.gather(*[self.io(file_digest, path)
+                                             for path in paths])
+            candidates = await self.db(filter_digests, candidates, digests,
+                                       report, force=force)
+
+        # the objects are expired by the commits of the batches, so the
+        # names and paths are read here on the database thread
+        paths = await self.db(lambda: [(c[0].name, c[1].outpath,
+                                        c[1].inppath) for c in candidates])
+
+        log.info('harvest {0}: {1:d} changed, {2:d} unchanged, {3:d} '
+                 'missing'.format(jobname, len(candidates),
+                                  len(report['unchanged']),
+                                  len(report['missing'])))
+
+        if self.workers > 1 and len(paths) > 1:
+            if self._procexecutor is None:
+                self._procexecutor = ProcessPoolExecutor(
+                    max_workers=self.workers)
+            executor = self._procexecutor
+        else:
+            executor = self._ioexecutor
+
+        loop = asyncio.get_running_loop()
+
+        async def read(candidate, name, path):
+            async with self.limit:
+                result = await loop.run_in_executor(executor, read_output,
+                                                    path)
+            return candidate, name, result
+
+        tasks = [asyncio.ensure_future(read(c, p[0], p[1:]))
+                 for c, p in zip(candidates, paths)]
+
+        batch = []
+        try:
+            for future in asyncio.as_completed(tasks):
+                candidate, name, result = await future
+                outpath, atoms, jobscript, error = result
+                system, job, stat, digest = candidate
+                if atoms is None:
+                    report['failed'][name] = error
+                    log.warning('failed to read {0}: {1}'.format(outpath,
+                                                                 error))
+                    continue
+
+                batch.append((system, job, stat, digest, atoms, jobscript))
+                report['updated'].append(name)
+
+                if len(batch) >= batch_size:
+                    # the remaining reads continue while the batch is written
+                    await self.db(self.manager._apply_harvest, batch,
+                                  jobstatus, packed, commit)
+                    batch = []
+
+            if batch:
+                await self.db(self.manager._apply_harvest, batch, jobstatus,
+                              packed, commit)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        await self.db(self.manager.session.commit if commit
+                      else self.manager.session.rollback)
+
+        return report
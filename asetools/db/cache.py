@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+'''
+Read-through cache of ase.Atoms reconstructed from the database
+'''
+
+import glob
+import os
+import pickle
+
+from collections import OrderedDict
+
+from .dbinterface import get_atoms_many
+
+
+class AtomsCache(object):
+    '''
+    Bounded LRU cache of ase.Atoms instances built from the
+    :py:class:`System <asetools.db.model.System>` rows, optionally backed by
+    a directory with pickled Atoms that persists between sessions.
+
+    The entries are keyed on ``(System.id, System.mtime)`` so a system
+    modified in the database is never served from a stale entry, copies of
+    the cached Atoms are returned so the callers can modify them freely.
+
+    Args:
+      session : session
+        Session object instance
+      maxsize : int
+        Maximal number of Atoms kept in memory
+      cachedir : str
+        Directory for the on-disk cache, disabled if `None`
+    '''
+
+    def __init__(self, session, maxsize=256, cachedir=None):
+
+        self.session = session
+        self.maxsize = maxsize
+        self.cachedir = cachedir
+        self._data = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if cachedir is not None and not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, system):
+        return self.key(system) in self._data
+
+    @staticmethod
+    def key(system):
+        'Return the cache key for the `system`'
+
+        return (system.id, system.mtime)
+
+    def _path(self, key):
+        'Return the name of the on-disk cache file for the `key`'
+
+        sid, mtime = key
+        stamp = 'none' if mtime is None else mtime.strftime('%Y%m%dT%H%M%S%f')
+        return os.path.join(self.cachedir, '{0:d}-{1}.pkl'.format(sid, stamp))
+
+    def _store(self, key, atoms):
+        'Put `atoms` under `key` evicting the least recently used entries'
+
+        self._data[key] = atoms
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+        if self.cachedir is not None:
+            path = self._path(key)
+            if not os.path.exists(path):
+                with open(path, 'wb') as fobj:
+                    pickle.dump(atoms, fobj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _lookup(self, key):
+        'Return the cached Atoms for the `key` or `None`'
+
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+        if self.cachedir is not None:
+            path = self._path(key)
+            if os.path.exists(path):
+                with open(path, 'rb') as fobj:
+                    atoms = pickle.load(fobj)
+                self.disk_hits += 1
+                self._store(key, atoms)
+                return atoms
+
+        return None
+
+    def get(self, system):
+        '''
+        Return the ase.Atoms for a single system
+
+        Args:
+          system : System
+            :py:class:`System <asetools.db.model.System>` instance
+        '''
+
+        return self.get_many([system])[0]
+
+    def get_many(self, systems):
+        '''
+        Return a list of ase.Atoms for the `systems`, the ones not found in
+        the cache are loaded from the database in one go
+
+        Args:
+          systems : list
+            List of :py:class:`System <asetools.db.model.System>` instances
+        '''
+
+        out = [None] * len(systems)
+        missing = OrderedDict()
+        for i, system in enumerate(systems):
+            atoms = self._lookup(self.key(system))
+            if atoms is None:
+                missing.setdefault(system.id, []).append(i)
+            else:
+                out[i] = atoms.copy()
+
+        if missing:
+            self.misses += len(missing)
+            loaded = get_atoms_many(self.session, list(missing.keys()))
+            for sid, indices in missing.items():
+                if sid not in loaded:
+                    raise ValueError('No system with id={} in the '
+                                     'database'.format(sid))
+                atoms = loaded[sid]
+                # entries for older modification times are stale
+                self._drop([sid])
+                self._store(self.key(systems[indices[0]]), atoms)
+                for i in indices:
+                    out[i] = atoms.copy()
+
+        return out
+
+    def invalidate(self, systems=None):
+        '''
+        Drop the cached entries (in memory and on disk) of the `systems`
+        regardless of their modification time, or all the entries if
+        `systems` is `None`
+
+        Args:
+          systems : list
+            List of :py:class:`System <asetools.db.model.System>` instances
+        '''
+
+        if systems is None:
+            self._data.clear()
+            if self.cachedir is not None:
+                for path in glob.glob(os.path.join(self.cachedir, '*.pkl')):
+                    os.remove(path)
+            return
+
+        self._drop(set(s.id for s in systems))
+
+    def _drop(self, ids):
+        'Remove all the entries of the systems with `ids`'
+
+        for key in [k for k in self._data if k[0] in ids]:
+            del self._data[key]
+
+        if self.cachedir is not None:
+            for sid in ids:
+                if sid is None:
+                    continue
+                pattern = os.path.join(self.cachedir, '{0:d}-*.pkl'.format(sid))
+                for path in glob.glob(pattern):
+                    os.remove(path)
+
+    def clear(self):
+        'Remove all the entries and reset the statistics'
+
+        self.invalidate()
+        self.hits = self.disk_hits = self.misses = 0
+
+    @property
+    def stats(self):
+        'Dictionary with the cache statistics'
+
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hitrate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
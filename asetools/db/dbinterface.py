@@ -3,41 +3,180 @@
 '''A module providing methods for communication between ASE and the database'''
 
 import argparse
+import glob
 import json
 import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import pandas as pd
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker, scoped_session, selectinload
+from sqlalchemy.pool import QueuePool
 import numpy as np
 
 import ase.io
 from ase import Atoms
 from ase.geometry import cellpar_to_cell, cell_to_cellpar
 
-from .model import (Base, DBAtom, System, DBTemplate, DBCalculator, Vibration,
-                    VibrationSet)
+from .model import (Base, DBAtom, DBAtomArrays, System, DBTemplate,
+                    DBCalculator, Job, Vibration, VibrationSet)
+from .utils import chunks
 
 
-def get_session(dbpath, echo=False):
+# maximal number of ids used in a single IN clause
+CHUNKSIZE = 500
+
+# columns of the atoms table needed to build ase.Atoms, in order
+ATOM_COLUMNS = ['atomic_number', 'x', 'y', 'z', 'momentum_x', 'momentum_y',
+                'momentum_z', 'tag', 'mass', 'magmom', 'charge']
+
+
+# recommended settings for SQLite databases read by many processes while
+# being written to, see https://www.sqlite.org/pragma.html
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'busy_timeout': 30000,
+}
+
+PGURL = 'postgresql+{dbapi:s}://smn_kvantekjemi_test_user:{passwd:s}@dbpg-hotel-utv.uio.no/smn_kvantekjemi_test'
+
+# process wide registries of engines and session factories
+_engines = {}
+_sessionmakers = {}
+
+
+def _set_sqlite_pragmas(pragmas):
+    'Return a connect event listener setting the SQLite `pragmas`'
+
+    def listener(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas:
+            cursor.execute('PRAGMA {0:s}={1!s}'.format(key, value))
+        cursor.close()
+
+    return listener
+
+
+def get_cached_engine(url, echo=False, pragmas=None, **kwargs):
+    '''
+    Return the engine for `url` from a process wide registry, creating it
+    on the first request.
+
+    File based SQLite engines use a connection pool shareable between
+    threads and get the `pragmas` applied on every new connection, other
+    databases get a pool with pre-ping.
+
+    Args:
+      url : str
+        Database URL
+      echo : bool
+        Echo the SQL statements
+      pragmas : dict
+        SQLite pragmas to be set on connect, e.g. :py:data:`SQLITE_PRAGMAS`
+      kwargs :
+        Additional arguments for `sqlalchemy.create_engine`
+
+    Returns:
+      engine :
+        Database engine
+    '''
+
+    pragmas = tuple(sorted((pragmas or {}).items()))
+    key = (url, echo, pragmas,
+           tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+
+    if key not in _engines:
+        if url.startswith('sqlite'):
+            if ':memory:' not in url and url.rstrip('/') != 'sqlite:':
+                kwargs.setdefault('poolclass', QueuePool)
+                kwargs.setdefault('connect_args', {'check_same_thread': False})
+        else:
+            kwargs.setdefault('pool_pre_ping', True)
+
+        engine = create_engine(url, echo=echo, **kwargs)
+
+        if url.startswith('sqlite') and pragmas:
+            event.listen(engine, 'connect', _set_sqlite_pragmas(pragmas))
+
+        _engines[key] = engine
+
+    return _engines[key]
+
+
+def dispose_engines():
+    'Dispose all the cached engines and clear the registries'
+
+    for engine in _engines.values():
+        engine.dispose()
+    _engines.clear()
+    _sessionmakers.clear()
+
+
+def _get_sessionmaker(engine):
+    'Return the cached session factory bound to `engine`'
+
+    if engine not in _sessionmakers:
+        _sessionmakers[engine] = sessionmaker(bind=engine, autoflush=False,
+                                              autocommit=False)
+    return _sessionmakers[engine]
+
+
+def get_session(dbpath, echo=False, pragmas=None):
     '''
     Return the database session connection for the sqlite3 database
 
     Args:
       dbpath : str
         Path to the database file
+      echo : bool
+        Echo the SQL statements
+      pragmas : dict
+        SQLite pragmas to be set on connect, e.g. :py:data:`SQLITE_PRAGMAS`
 
     Returns:
       session :
         Session instance
     '''
 
-    if os.path.exists(dbpath):
-        engine = create_engine("sqlite:///{path:s}".format(path=dbpath), echo=echo)
-    else:
-        engine = create_engine("sqlite:///{path:s}".format(path=dbpath), echo=echo)
+    exists = os.path.exists(dbpath)
+    engine = get_engine(dbpath, echo=echo, pragmas=pragmas)
+    if not exists:
         Base.metadata.create_all(engine)
-    db_session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-    return db_session()
+    return _get_sessionmaker(engine)()
+
+
+def get_scoped_session(dbpath, echo=False, pragmas=None):
+    '''
+    Return a thread local session registry for the sqlite3 database, calling
+    the registry returns the session of the current thread
+
+    Args:
+      dbpath : str
+        Path to the database file
+      echo : bool
+        Echo the SQL statements
+      pragmas : dict
+        SQLite pragmas to be set on connect, e.g. :py:data:`SQLITE_PRAGMAS`
+
+    Returns:
+      registry : sqlalchemy.orm.scoped_session
+    '''
+
+    exists = os.path.exists(dbpath)
+    engine = get_engine(dbpath, echo=echo, pragmas=pragmas)
+    if not exists:
+        Base.metadata.create_all(engine)
+
+    key = ('scoped', engine)
+    if key not in _sessionmakers:
+        _sessionmakers[key] = scoped_session(_get_sessionmaker(engine))
+    return _sessionmakers[key]
 
 
 def get_pgsession(passwd, dbapi='psycopg2'):
@@ -53,12 +192,11 @@ def get_pgsession(passwd, dbapi='psycopg2'):
         Session instance
     '''
 
-    engine = create_engine('postgresql+{0:s}://smn_kvantekjemi_test_user:{1:s}@dbpg-hotel-utv.uio.no/smn_kvantekjemi_test'.format(dbapi, passwd))
-    db_session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-    return db_session()
+    engine = get_pgengine(passwd, dbapi=dbapi)
+    return _get_sessionmaker(engine)()
 
 
-def get_pgengine(passwd):
+def get_pgengine(passwd, dbapi='psycopg2'):
     '''
     Get the database engine from the postgresql
 
@@ -71,15 +209,29 @@ def get_pgengine(passwd):
         Database engine
     '''
 
-    engine = create_engine('postgresql+psycopg2://smn_kvantekjemi_test_user:{}@dbpg-hotel-utv.uio.no/smn_kvantekjemi_test'.format(passwd))
-    return engine
+    return get_cached_engine(PGURL.format(dbapi=dbapi, passwd=passwd))
+
 
+def get_engine(dbpath, echo=False, pragmas=None):
+    '''
+    Return the db engine for the sqlite3 database, engines are cached per
+    database path
+
+    Args:
+      dbpath : str
+        Path to the database file
+      echo : bool
+        Echo the SQL statements
+      pragmas : dict
+        SQLite pragmas to be set on connect, e.g. :py:data:`SQLITE_PRAGMAS`
+    '''
 
-def get_engine(dbpath):
-    '''Return the db engine'''
+    # absolute path since pooled connections can be opened after a chdir
+    if dbpath != ':memory:':
+        dbpath = os.path.abspath(dbpath)
 
-    engine = create_engine("sqlite:///{path:s}".format(path=dbpath), echo=False)
-    return engine
+    return get_cached_engine("sqlite:///{path:s}".format(path=dbpath),
+                             echo=echo, pragmas=pragmas)
 
 
 def get_table(tablename, dbpath, **kwargs):
@@ -100,7 +252,7 @@ def get_table(tablename, dbpath, **kwargs):
     '''
 
     tables = ['systems', 'calculators', 'asetemplates', 'jobs', 'atoms',
-              'vibrations', 'vibrationsets']
+              'atomarrays', 'vibrations', 'vibrationsets']
 
     if tablename in tables:
         engine = get_engine(dbpath)
@@ -132,6 +284,11 @@ def get_atoms(session, system_id):
     '''
     From a db row representing a system create ase.Atoms instance and return
 
+    Systems stored in the packed format (see
+    :py:class:`DBAtomArrays <asetools.db.model.DBAtomArrays>`) are decoded
+    from the array columns, otherwise the atoms are assembled from the
+    individual :py:class:`DBAtom <asetools.db.model.DBAtom>` rows.
+
     Args:
       session : session
         Session object instance
@@ -144,39 +301,240 @@ def get_atoms(session, system_id):
     '''
 
     q = session.query(System).get(system_id)
-    n = len(q.atoms)
 
-    xyz = np.hstack((
-        numpify(q.atoms, 'x').reshape(n, 1),
-        numpify(q.atoms, 'y').reshape(n, 1),
-        numpify(q.atoms, 'z').reshape(n, 1),
-    ))
+    if q.atomarrays is not None:
+        arrays = {name: q.atomarrays.get_array(name)
+                  for name in DBAtomArrays.layout.keys()}
+    else:
+        n = len(q.atoms)
+
+        arrays = {
+            'numbers': numpify(q.atoms, 'atomic_number'),
+            'positions': np.hstack((
+                numpify(q.atoms, 'x').reshape(n, 1),
+                numpify(q.atoms, 'y').reshape(n, 1),
+                numpify(q.atoms, 'z').reshape(n, 1),
+            )),
+            'momenta': np.hstack((
+                numpify(q.atoms, 'momentum_x').reshape(n, 1),
+                numpify(q.atoms, 'momentum_y').reshape(n, 1),
+                numpify(q.atoms, 'momentum_z').reshape(n, 1),
+            )),
+            'tags': numpify(q.atoms, 'tag'),
+            'masses': numpify(q.atoms, 'mass'),
+            'magmoms': numpify(q.atoms, 'magmom'),
+            'charges': numpify(q.atoms, 'charge'),
+        }
+
+    cellpar = [q.cell_a, q.cell_b, q.cell_c,
+               q.cell_alpha, q.cell_beta, q.cell_gamma]
+    pbc = [q.pbc_a, q.pbc_b, q.pbc_c]
+
+    return arrays2atoms(arrays, cellpar, pbc, name=q.name,
+                        topology=q.topology)
+
+
+def arrays2atoms(arrays, cellpar, pbc, name=None, topology=None):
+    '''
+    Create the ase.Atoms instance from a dictionary of per atom arrays and
+    the cell information stored with the system
+
+    Args:
+      arrays : dict
+        Dictionary with `numbers`, `positions`, `momenta`, `tags`,
+        `masses`, `magmoms` and `charges` arrays
+      cellpar : list
+        Cell parameters: a, b, c, alpha, beta, gamma
+      pbc : list
+        Periodic boundary conditions along the three cell vectors
+      name : str
+        Name of the system
+      topology : str
+        Three letter framework topology code
 
-    momenta = np.hstack((
-        numpify(q.atoms, 'momentum_x').reshape(n, 1),
-        numpify(q.atoms, 'momentum_y').reshape(n, 1),
-        numpify(q.atoms, 'momentum_z').reshape(n, 1),
-    ))
+    Returns:
+      atoms : ase.Atoms
+    '''
 
     atoms = Atoms(
-        numbers=numpify(q.atoms, 'atomic_number'),
-        positions=xyz,
-        momenta=momenta,
-        tags=numpify(q.atoms, 'tag'),
-        masses=numpify(q.atoms, 'mass'),
-        magmoms=numpify(q.atoms, 'magmom'),
-        charges=numpify(q.atoms, 'charge'),
+        numbers=arrays['numbers'],
+        positions=arrays['positions'],
+        momenta=arrays['momenta'],
+        tags=arrays['tags'],
+        masses=arrays['masses'],
+        magmoms=arrays['magmoms'],
+        charges=arrays['charges'],
     )
 
-    atoms.set_cell(cellpar_to_cell([q.cell_a, q.cell_b, q.cell_c,
-                                    q.cell_alpha, q.cell_beta, q.cell_gamma]))
-    atoms.set_pbc([q.pbc_a, q.pbc_b, q.pbc_c])
-    atoms.info['name'] = q.name
-    atoms.info['topology'] = q.topology
+    atoms.set_cell(cellpar_to_cell(cellpar))
+    atoms.set_pbc(pbc)
+    atoms.info['name'] = name
+    atoms.info['topology'] = topology
 
     return atoms
 
 
+def get_atoms_many(session, system_ids):
+    '''
+    Create ase.Atoms instances for many systems at once
+
+    Instead of loading each :py:class:`System <asetools.db.model.System>`
+    and its atoms through the ORM, the system and atom columns are fetched
+    with a couple of Core SELECTs per chunk of ids, the atom rows are
+    converted into NumPy arrays once and split per system.
+
+    Args:
+      session : session
+        Session object instance
+      system_ids : list of int
+        Identifiers of the rows from the systems table
+
+    Returns:
+      out : dict
+        Dictionary with system ids as keys and ase.Atoms as values, in the
+        order of `system_ids`, ids not found in the database are skipped
+    '''
+
+    systems = System.__table__
+    packed = DBAtomArrays.__table__
+    dbatoms = DBAtom.__table__
+
+    syscols = [systems.c.id, systems.c.name, systems.c.topology,
+               systems.c.cell_a, systems.c.cell_b, systems.c.cell_c,
+               systems.c.cell_alpha, systems.c.cell_beta, systems.c.cell_gamma,
+               systems.c.pbc_a, systems.c.pbc_b, systems.c.pbc_c]
+    arraycols = [packed.c.natoms] + [packed.c[n] for n in DBAtomArrays.layout]
+
+    atoms = {}
+    for chunk in chunks(system_ids, CHUNKSIZE):
+
+        sysrows = session.execute(
+            select(*(syscols + arraycols)).
+            select_from(systems.outerjoin(packed)).
+            where(systems.c.id.in_(chunk))).fetchall()
+
+        info = {}
+        unpacked = []
+        for row in sysrows:
+            info[row[0]] = row
+            if row.natoms is None:
+                unpacked.append(row[0])
+            else:
+                arrays = {name: DBAtomArrays.unpack(name, getattr(row, name),
+                                                    row.natoms)
+                          for name in DBAtomArrays.layout}
+                atoms[row[0]] = _row2atoms(row, arrays)
+
+        if not unpacked:
+            continue
+
+        rows = session.execute(
+            select(dbatoms.c.system_id,
+                   *[dbatoms.c[c] for c in ATOM_COLUMNS]).
+            where(dbatoms.c.system_id.in_(unpacked)).
+            order_by(dbatoms.c.system_id, dbatoms.c.id)).fetchall()
+
+        data = np.array(rows, dtype=float).reshape(len(rows),
+                                                   len(ATOM_COLUMNS) + 1)
+        ids = data[:, 0].astype(int)
+        bounds = np.flatnonzero(np.diff(ids)) + 1
+        starts = np.concatenate(([0], bounds)).astype(int)
+        stops = np.concatenate((bounds, [len(ids)])).astype(int)
+
+        for start, stop in zip(starts, stops):
+            block = data[start:stop]
+            arrays = {
+                'numbers': block[:, 1].astype(int),
+                'positions': block[:, 2:5],
+                'momenta': block[:, 5:8],
+                'tags': block[:, 8].astype(int),
+                'masses': block[:, 9],
+                'magmoms': block[:, 10],
+                'charges': block[:, 11],
+            }
+            sid = int(ids[start])
+            atoms[sid] = _row2atoms(info[sid], arrays)
+
+        # systems without any atoms
+        for sid in set(unpacked) - set(atoms.keys()):
+            atoms[sid] = _row2atoms(info[sid], None)
+
+    return {sid: atoms[sid] for sid in system_ids if sid in atoms}
+
+
+def jobs_by_name(session, systems, jobname, missing='raise', related=False):
+    '''
+    Return the jobs named `jobname` of many systems loaded with a single
+    query per chunk of systems instead of walking `System.jobs` of each
+    system
+
+    Args:
+      session : session
+        Session object instance
+      systems : list
+        List of :py:class:`System <asetools.db.model.System>` instances
+      jobname : str
+        Name of the job, referencing `Job.name`
+      missing : str
+        Either `raise` to raise `ValueError` when some of the systems have
+        no such job or `none` to return `None` for them
+      related : bool
+        Also load the templates and calculators (with their attributes) of
+        the jobs
+
+    Returns:
+      jobs : list
+        :py:class:`Job <asetools.db.model.Job>` instances in the order of
+        `systems`, the first (lowest id) job is taken if a system has more
+        than one job with the same name
+    '''
+
+    if missing not in ['raise', 'none']:
+        raise ValueError('missing should be "raise" or "none", '
+                         'got: {}'.format(missing))
+
+    if any(system.id is None for system in systems):
+        session.flush()
+
+    query = session.query(Job).filter(Job.name == jobname)
+    if related:
+        query = query.options(selectinload(Job.template),
+                              selectinload(Job.calculator).
+                              selectinload(DBCalculator.attributes))
+
+    found = {}
+    for chunk in chunks(set(system.id for system in systems), CHUNKSIZE):
+        for job in query.filter(Job.system_id.in_(chunk)).order_by(Job.id):
+            found.setdefault(job.system_id, job)
+
+    jobs = [found.get(system.id) for system in systems]
+
+    if missing == 'raise':
+        absent = [system.name for system, job in zip(systems, jobs)
+                  if job is None]
+        if absent:
+            raise ValueError('No job named "{0}" for systems: {1}'.format(
+                jobname, ', '.join(str(name) for name in absent)))
+
+    return jobs
+
+
+def _row2atoms(row, arrays):
+    'Build the ase.Atoms from the systems table `row` and atom `arrays`'
+
+    if arrays is None:
+        arrays = {'numbers': [], 'positions': np.zeros((0, 3)),
+                  'momenta': None, 'tags': None, 'masses': None,
+                  'magmoms': None, 'charges': None}
+
+    cellpar = [row.cell_a, row.cell_b, row.cell_c,
+               row.cell_alpha, row.cell_beta, row.cell_gamma]
+    pbc = [row.pbc_a, row.pbc_b, row.pbc_c]
+
+    return arrays2atoms(arrays, cellpar, pbc, name=row.name,
+                        topology=row.topology)
+
+
 def get_template(session, ids):
     'Return a template string based either on the id or name'
 
@@ -201,51 +559,221 @@ def atoms2db(atoms):
       dbatoms : :py:class:`DBAtom <asetools.db.model.DBAtom>`
     '''
 
-    dbatoms = []
+    return [DBAtom(**mapping) for mapping in atoms2mappings(atoms)]
 
-    inimagm = atoms.get_initial_magnetic_moments()
-    inichar = atoms.get_initial_charges()
-    if atoms.get_calculator() is not None:
-        try:
-            forces = atoms.get_forces()
-        except:
-            forces = [[None] * 3 for _ in range(len(atoms))]
+
+def atoms2mappings(atoms, system_id=None):
+    '''
+    Convert `ase.Atoms` object into a list of dictionaries with the values
+    of the :py:class:`DBAtom <asetools.db.model.DBAtom>` columns, one per
+    atom, suitable for a bulk (executemany) insert
+
+    The values are taken directly from the arrays of `atoms` instead of
+    going through the per atom ``ase.Atom`` proxy objects.
+
+    Args:
+      atoms : ase.Atoms
+        ASE atoms object
+      system_id : int
+        Identifier of the system the atoms belong to
+
+    Returns:
+      mappings : list of dict
+    '''
+
+    n = len(atoms)
+
+    positions = atoms.get_positions()
+    momenta = atoms.get_momenta()
+    forces = get_forces(atoms)
+    if forces is None:
+        forces = np.full((n, 3), None, dtype=object)
+
+    columns = {
+        'atomic_number': atoms.get_atomic_numbers(),
+        'mass': atoms.get_masses(),
+        'tag': atoms.get_tags(),
+        'x': positions[:, 0],
+        'y': positions[:, 1],
+        'z': positions[:, 2],
+        'force_x': forces[:, 0],
+        'force_y': forces[:, 1],
+        'force_z': forces[:, 2],
+        'momentum_x': momenta[:, 0],
+        'momentum_y': momenta[:, 1],
+        'momentum_z': momenta[:, 2],
+        'charge': atoms.get_initial_charges(),
+        'magmom': atoms.get_initial_magnetic_moments(),
+        'initial_magmom': atoms.get_initial_magnetic_moments(),
+        'initial_charge': atoms.get_initial_charges(),
+    }
+
+    # tolist converts numpy scalars into python types in one pass
+    names = list(columns.keys())
+    values = zip(*[columns[name].tolist() for name in names])
+
+    if system_id is None:
+        return [dict(zip(names, row)) for row in values]
     else:
-        forces = [[None] * 3 for _ in range(len(atoms))]
-
-    for atom, imagm, icharge, force in zip(atoms, inimagm, inichar, forces):
-
-        dbatoms.append(DBAtom(
-            atomic_number=int(atom.number),
-            mass=atom.mass,
-            tag=int(atom.tag),
-            x=atom.position[0],
-            y=atom.position[1],
-            z=atom.position[2],
-            force_x=force[0],
-            force_y=force[1],
-            force_z=force[2],
-            momentum_x=atom.momentum[0],
-            momentum_y=atom.momentum[1],
-            momentum_z=atom.momentum[2],
-            charge=atom.charge,
-            magmom=atom.magmom,
-            initial_magmom=imagm,
-            initial_charge=icharge,
-        ))
-
-    return dbatoms
+        names.append('system_id')
+        return [dict(zip(names, row + (system_id,))) for row in values]
+
+
+def bulk_insert_atoms(session, items):
+    '''
+    Insert the atoms of one or many systems into the atoms table with a
+    single executemany INSERT
+
+    Args:
+      session : session
+        Session object instance
+      items : list of tuples
+        List of ``(system_id, atoms)`` tuples
+
+    Returns:
+      n : int
+        Number of inserted rows
+    '''
+
+    mappings = []
+    for system_id, atoms in items:
+        mappings.extend(atoms2mappings(atoms, system_id=system_id))
+
+    if mappings:
+        session.execute(DBAtom.__table__.insert(), mappings)
+
+    return len(mappings)
+
+
+def add_systems(session, systems, atoms_list):
+    '''
+    Add :py:class:`System <asetools.db.model.System>` instances created with
+    ``atoms2system(..., bulk=True)`` to the session and insert the atoms of
+    all row-stored systems with a single bulk insert. Changes are flushed
+    but not committed.
+
+    Args:
+      session : session
+        Session object instance
+      systems : list
+        List of :py:class:`System <asetools.db.model.System>` instances
+      atoms_list : list
+        List of ase.Atoms instances corresponding to `systems`
+    '''
+
+    # systems with packed arrays or already attached atom rows are
+    # written by the flush
+    rowwise = [system.atomarrays is None and len(system.atoms) == 0
+               for system in systems]
+
+    session.add_all(systems)
+    session.flush()
+
+    bulk_insert_atoms(session, [(system.id, atoms) for system, atoms, rows
+                                in zip(systems, atoms_list, rowwise)
+                                if rows])
+
+
+def get_forces(atoms):
+    '''
+    Return the forces from the calculator attached to `atoms` or ``None``
+    if they are not available
+    '''
+
+    if atoms.get_calculator() is None:
+        return None
+    try:
+        return atoms.get_forces()
+    except:
+        return None
+
+
+def atoms2arrays(atoms):
+    '''
+    Convert `ase.Atoms` object into a
+    :py:class:`DBAtomArrays <asetools.db.model.DBAtomArrays>` instance
+    holding the packed per atom arrays
+
+    Args:
+      atoms : ase.Atoms
+        ASE atoms object
+
+    Returns:
+      arrays : :py:class:`DBAtomArrays <asetools.db.model.DBAtomArrays>`
+    '''
+
+    arrays = DBAtomArrays(natoms=len(atoms))
+    arrays.set_array('numbers', atoms.get_atomic_numbers())
+    arrays.set_array('positions', atoms.get_positions())
+    arrays.set_array('momenta', atoms.get_momenta())
+    arrays.set_array('forces', get_forces(atoms))
+    arrays.set_array('magmoms', atoms.get_initial_magnetic_moments())
+    arrays.set_array('charges', atoms.get_initial_charges())
+    arrays.set_array('tags', atoms.get_tags())
+    arrays.set_array('masses', atoms.get_masses())
+
+    return arrays
+
+
+def replace_atoms(session, systems, atoms_list, packed=None):
+    '''
+    Replace the atoms of existing systems. Row stored atoms of all the
+    `systems` are removed with a single DELETE and the new ones written with
+    a single bulk insert. Changes are not committed.
+
+    Args:
+      session : session
+        Session object instance
+      systems : list
+        List of persistent :py:class:`System <asetools.db.model.System>`
+        instances
+      atoms_list : list
+        List of ase.Atoms instances with the new atoms for `systems`
+      packed : bool
+        Store the atoms as packed arrays if `True` or as one row per atom if
+        `False`, by default the current storage of each system is kept
+    '''
+
+    dbatoms = DBAtom.__table__
+
+    items = []
+    for system, atoms in zip(systems, atoms_list):
+
+        if packed is None:
+            use_packed = system.atomarrays is not None
+        else:
+            use_packed = packed
+
+        if use_packed:
+            system.atomarrays = atoms2arrays(atoms)
+        else:
+            system.atomarrays = None
+            items.append((system.id, atoms))
+
+    for chunk in chunks([system.id for system in systems], CHUNKSIZE):
+        session.execute(dbatoms.delete().where(dbatoms.c.system_id.in_(chunk)))
+
+    bulk_insert_atoms(session, items)
+
+    for system in systems:
+        session.expire(system, ['atoms'])
 
 
 def atoms2system(atoms, name=None, topology=None, magnetic_moment=None,
                  notes=None, vibrations=None, vibname=None, atom_ids=None,
-                 realonly=False):
+                 realonly=False, packed=False, bulk=False):
     '''
     Instantiate a :py:class:`asetools.db.model.System` from `ase.Atoms`
     objects and additional parameters
-    '''
 
-    dbatoms = atoms2db(atoms)
+    If `packed` is ``True`` the atoms are stored as packed arrays in
+    :py:class:`DBAtomArrays <asetools.db.model.DBAtomArrays>` instead of one
+    :py:class:`DBAtom <asetools.db.model.DBAtom>` row per atom and the
+    vibrations as a packed array in `VibrationSet.energies`. If `bulk`
+    is ``True`` the :py:class:`DBAtom <asetools.db.model.DBAtom>` rows are
+    not attached to the system, they should be inserted afterwards with
+    :py:func:`add_systems <asetools.db.dbinterface.add_systems>`.
+    '''
 
     cellpar = cell_to_cellpar(atoms.get_cell())
     pbc = atoms.get_pbc()
@@ -263,9 +791,13 @@ def atoms2system(atoms, name=None, topology=None, magnetic_moment=None,
         pbc_a=bool(pbc[0]),
         pbc_b=bool(pbc[1]),
         pbc_c=bool(pbc[2]),
-        atoms=dbatoms,
         magnetic_moment=magnetic_moment)
 
+    if packed:
+        system.atomarrays = atoms2arrays(atoms)
+    elif not bulk:
+        system.atoms = atoms2db(atoms)
+
     # add the notes to the system instance
     if notes:
         for key, value in notes.items():
@@ -278,14 +810,14 @@ def atoms2system(atoms, name=None, topology=None, magnetic_moment=None,
     # add vibrations, if present
     if vibrations is not None:
         vibset = vibrations2db(vibrations, name=vibname, atom_ids=atom_ids,
-                               realonly=realonly)
+                               realonly=realonly, packed=packed)
         system.vibrationsets = [vibset]
 
     return system
 
 
 def vibrations2db(vibrations, name=None, atom_ids=None, system_id=None,
-                  realonly=False):
+                  realonly=False, packed=False):
     '''
     Instantiate the :py:class:` VibrationSet <asetools.db.model.VibrationSet>`
     from a numpy array containing vibrational energies or a numpy (.npy) file with
@@ -305,24 +837,33 @@ def vibrations2db(vibrations, name=None, atom_ids=None, system_id=None,
       realonly : bool
         If True only the real part of vibrational energies should be passed
         in vibrations
+      packed : bool
+        Store the energies as a single packed array in
+        `VibrationSet.energies` instead of one
+        :py:class:`Vibration <asetools.db.model.Vibration>` row per mode
 
     Returns:
       out : :py:class:`VibrationSet <asetools.db.model.VibrationSet>`
     '''
 
     if isinstance(vibrations, np.ndarray):
-        if vibrations.dtype == np.complex and not realonly:
-            viblist = [Vibration(energy_real=r, energy_imag=i) for (r, i) in zip(vibrations.real, vibrations.imag)]
-        elif realonly:
-            viblist = [Vibration(energy_real=r, energy_imag=i) for (r, i) in zip(vibrations, np.zeros_like(vibrations))]
+        if realonly:
+            array = np.real(vibrations).astype(np.complex128)
+        else:
+            array = vibrations.astype(np.complex128)
     elif isinstance(vibrations, str):
-        array = np.load(vibrations)
-        viblist = [Vibration(energy_real=r, energy_imag=i) for (r, i) in zip(array.real, array.imag)]
+        array = np.load(vibrations).astype(np.complex128)
     else:
         raise ValueError('<vibrations> should be either <str> or <numpy.ndarray> type, got: {}'.format(type(vibrations)))
 
     vibset = VibrationSet(name=name, atom_ids=atom_ids, system_id=system_id)
-    vibset.vibrations = viblist
+
+    if packed:
+        vibset.energies = VibrationSet.pack(array)
+    else:
+        vibset.vibrations = [Vibration(energy_real=r, energy_imag=i)
+                             for r, i in zip(array.real.tolist(),
+                                             array.imag.tolist())]
 
     return vibset
 
@@ -396,7 +937,8 @@ def hasattribute(obj, name, default=None):
     return out
 
 
-def from_traj(session, traj, name, topology, notes, calcid=None, tempid=None):
+def from_traj(session, traj, name, topology, notes, calcid=None, tempid=None,
+              packed=False):
     '''
     Extract the relevant data from the trajectory file and add them as a row
     to the systems table in the database
@@ -416,35 +958,232 @@ def from_traj(session, traj, name, topology, notes, calcid=None, tempid=None):
         Calcualtor id from the db
       tempid : int
         DBTemplate id from the db
+      packed : bool
+        Store the atoms as packed arrays instead of one row per atom
     '''
 
     atoms = ase.io.read(traj)
-    system = atoms2system(atoms, name=name, topology=topology, notes=notes)
+    system = atoms2system(atoms, name=name, topology=topology, notes=notes,
+                          packed=packed, bulk=True)
 
     if calcid:
         system.calculator = session.query(DBCalculator).get(calcid)
     if tempid:
         system.template = session.query(DBTemplate).get(tempid)
 
-    session.add(system)
+    add_systems(session, [system], [atoms])
     session.commit()
 
 
+def read_manifest(fname):
+    '''
+    Read the manifest file with the trajectories to be added to the
+    database. Each non empty line, not starting with ``#``, should contain
+    the path to the trajectory optionally followed by the name and the
+    topology of the system, separated by whitespace.
+
+    Args:
+      fname : str
+        Name of the manifest file
+
+    Returns:
+      items : list of tuples
+        List of ``(path, name, topology)`` tuples, missing values are
+        ``None``
+    '''
+
+    items = []
+    with open(fname, 'r') as fman:
+        for line in fman:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            fields = line.split()
+            fields += [None] * (3 - len(fields))
+            items.append(tuple(fields[:3]))
+    return items
+
+
+def read_checkpoint(fname):
+    'Return the set of trajectory paths recorded in the checkpoint file'
+
+    if fname is None or not os.path.exists(fname):
+        return set()
+
+    with open(fname, 'r') as fchk:
+        return set(line.rstrip('\n') for line in fchk if line.strip())
+
+
+def _read_traj(path):
+    '''
+    Read the last image from the trajectory `path`, used in the worker
+    processes, errors are returned instead of raised
+    '''
+
+    try:
+        return path, ase.io.read(path), None
+    except Exception as exc:
+        return path, None, '{0}: {1}'.format(exc.__class__.__name__, exc)
+
+
+def from_trajs(session, items, topology=None, notes=None, packed=False,
+               workers=1, batch_size=100, checkpoint=None, verbose=True):
+    '''
+    Add systems from many trajectory files to the database
+
+    The trajectories are parsed in a pool of `workers` processes and the
+    results are written by the calling process, committing every
+    `batch_size` systems. At most ``2 * workers`` trajectories are parsed
+    ahead of the writer. Paths of the committed trajectories are appended
+    to the `checkpoint` file and skipped when the import is restarted with
+    the same checkpoint.
+
+    Args:
+      session : session
+        Database connection
+      items : list of tuples
+        List of ``(path, name, topology)`` tuples, if name is ``None`` the
+        file name without the extension is used, if topology is ``None``
+        the `topology` argument is used
+      topology : str
+        Default three letter framework topology code
+      notes : dict
+        Additional properties to be stored with every system (as dict)
+      packed : bool
+        Store the atoms as packed arrays instead of one row per atom
+      workers : int
+        Number of processes used to parse the trajectories
+      batch_size : int
+        Number of systems added per commit
+      checkpoint : str
+        Name of the file recording the paths of committed trajectories
+      verbose : bool
+        Print progress information
+
+    Returns:
+      failed : dict
+        Paths of the trajectories that could not be read as keys with the
+        error messages as values
+    '''
+
+    done = read_checkpoint(checkpoint)
+    todo = [item for item in items if item[0] not in done]
+    meta = {item[0]: item for item in todo}
+    paths = [item[0] for item in todo]
+
+    if verbose and done:
+        print('skipping {0:d} trajectories found in checkpoint: {1}'.format(
+            len(items) - len(todo), checkpoint))
+
+    failed = {}
+    batch = []
+    nadded = 0
+    start = time.time()
+
+    def flush():
+        'Write the current batch to the database and the checkpoint'
+
+        add_systems(session, [system for system, _, _ in batch],
+                    [atoms for _, atoms, _ in batch])
+        session.commit()
+        if checkpoint is not None:
+            with open(checkpoint, 'a') as fchk:
+                for _, _, path in batch:
+                    fchk.write(path + '\n')
+        if verbose:
+            elapsed = time.time() - start
+            print('added {0:d}/{1:d} systems ({2:.1f} systems/s)'.format(
+                nadded, len(todo), nadded / elapsed if elapsed > 0 else 0.0))
+        del batch[:]
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = _bounded_map(executor, _read_traj, paths, 2 * workers)
+    else:
+        executor = None
+        results = map(_read_traj, paths)
+
+    try:
+        for path, atoms, error in results:
+
+            if atoms is None:
+                failed[path] = error
+                if verbose:
+                    print('failed to read {0}: {1}'.format(path, error))
+                continue
+
+            _, name, topo = meta[path]
+            if name is None:
+                name = os.path.splitext(os.path.basename(path))[0]
+            if topo is None:
+                topo = topology
+
+            system = atoms2system(atoms, name=name, topology=topo,
+                                  notes=notes, packed=packed, bulk=True)
+            batch.append((system, atoms, path))
+            nadded += 1
+
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return failed
+
+
+def _bounded_map(executor, func, items, window):
+    '''
+    Yield ``func(item)`` for the `items` in order with at most `window`
+    calls submitted to the `executor` at a time, a new call is submitted
+    only when a result is consumed
+    '''
+
+    items = iter(items)
+    futures = deque(executor.submit(func, item)
+                    for item in islice(items, window))
+    while futures:
+        result = futures.popleft().result()
+        for item in islice(items, 1):
+            futures.append(executor.submit(func, item))
+        yield result
+
+
 def add_system():
     '''
-    Add a system to a SQLite3 database from a parsed trajectory file.
+    Add systems to a SQLite3 database from parsed trajectory files.
+
+    A single trajectory is added as before, many trajectories (files, glob
+    patterns or a manifest file) are parsed in parallel and committed in
+    batches, see :py:func:`from_trajs <asetools.db.dbinterface.from_trajs>`.
     '''
 
     parser = argparse.ArgumentParser()
 
     parser.add_argument('db', help='database file')
-    parser.add_argument('traj', help='trajectory file')
+    parser.add_argument('traj', nargs='*',
+                        help='trajectory file(s) or glob pattern(s)')
+    parser.add_argument('-m', '--manifest',
+                        help='file with lines: path [name [topology]]')
     parser.add_argument('-n', '--name', help='name of the system')
     parser.add_argument('-t', '--topology', help='framework topology code')
-    parser.add_argument('-c', '--calcid', help='calculator id')
-    parser.add_argument('-a', '--tempid', help='ase template id')
+    parser.add_argument('-c', '--calcid', type=int, help='calculator id')
+    parser.add_argument('-a', '--tempid', type=int, help='ase template id')
     parser.add_argument('--notes', help='additional system info',
                         default=dict())
+    parser.add_argument('--packed', action='store_true',
+                        help='store the atoms as packed arrays')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes parsing the trajectories')
+    parser.add_argument('-b', '--batch-size', type=int, default=100,
+                        help='number of systems added per commit')
+    parser.add_argument('--checkpoint',
+                        help='file recording added trajectories, used to resume')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not report progress')
 
     args = parser.parse_args()
 
@@ -453,12 +1192,38 @@ def add_system():
     else:
         raise ValueError('db does not exist : ', args.db)
 
-    if not os.path.exists(args.traj):
-        raise ValueError('traj does not exist : ', args.traj)
-
     if args.notes:
         args.notes = json.loads(args.notes)
 
-    from_traj(session=session, traj=args.traj, name=args.name,
-              topology=args.topology, notes=args.notes,
-              calcid=args.calcid, tempid=args.calcid)
+    items = []
+    for pattern in args.traj:
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            raise ValueError('traj does not exist : ', pattern)
+        items.extend((path, None, None) for path in paths)
+    if args.manifest:
+        items.extend(read_manifest(args.manifest))
+
+    if not items:
+        parser.error('no trajectories specified')
+
+    if len(items) == 1 and not args.manifest:
+        from_traj(session=session, traj=items[0][0], name=args.name,
+                  topology=args.topology, notes=args.notes,
+                  calcid=args.calcid, tempid=args.tempid, packed=args.packed)
+        return
+
+    if args.name:
+        parser.error('--name can only be used with a single trajectory')
+    if args.calcid is not None or args.tempid is not None:
+        parser.error('--calcid and --tempid can only be used with a single '
+                     'trajectory')
+
+    failed = from_trajs(session, items, topology=args.topology,
+                        notes=args.notes, packed=args.packed,
+                        workers=args.jobs, batch_size=args.batch_size,
+                        checkpoint=args.checkpoint, verbose=not args.quiet)
+
+    if failed:
+        print('{0:d} trajectories could not be read'.format(len(failed)))
+        sys.exit(1)
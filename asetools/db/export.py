@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+'''
+Streaming export of the database tables to Parquet or Arrow IPC files.
+
+The rows are read in chunks through a server side cursor and written as
+record batches, so tables of any size (including the atoms table) can be
+exported without materializing them in memory. Requires pyarrow_.
+
+.. _pyarrow: https://arrow.apache.org/docs/python/
+'''
+
+import argparse
+import datetime
+import os
+
+from sqlalchemy import (select, Integer, Float, Boolean, DateTime,
+                        LargeBinary)
+
+from .model import Base
+from .dbinterface import get_cached_engine
+
+
+def _import_pyarrow():
+    'Import pyarrow with a helpful message if it is not installed'
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('export requires pyarrow, install it with: '
+                          'pip install pyarrow')
+    return pyarrow
+
+
+def arrow_type(coltype):
+    'Return the pyarrow type corresponding to the sqlalchemy column type'
+
+    pa = _import_pyarrow()
+
+    if isinstance(coltype, Boolean):
+        return pa.bool_()
+    elif isinstance(coltype, Integer):
+        return pa.int64()
+    elif isinstance(coltype, Float):
+        return pa.float64()
+    elif isinstance(coltype, DateTime):
+        return pa.timestamp('us')
+    elif isinstance(coltype, LargeBinary):
+        return pa.binary()
+    else:
+        return pa.string()
+
+
+def build_query(tablename, columns=None, topology=None, formula=None,
+                since=None, until=None, datecol='mtime'):
+    '''
+    Return the select statement for the table with column projection and
+    filters on the systems the rows belong to
+
+    Args:
+      tablename : str
+        Name of the table
+      columns : list of str
+        Columns to export, all by default
+      topology : str
+        Select only systems with this topology
+      formula : str
+        Select only systems with this chemical formula
+      since : datetime.datetime
+        Select only systems with `datecol` later or equal
+      until : datetime.datetime
+        Select only systems with `datecol` earlier
+      datecol : str
+        Systems column used for the date range, `ctime` or `mtime`
+    '''
+
+    if tablename not in Base.metadata.tables:
+        raise ValueError('Table should be one of: {}'.format(
+            ", ".join(sorted(Base.metadata.tables.keys()))))
+
+    table = Base.metadata.tables[tablename]
+    systems = Base.metadata.tables['systems']
+
+    if columns is None:
+        cols = list(table.columns)
+    else:
+        missing = set(columns) - set(table.columns.keys())
+        if missing:
+            raise ValueError('Unknown columns in {0}: {1}'.format(
+                tablename, ", ".join(sorted(missing))))
+        cols = [table.c[c] for c in columns]
+
+    conditions = []
+    if topology is not None:
+        conditions.append(systems.c.topology == topology)
+    if formula is not None:
+        conditions.append(systems.c.formula == formula)
+    if since is not None:
+        conditions.append(systems.c[datecol] >= since)
+    if until is not None:
+        conditions.append(systems.c[datecol] < until)
+
+    query = select(*cols)
+
+    if conditions:
+        if tablename == 'systems':
+            query = query.where(*conditions)
+        else:
+            sysids = select(systems.c.id).where(*conditions)
+            if 'system_id' in table.c:
+                query = query.where(table.c.system_id.in_(sysids))
+            elif tablename == 'vibrations':
+                vibsets = Base.metadata.tables['vibrationsets']
+                setids = select(vibsets.c.id).\
+                    where(vibsets.c.system_id.in_(sysids))
+                query = query.where(table.c.vibrationset_id.in_(setids))
+            else:
+                raise ValueError('Table {0} cannot be filtered by system '
+                                 'attributes'.format(tablename))
+
+    # stable order, makes the chunks reproducible
+    query = query.order_by(*table.primary_key.columns)
+
+    return query, cols
+
+
+def iter_batches(engine, query, cols, chunksize=50000):
+    '''
+    Execute the `query` with a server side cursor and yield
+    `pyarrow.RecordBatch` instances with at most `chunksize` rows
+    '''
+
+    pa = _import_pyarrow()
+
+    schema = pa.schema([(c.name, arrow_type(c.type)) for c in cols])
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.fetchmany(chunksize)
+            if not rows:
+                break
+            arrays = [pa.array([row[i] for row in rows], type=field.type)
+                      for i, field in enumerate(schema)]
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _write_parquet_partitioned(table, output, partition_on, part):
+    'Write `table` as hive style partitions of the `partition_on` column'
+
+    pa = _import_pyarrow()
+    import pyarrow.compute as pc
+
+    values = table.column(partition_on)
+    rest = table.drop([partition_on])
+    for value in pc.unique(values).to_pylist():
+        if value is None:
+            mask = pc.is_null(values)
+        else:
+            mask = pc.equal(values, pa.scalar(value, type=values.type))
+        path = os.path.join(output, '{0}={1}'.format(partition_on, value))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        pa.parquet.write_table(rest.filter(mask),
+                               os.path.join(path, 'part-{0:05d}.parquet'.format(part)))
+
+
+def export_table(engine, tablename, output, fmt='parquet', columns=None,
+                 topology=None, formula=None, since=None, until=None,
+                 datecol='mtime', chunksize=50000, partition_on=None,
+                 verbose=False):
+    '''
+    Export a table from the database to Parquet files or an Arrow IPC file
+    reading it in chunks
+
+    Args:
+      engine :
+        Database engine
+      tablename : str
+        Name of the table
+      output : str
+        For `parquet` the directory where the ``part-*.parquet`` files are
+        written, for `arrow` the name of the IPC file
+      fmt : str
+        Output format, `parquet` or `arrow`
+      columns : list of str
+        Columns to export, all by default
+      topology : str
+        Export only rows of systems with this topology
+      formula : str
+        Export only rows of systems with this chemical formula
+      since : datetime.datetime
+        Export only rows of systems with `datecol` later or equal
+      until : datetime.datetime
+        Export only rows of systems with `datecol` earlier
+      datecol : str
+        Systems column used for the date range, `ctime` or `mtime`
+      chunksize : int
+        Number of rows read and written at a time
+      partition_on : str
+        Column used for hive style partitioning of the parquet output
+      verbose : bool
+        Print progress information
+
+    Returns:
+      nrows : int
+        Number of exported rows
+    '''
+
+    pa = _import_pyarrow()
+
+    if fmt not in ['parquet', 'arrow']:
+        raise ValueError('fmt should be "parquet" or "arrow", got: {}'.format(fmt))
+    if partition_on is not None and fmt != 'parquet':
+        raise ValueError('partitioning is only supported for parquet')
+
+    query, cols = build_query(tablename, columns=columns, topology=topology,
+                              formula=formula, since=since, until=until,
+                              datecol=datecol)
+
+    if partition_on is not None and partition_on not in [c.name for c in cols]:
+        raise ValueError('partition column {} is not exported'.format(partition_on))
+
+    nrows = 0
+    writer = None
+    try:
+        for part, batch in enumerate(iter_batches(engine, query, cols,
+                                                  chunksize=chunksize)):
+            if fmt == 'arrow':
+                if writer is None:
+                    writer = pa.ipc.new_file(output, batch.schema)
+                writer.write_batch(batch)
+            else:
+                if not os.path.exists(output):
+                    os.makedirs(output)
+                table = pa.Table.from_batches([batch])
+                if partition_on is None:
+                    pa.parquet.write_table(table, os.path.join(
+                        output, 'part-{0:05d}.parquet'.format(part)))
+                else:
+                    _write_parquet_partitioned(table, output, partition_on,
+                                               part)
+            nrows += batch.num_rows
+            if verbose:
+                print('exported {0:d} rows from {1}'.format(nrows, tablename))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return nrows
+
+
+def parse_date(value):
+    'Parse the date given as YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS'
+
+    for fmt in ['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S']:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('Date must be YYYY-MM-DD[THH:MM:SS]')
+
+
+def main():
+    '''
+    Export a table from the database to Parquet or Arrow IPC files
+    '''
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('db', help='sqlite database file or a database URL')
+    parser.add_argument('table', help='name of the table to export')
+    parser.add_argument('output',
+                        help='output directory (parquet) or file (arrow)')
+    parser.add_argument('-f', '--format', default='parquet',
+                        choices=['parquet', 'arrow'])
+    parser.add_argument('-c', '--columns',
+                        help='comma separated list of columns to export')
+    parser.add_argument('-t', '--topology', help='framework topology code')
+    parser.add_argument('--formula', help='chemical formula')
+    parser.add_argument('--since', type=parse_date,
+                        help='systems modified since the date')
+    parser.add_argument('--until', type=parse_date,
+                        help='systems modified before the date')
+    parser.add_argument('--datecol', default='mtime',
+                        choices=['ctime', 'mtime'])
+    parser.add_argument('--chunksize', type=int, default=50000)
+    parser.add_argument('-p', '--partition-on',
+                        help='column used to partition the parquet output')
+    args = parser.parse_args()
+
+    if '://' in args.db:
+        url = args.db
+    elif os.path.exists(args.db):
+        url = 'sqlite:///{0:s}'.format(os.path.abspath(args.db))
+    else:
+        raise ValueError('db does not exist : ', args.db)
+
+    columns = args.columns.split(',') if args.columns else None
+
+    nrows = export_table(get_cached_engine(url), args.table, args.output,
+                         fmt=args.format, columns=columns,
+                         topology=args.topology, formula=args.formula,
+                         since=args.since, until=args.until,
+                         datecol=args.datecol, chunksize=args.chunksize,
+                         partition_on=args.partition_on, verbose=True)
+    print('wrote {0:d} rows to {1}'.format(nrows, args.output))
@@ -2,35 +2,325 @@
 
 '''A module with methods for managing jobs through a database'''
 
+import datetime
 import os
 import pickle
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import logging
 
+import numpy as np
+
 import ase.io
 from ase.geometry import cell_to_cellpar
 from ase.thermochemistry import HarmonicThermo, IdealGasThermo
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import selectinload
 
-from ..asetools import AseTemplate
-from ..submit import main as sub
-from .model import Job, System, VibrationSet
-from .dbinterface import vibrations2db, atoms2db, get_atoms
-from .utils import sanitizestr
+from ..asetools import AseTemplate, get_config
+from .. import thermochemistry as thc
+from ..scheduler import query_states
+from ..submit import main as sub, submit_array
+from .model import (Job, System, ThermoData, VibrationSet, plan_job_dir,
+                    stage_job_dir, swap_job_dir)
+from .cache import AtomsCache
+from .dbinterface import (CHUNKSIZE, jobs_by_name, vibrations2db,
+                          replace_atoms)
+from .utils import chunks, file_digest, sanitizestr
 
 
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+# job statuses followed by sync_status
+TRACKED_STATES = ('submitted', 'queued', 'running', 'suspended')
+
+
+def set_geometry(system, atoms):
+    '''
+    Set the cell, formula, energy and magnetization of the `system` from the
+    `atoms` read from a job output
+    '''
+
+    cellpar = cell_to_cellpar(atoms.get_cell())
+    pbc = atoms.get_pbc()
+    system.cell_a = cellpar[0]
+    system.cell_b = cellpar[1]
+    system.cell_c = cellpar[2]
+    system.cell_alpha = cellpar[3]
+    system.cell_beta = cellpar[4]
+    system.cell_gamma = cellpar[5]
+    system.pbc_a = bool(pbc[0])
+    system.pbc_b = bool(pbc[1])
+    system.pbc_c = bool(pbc[2])
+    system.formula = atoms.get_chemical_formula()
+    system.energy = atoms.get_potential_energy()
+    system.absolute_magnetization = atoms.get_absolute_magnetization()
+    system.total_magnetization = atoms.get_total_magnetization()
+
+
+def stat_output(path):
+    'Return the size and modification time of `path` or `None` if missing'
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+
+def read_output(paths):
+    '''
+    Read the trajectory and the input script of a job, used in the worker
+    processes of :py:meth:`JobManager.harvest_geoms`, errors are returned
+    instead of raised
+
+    Args:
+        paths : tuple
+            Paths to the output trajectory and to the input script
+
+    Returns:
+        out : tuple
+            Output path, atoms, input script and error message
+    '''
+
+    outpath, inppath = paths
+    try:
+        atoms = ase.io.read(outpath, format='traj')
+        with open(inppath, 'r') as finp:
+            jobscript = finp.read()
+    except Exception as exc:
+        return outpath, None, None, '{0}: {1}'.format(exc.__class__.__name__,
+                                                      exc)
+    return outpath, atoms, jobscript, None
+
+
+def stage_input(task):
+    '''
+    Stage the directory of a single job, used in the worker threads of
+    :py:meth:`JobManager.write_jobs` and :py:meth:`JobManager.write_vibs`,
+    errors are returned instead of raised
+
+    Args:
+        task : tuple
+            Job directory and the dictionary with the file contents, see
+            :py:func:`stage_job_dir <asetools.db.model.stage_job_dir>`
+
+    Returns:
+        out : tuple
+            Path of the staged directory and error message
+    '''
+
+    path, files = task
+    try:
+        staged = stage_job_dir(path, files)
+    except Exception as exc:
+        return None, '{0}: {1}'.format(exc.__class__.__name__, exc)
+    return staged, None
+
+
+def filter_outputs(systems, jobs, stats, report, force=False):
+    '''
+    Return the ``(system, job, stat, None)`` candidates for harvesting whose
+    output `stats` (see :py:func:`stat_output`) differ from the stamps
+    stored in the jobs, the missing and unchanged ones are added to the
+    `report`
+    '''
+
+    candidates = []
+    for system, job, stat in zip(systems, jobs, stats):
+        if stat is None:
+            report['missing'].append(system.name)
+        elif not force and (job.outsize, job.outmtime) == stat:
+            report['unchanged'].append(system.name)
+        else:
+            candidates.append((system, job, stat, None))
+    return candidates
+
+
+def filter_digests(candidates, digests, report, force=False):
+    '''
+    Drop the `candidates` whose output digests equal the stored ones, their
+    new size and modification time are recorded and they are added to the
+    `report` as unchanged
+    '''
+
+    changed = []
+    for (system, job, stat, _), digest in zip(candidates, digests):
+        if not force and job.outhash == digest:
+            job.outsize, job.outmtime = stat
+            report['unchanged'].append(system.name)
+        else:
+            changed.append((system, job, stat, digest))
+    return changed
+
+
+def job_files(job, text, files=None):
+    'Return the contents of the directory of `job` with the input `text`'
+
+    contents = {job.inpname: text}
+    if files is not None:
+        contents.update(files)
+    return contents
+
 
 class JobManager(object):
-    ''' database oriented job manager '''
+    '''
+    Database oriented job manager
+
+    Args:
+        session : session
+            Session object instance
+        cachesize : int
+            Maximal number of Atoms kept in the
+            :py:class:`AtomsCache <asetools.db.cache.AtomsCache>`
+        cachedir : str
+            Directory for the on-disk Atoms cache, disabled if `None`
+    '''
 
-    def __init__(self, session):
+    def __init__(self, session, cachesize=256, cachedir=None):
 
         self.session = session
+        self.atoms_cache = AtomsCache(session, maxsize=cachesize,
+                                      cachedir=cachedir)
+        # compiled templates keyed on the DBTemplate id
+        self._templates = {}
+
+    def get_template(self, dbtemplate):
+        '''
+        Return the :py:class:`CompiledTemplate <asetools.asetools.CompiledTemplate>`
+        of a `DBTemplate`, parsed once per template id and parsed again only
+        when the template text changes
+
+        Args:
+            dbtemplate : DBTemplate
+                :py:class:`DBTemplate <asetools.db.model.DBTemplate>` instance
+        '''
+
+        text = dbtemplate.template
+        cached = self._templates.get(dbtemplate.id)
+        if cached is None or cached[0] != text:
+            cached = (text, AseTemplate(text).compile())
+            if dbtemplate.id is not None:
+                self._templates[dbtemplate.id] = cached
+        return cached[1]
+
+    def _render_input(self, system, job, subs):
+        '''
+        Render the input of the `job` with the values from its calculator
+        updated with `subs`, return the text (`None` if any template key has
+        no value) and the set of keys without values
+        '''
+
+        template = self.get_template(job.template)
+
+        # create a dictionary with replacements for the template by getting
+        # the matching values from the calculator attributes based on keys
+        # from the template
+        attributes = job.calculator.attributes
+        subs2render = {k: job.calculator[k] for k in template.named
+                       if k in attributes}
+
+        # update the values with the ones supplied by the user
+        if subs is not None:
+            subs2render.update(subs)
+
+        # check if all the template keys have values before rendering the
+        # tempate
+        missing = set(template.named) - set(subs2render.keys())
+        if missing:
+            print('Not writing input for {0}, missing values for: {1}'.format(
+                system.name, str(missing)))
+            return None, missing
+
+        return template.render(subs2render), missing
+
+    def _write_inputs(self, tasks, errors, workers, overwrite=False,
+                      dry_run=False):
+        '''
+        Write the job directories described by `tasks`, a list of
+        ``(system, path, files)`` tuples, and add the errors to `errors`
+
+        All the directories are first staged over a pool of `workers`
+        threads and only then swapped in place, so an interrupted call
+        leaves the existing directories untouched. With `dry_run` the
+        plans (see :py:func:`plan_job_dir <asetools.db.model.plan_job_dir>`)
+        are returned instead with the system names as keys.
+        '''
+
+        def run(func, items):
+            if workers > 1 and len(items) > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    return list(pool.map(func, items))
+            return [func(item) for item in items]
+
+        if dry_run:
+            plans = run(lambda t: plan_job_dir(t[1], t[2], overwrite), tasks)
+            return {t[0].name: plan for t, plan in zip(tasks, plans)}
+
+        todo = []
+        for task in tasks:
+            if not overwrite and os.path.exists(task[1]):
+                errors[task[0].name] = 'OSError: path: {} exists'.format(task[1])
+            else:
+                todo.append(task)
+
+        staged = run(stage_input, [(path, files) for _, path, files in todo])
+
+        written = []
+        for (system, path, _), (stage, error) in zip(todo, staged):
+            if error is None:
+                try:
+                    swap_job_dir(stage, path, overwrite=overwrite)
+                except OSError as exc:
+                    error = '{0}: {1}'.format(exc.__class__.__name__, exc)
+            if error is None:
+                written.append(system)
+                log.info('wrote job directory {}'.format(path))
+            else:
+                errors[system.name] = error
+                log.warning('failed to write {0}: {1}'.format(path, error))
+
+        return written
+
+    def _get_vibsets(self, systems, vibsetname, missing='raise'):
+        '''
+        Return a dictionary mapping system ids to their vibration sets named
+        `vibsetname` loaded with a single query per chunk of systems
+        '''
+
+        if missing not in ['raise', 'none']:
+            raise ValueError('missing should be "raise" or "none", '
+                             'got: {}'.format(missing))
+
+        vibsets = {}
+        ids = list(set(system.id for system in systems))
+        for chunk in chunks(ids, CHUNKSIZE):
+            query = self.session.query(VibrationSet).\
+                options(selectinload(VibrationSet.vibrations)).\
+                filter(VibrationSet.name == vibsetname).\
+                filter(VibrationSet.system_id.in_(chunk))
+            for vibset in query:
+                if vibset.system_id in vibsets:
+                    raise ValueError('Multiple vibration sets "{0}" for system '
+                                     'id={1}'.format(vibsetname,
+                                                     vibset.system_id))
+                vibsets[vibset.system_id] = vibset
+
+        lacking = [system.name for system in systems
+                   if system.id not in vibsets]
+        if lacking:
+            msg = 'No vibration set "{0}" for {1:d} system(s): {2}'.format(
+                vibsetname, len(lacking), ', '.join(str(n) for n in lacking))
+            if missing == 'raise':
+                raise ValueError(msg)
+            log.warning(msg)
+
+        return vibsets
 
     def get_thermo(self, systems, thermo='Harmonic', vibsetname='PHVA',
-                   **kwargs):
+                   missing='raise', **kwargs):
         '''
         For a list of specified :py:class:`System <asetools.db.model.System>`
         intances create and return a corresponding list of thermochemistry
@@ -38,6 +328,10 @@ class JobManager(object):
         :py:class:`System <asetools.db.model.System>`, vibrations in
         :py:class:`VibrationSet <asetools.db.model.VibrationSet>` and thermo type.
 
+        The vibration sets of all the systems are loaded with a single query
+        per chunk of systems (together with their vibrations) instead of one
+        query per system.
+
         Args:
             systems : list
                 List of :py:class:`System <asetools.db.model.System>` instances
@@ -45,23 +339,45 @@ class JobManager(object):
                 Name of the thermochemical model to use, `Harmonic` or `IdealGas`
             vibsetname : str
                 Name of the vibration set to select
+            missing : str
+                What to do with systems without the `vibsetname` vibration
+                set: `raise` a `ValueError` listing them or log a warning and
+                put `None` in their place for `none`
+            kwargs :
+                Passed to `IdealGasThermo`, `geometry` is required for
+                `IdealGas`
+
+        Returns:
+            out : list
+                Thermochemistry instances in the order of `systems`
         '''
 
+        if thermo not in ['Harmonic', 'IdealGas']:
+            raise ValueError('Unknown thermo: {}'.format(thermo))
+
+        vibsets = self._get_vibsets(systems, vibsetname, missing)
+
+        found = [system for system in systems if system.id in vibsets]
+
+        if thermo == 'IdealGas':
+            geometry = kwargs.pop('geometry')
+            atoms_list = self.atoms_cache.get_many(found)
+
         out = []
+        i = 0
         for system in systems:
-            energy = system.energy
-            vibset = self.session.query(VibrationSet).\
-                filter(VibrationSet.name == vibsetname).\
-                filter(VibrationSet.system_id == system.id).one()
-            vibenergies = vibset.vibenergies
+            if system.id not in vibsets:
+                out.append(None)
+                continue
 
+            vibenergies = vibsets[system.id].vibenergies
             if thermo == 'Harmonic':
-                out.append(HarmonicThermo(vibenergies, energy))
+                out.append(HarmonicThermo(vibenergies, system.energy))
             elif thermo == 'IdealGas':
-                atoms = get_atoms(self.session, system.id)
-                out.append(IdealGasThermo(vibenergies, kwargs.pop('geometry'),
-                                          potentialenergy=energy, atoms=atoms,
-                                          **kwargs))
+                out.append(IdealGasThermo(vibenergies, geometry,
+                                          potentialenergy=system.energy,
+                                          atoms=atoms_list[i], **kwargs))
+            i += 1
 
         return out
 
@@ -173,12 +489,12 @@ class JobManager(object):
                  'magmoms': magmoms,
                  'fmax': fmax}
 
-        self.write_jobs([tst], 'neb', subs=[repls], commit=commit)
+        self.write_jobs([tst], 'neb', subs=repls, commit=commit)
 
         # write initial and final structures into the working directory of the job
-        nebjob = next(j for j in tst.jobs if j.name == 'neb')
-        for struct, name in zip([initial, final], ['initial.traj', 'final.traj']):
-            atoms = get_atoms(self.session, struct.id)
+        nebjob = tst.get_job('neb')
+        structs = self.atoms_cache.get_many([initial, final])
+        for atoms, name in zip(structs, ['initial.traj', 'final.traj']):
             ase.io.write(os.path.join(nebjob.abspath, name), atoms)
 
     def insert_vibs(self, systems, relaxname='relax', calc_id=1, temp_id=8,
@@ -208,8 +524,9 @@ class JobManager(object):
                 Flag to mark whether to commit changes or not
         '''
 
-        for system in systems:
-            relaxjob = next(j for j in system.jobs if j.name == relaxname)
+        relaxjobs = jobs_by_name(self.session, systems, relaxname)
+
+        for system, relaxjob in zip(systems, relaxjobs):
 
             sanitized = sanitizestr(vibname)
 
@@ -233,7 +550,8 @@ class JobManager(object):
         else:
             self.session.rollback()
 
-    def submit_jobs(self, systems, jobname, subargs=None, commit=True):
+    def submit_jobs(self, systems, jobname, subargs=None, array=False,
+                    arraydir=None, arrayname=None, maxrun=None, commit=True):
         '''
         Submit/resubmit selected jobs for specified systems
 
@@ -245,23 +563,52 @@ class JobManager(object):
             subargs : list
                 List of `str` argument to be passed to `asetools.submit.main`
                 and then to the scheduler
+            array : bool
+                Submit all the jobs as a single array job with
+                :py:func:`asetools.submit.submit_array` instead of one
+                submission per job
+            arraydir : str
+                Directory for the array job script and index file, by
+                default the parent directory of the first job
+            arrayname : str
+                Name of the array job, by default `jobname` sanitized
+            maxrun : int
+                Maximal number of array tasks running at the same time
             commit : bool
                 Flag to mark whether to commit changes or not
         '''
 
-        for system in systems:
-            job = next(j for j in system.jobs if j.name == jobname)
+        jobs = jobs_by_name(self.session, systems, jobname)
+
+        if subargs is None:
+            subargs = ['-t', '120:00:00', '-n', '2']
+
+        if array:
+            if not jobs:
+                return
+            if arraydir is None:
+                arraydir = os.path.dirname(os.path.normpath(jobs[0].abspath))
+            if arrayname is None:
+                arrayname = sanitizestr(jobname)
+            _, taskids = submit_array([(job.abspath, job.inpname)
+                                       for job in jobs],
+                                      args=subargs, workdir=arraydir,
+                                      name=arrayname, maxrun=maxrun)
+        else:
+            taskids = [sub([job.inpname] + subargs, workdir=job.abspath)
+                       for job in jobs]
 
-            os.chdir(job.abspath)
-            if subargs is not None:
-                arglist = [job.inpname] + subargs
-            else:
-                arglist = [job.inpname, '-t', '120:00:00', '-n', '2']
-            # submit the job
-            sub(arglist)
+        self._record_submission(jobs, taskids, commit=commit)
 
+    def _record_submission(self, jobs, taskids, commit=True):
+        'Store the batch ids of the submitted `jobs`'
+
+        now = datetime.datetime.now()
+        for job, taskid in zip(jobs, taskids):
             # update job status
+            job.batchid = taskid
             job.status = 'submitted'
+            job.statustime = now
             self.session.add(job)
 
         if commit:
@@ -269,9 +616,110 @@ class JobManager(object):
         else:
             self.session.rollback()
 
+    def sync_status(self, systems=None, jobname=None, batch=None,
+                    command=None, commit=True):
+        '''
+        Update the status of the submitted jobs from the batch system
+
+        The states of all the tracked jobs (with a `batchid` and the status
+        `submitted`, `queued`, `running` or `suspended`) are obtained with a
+        single scheduler call (see :py:func:`asetools.scheduler.query_states`)
+        and written with one bulk UPDATE.
+
+        Args:
+            systems : list
+                List of :py:class:`System <asetools.db.model.System>`
+                instances to restrict the sync to, all systems by default
+            jobname : str
+                Restrict the sync to the jobs with this name
+            batch : str
+                Batch system, `slurm`, `pbs` or `local`, by default taken
+                from the site configuration
+            command : list of str
+                Replacement for the scheduler executable, see
+                :py:func:`asetools.scheduler.query_states`
+            commit : bool
+                Flag to mark whether to commit changes or not
+
+        Returns:
+            changed : dict
+                New statuses with the job ids as keys
+        '''
+
+        if batch is None:
+            batch = get_config()['batch']
+
+        tracked = self._tracked_jobs(systems, jobname)
+        if not tracked:
+            return {}
+
+        states = query_states(sorted(set(row.batchid for row in tracked)),
+                              batch=batch, command=command)
+
+        return self._apply_states(tracked, states, commit=commit)
+
+    def _tracked_jobs(self, systems=None, jobname=None):
+        'Return the id, batch id and status rows of the tracked jobs'
+
+        jobs = Job.__table__
+        query = select(jobs.c.id, jobs.c.batchid, jobs.c.status).\
+            where(jobs.c.batchid.isnot(None)).\
+            where(jobs.c.status.in_(TRACKED_STATES))
+        if jobname is not None:
+            query = query.where(jobs.c.name == jobname)
+        if systems is None:
+            return self.session.execute(query).fetchall()
+
+        rows = []
+        for chunk in chunks([system.id for system in systems], CHUNKSIZE):
+            rows.extend(self.session.execute(
+                query.where(jobs.c.system_id.in_(chunk))).fetchall())
+        return rows
+
+    def _apply_states(self, tracked, states, commit=True):
+        '''
+        Write the scheduler `states` of the `tracked` jobs (see
+        :py:meth:`_tracked_jobs`) that changed with one bulk UPDATE
+        '''
+
+        jobs = Job.__table__
+        now = datetime.datetime.now()
+        changed = {}
+        for row in tracked:
+            state = states.get(row.batchid)
+            if state is None:
+                log.warning('job {0} (id={1}) not known to the batch '
+                            'system'.format(row.batchid, row.id))
+            elif state != row.status:
+                changed[row.id] = state
+
+        if changed:
+            self.session.execute(
+                jobs.update().
+                where(jobs.c.id == bindparam('jobid')).
+                values(status=bindparam('newstatus'), statustime=now),
+                [{'jobid': jid, 'newstatus': state}
+                 for jid, state in changed.items()])
+
+            # refresh the jobs already loaded in the session
+            for obj in list(self.session.identity_map.values()):
+                if isinstance(obj, Job) and obj.id in changed:
+                    self.session.expire(obj, ['status', 'statustime'])
+
+        log.info('synced {0:d} jobs, {1:d} changed'.format(len(tracked),
+                                                           len(changed)))
+
+        if commit:
+            self.session.commit()
+        else:
+            self.session.rollback()
+
+        return changed
+
     def update_vibs(self, systems, jobname, vibfile='vibenergies.npy',
                     vibname='PHVA', thermofile=None, T=298.15, p=100000,
-                    verbose=False, jobstatus='finished', commit=True):
+                    verbose=False, jobstatus='finished', packed=False,
+                    commit=True):
         '''
         Update frequencies and thermochemistry in the database for the
         `systems` from the jobs with the name `jobname`.
@@ -291,17 +739,21 @@ class JobManager(object):
                 Temperature for thermochemistry calculation in `K`
             p : pressure
                 Pressure for thermochemistry calculation in `Pa`
+            packed : bool
+                Store the vibrational energies as a single packed array
             commit : bool
                 Flag to mark whether to commit changes or not
         '''
 
-        for mol in systems:
-            job = next(j for j in mol.jobs if j.name == jobname)
+        jobs = jobs_by_name(self.session, systems, jobname)
+
+        for mol, job in zip(systems, jobs):
             job.jobscript = open(job.inppath, 'r').read()
             job.status = jobstatus
 
             if os.path.exists(os.path.join(job.abspath, vibfile)):
-                vibset = vibrations2db(os.path.join(job.abspath, vibfile), name=vibname)
+                vibset = vibrations2db(os.path.join(job.abspath, vibfile),
+                                       name=vibname, packed=packed)
                 mol.vibrationsets.append(vibset)
 
             if thermofile is not None:
@@ -341,8 +793,141 @@ class JobManager(object):
         else:
             self.session.rollback()
 
+    def update_thermo(self, systems, temperatures, pressures=100000.,
+                      thermo='Harmonic', vibsetname='PHVA', missing='raise',
+                      geometry=None, symmetrynumber=None, spin=None,
+                      ignore_imag=False, replace=True, commit=True):
+        '''
+        Evaluate the thermochemistry of the `systems` over a grid of
+        temperatures (and pressures) with the vectorized kernels from
+        :py:mod:`asetools.thermochemistry` and store one
+        :py:class:`ThermoData <asetools.db.model.ThermoData>` row per system
+        and grid point.
+
+        Args:
+            systems : list
+                List of :py:class:`System <asetools.db.model.System>` instances
+            temperatures : array_like
+                Temperatures in `K`
+            pressures : array_like
+                Pressures in `Pa`, only used for `IdealGas`
+            thermo : str
+                Name of the thermochemical model to use, `Harmonic` or `IdealGas`
+            vibsetname : str
+                Name of the vibration set to select
+            missing : str
+                What to do with systems without the vibration set, see
+                :py:meth:`get_thermo`
+            geometry : str or list of str
+                Geometry of the molecules for `IdealGas`
+            symmetrynumber : int or list of int
+                Rotational symmetry numbers for `IdealGas`
+            spin : float or list of float
+                Total electronic spins for `IdealGas`
+            ignore_imag : bool
+                Drop the imaginary modes instead of raising an error
+            replace : bool
+                Remove the previously stored data of the same model for the
+                `systems` before inserting the new values
+            commit : bool
+                Flag to mark whether to commit changes or not
+
+        Returns:
+            found : list
+                Systems with the vibration set, in the order of the rows of
+                the result arrays
+            results : dict
+                Arrays with the thermochemical quantities, see
+                :py:func:`asetools.thermochemistry.harmonic` and
+                :py:func:`asetools.thermochemistry.ideal_gas`
+        '''
+
+        if thermo not in ['Harmonic', 'IdealGas']:
+            raise ValueError('Unknown thermo: {}'.format(thermo))
+
+        temperatures = np.atleast_1d(np.asarray(temperatures, dtype=float))
+        pressures = np.atleast_1d(np.asarray(pressures, dtype=float))
+
+        vibsets = self._get_vibsets(systems, vibsetname, missing)
+        found = [system for system in systems if system.id in vibsets]
+        vibenergies = [vibsets[system.id].vibenergies for system in found]
+        epot = [np.nan if system.energy is None else system.energy
+                for system in found]
+
+        if thermo == 'Harmonic':
+            model = 'HarmonicThermo'
+            results = thc.harmonic(thc.pad_energies(vibenergies,
+                                                    ignore_imag=ignore_imag),
+                                   temperatures, potentialenergy=epot)
+            grid = [(t, None) for t in temperatures.tolist()]
+            quantities = {name: results[name].ravel()
+                          for name in ['internal_energy', 'entropy',
+                                       'free_energy']}
+            quantities['enthalpy'] = np.full(len(found) * len(grid), np.nan)
+        else:
+            if geometry is None or symmetrynumber is None or spin is None:
+                raise ValueError('geometry, symmetrynumber and spin are '
+                                 'required for IdealGas')
+            model = 'IdealGasThermo'
+            results = thc.ideal_gas_atoms(
+                vibenergies, self.atoms_cache.get_many(found), temperatures,
+                pressures, geometry=geometry, symmetrynumber=symmetrynumber,
+                spin=spin, potentialenergy=epot, ignore_imag=ignore_imag)
+            grid = [(t, p) for t in temperatures.tolist()
+                    for p in pressures.tolist()]
+            npres = len(pressures)
+            quantities = {
+                'internal_energy': np.repeat(results['internal_energy'], npres,
+                                             axis=1).ravel(),
+                'enthalpy': np.repeat(results['enthalpy'], npres,
+                                      axis=1).ravel(),
+                'entropy': results['entropy'].ravel(),
+                'free_energy': results['free_energy'].ravel(),
+            }
+
+        quantities['zpe'] = np.repeat(results['zpe'], len(grid))
+        # NaN from missing energies are stored as NULL
+        quantities = {name: [None if np.isnan(v) else v
+                             for v in values.tolist()]
+                      for name, values in quantities.items()}
+
+        table = ThermoData.__table__
+
+        if replace:
+            for chunk in chunks([system.id for system in found], CHUNKSIZE):
+                self.session.execute(
+                    table.delete().
+                    where(table.c.system_id.in_(chunk)).
+                    where(table.c.model == model))
+
+        rows = []
+        n = 0
+        for system in found:
+            setid = vibsets[system.id].id
+            for temperature, pressure in grid:
+                row = {'system_id': system.id, 'vibrationset_id': setid,
+                       'model': model, 'temperature': temperature,
+                       'pressure': pressure}
+                for name, values in quantities.items():
+                    row[name] = values[n]
+                rows.append(row)
+                n += 1
+
+        for chunk in chunks(rows, 20 * CHUNKSIZE):
+            self.session.execute(table.insert(), chunk)
+
+        for system in found:
+            self.session.expire(system, ['thermodata'])
+
+        if commit:
+            self.session.commit()
+        else:
+            self.session.rollback()
+
+        return found, results
+
     def update_geoms(self, systems, jobname, jobstatus='finished',
-                     commit=True):
+                     packed=None, commit=True):
         '''
         Update the database for the `systems` from the jobs `jobname`
 
@@ -351,49 +936,178 @@ class JobManager(object):
                 List of :py:class:`System <asetools.db.model.System>` instances
             jobname : str
                 Name of the job for which the data in system should be updated
+            packed : bool
+                Store the atoms as packed arrays if `True` or as one row per
+                atom if `False`, by default the current storage of each
+                system is kept
             commit : bool
                 Flag to mark whether to commit changes or not
         '''
 
-        for mol in systems:
-            job = next(j for j in mol.jobs if j.name == jobname)
+        atoms_list = []
+        jobs = jobs_by_name(self.session, systems, jobname)
+        for mol, job in zip(systems, jobs):
             job.jobscript = open(job.inppath, 'r').read()
             job.status = jobstatus
 
             atoms = ase.io.read(str(job.outpath), format='traj')
+            atoms_list.append(atoms)
+            job.outsize, job.outmtime = stat_output(job.outpath)
+            job.outhash = None
 
-            dbatoms = atoms2db(atoms)
-            mol.atoms = dbatoms
-            cellpar = cell_to_cellpar(atoms.get_cell())
-            pbc = atoms.get_pbc()
-            mol.cell_a = cellpar[0]
-            mol.cell_b = cellpar[1]
-            mol.cell_c = cellpar[2]
-            mol.cell_alpha = cellpar[3]
-            mol.cell_beta = cellpar[4]
-            mol.cell_gamma = cellpar[5]
-            mol.pbc_a = bool(pbc[0])
-            mol.pbc_b = bool(pbc[1])
-            mol.pbc_c = bool(pbc[2])
-            mol.formula = atoms.get_chemical_formula()
-            mol.energy = atoms.get_potential_energy()
-            mol.absolute_magnetization = atoms.get_absolute_magnetization()
-            mol.total_magnetization = atoms.get_total_magnetization()
+            set_geometry(mol, atoms)
             self.session.add(mol)
             self.session.add(job)
 
+        # write all the atoms in one go
+        replace_atoms(self.session, systems, atoms_list, packed=packed)
+        self.atoms_cache.invalidate(systems)
+
+        if commit:
+            self.session.commit()
+        else:
+            self.session.rollback()
+
+    def harvest_geoms(self, systems, jobname, jobstatus='finished',
+                      packed=None, workers=4, threads=16, batch_size=200,
+                      use_hash=False, force=False, commit=True):
+        '''
+        Incremental and parallel version of :py:meth:`update_geoms`
+
+        The output files of all the jobs are stat-ed first in a pool of
+        `threads` threads and the ones with the same size and modification
+        time as recorded at the previous harvest are skipped. The changed
+        trajectories are read in a pool of `workers` processes and the
+        database is updated in batches of `batch_size` systems.
+
+        Args:
+            systems : list
+                List of :py:class:`System <asetools.db.model.System>` instances
+            jobname : str
+                Name of the job for which the data in system should be updated
+            jobstatus : str
+                Status set for the harvested jobs
+            packed : bool
+                Storage of the atoms, see :py:meth:`update_geoms`
+            workers : int
+                Number of processes reading the trajectories
+            threads : int
+                Number of threads used to stat and hash the outputs
+            batch_size : int
+                Number of systems updated per commit
+            use_hash : bool
+                Compare also the SHA1 digest of outputs with changed
+                size/mtime, so files that were only touched or copied are
+                not read again
+            force : bool
+                Read all the outputs regardless of the stored stamps
+            commit : bool
+                Flag to mark whether to commit changes or not
+
+        Returns:
+            report : dict
+                Names of the systems that were `updated`, `unchanged`,
+                `missing` (no output file) and `failed` (dict with errors)
+        '''
+
+        report = {'updated': [], 'unchanged': [], 'missing': [], 'failed': {}}
+
+        jobs = jobs_by_name(self.session, systems, jobname)
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            stats = list(pool.map(stat_output, [job.outpath for job in jobs]))
+
+        candidates = filter_outputs(systems, jobs, stats, report, force=force)
+
+        if use_hash and candidates:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                digests = list(pool.map(file_digest,
+                                        [c[1].outpath for c in candidates]))
+            candidates = filter_digests(candidates, digests, report,
+                                        force=force)
+
+        log.info('harvest {0}: {1:d} changed, {2:d} unchanged, {3:d} '
+                 'missing'.format(jobname, len(candidates),
+                                  len(report['unchanged']),
+                                  len(report['missing'])))
+
+        meta = {c[1].outpath: c for c in candidates}
+        paths = [(c[1].outpath, c[1].inppath) for c in candidates]
+
+        if workers > 1 and len(paths) > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            chunksize = max(1, min(64, len(paths) // (4 * workers)))
+            results = executor.map(read_output, paths, chunksize=chunksize)
+        else:
+            executor = None
+            results = map(read_output, paths)
+
+        batch = []
+
+        try:
+            for outpath, atoms, jobscript, error in results:
+                system, job, stat, digest = meta[outpath]
+                if atoms is None:
+                    report['failed'][system.name] = error
+                    log.warning('failed to read {0}: {1}'.format(outpath, error))
+                    continue
+
+                batch.append((system, job, stat, digest, atoms, jobscript))
+                report['updated'].append(system.name)
+
+                if len(batch) >= batch_size:
+                    self._apply_harvest(batch, jobstatus, packed, commit)
+                    batch = []
+
+            if batch:
+                self._apply_harvest(batch, jobstatus, packed, commit)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
         if commit:
             self.session.commit()
         else:
             self.session.rollback()
 
+        return report
+
+    def _apply_harvest(self, batch, jobstatus, packed=None, commit=True):
+        '''
+        Write a batch of harvested outputs, a list of ``(system, job, stat,
+        digest, atoms, jobscript)`` tuples, to the database
+        '''
+
+        for system, job, stat, digest, atoms, jobscript in batch:
+            set_geometry(system, atoms)
+            job.jobscript = jobscript
+            job.status = jobstatus
+            job.outsize, job.outmtime = stat
+            # without use_hash the stale digest of older content is cleared
+            job.outhash = digest
+
+        systems = [item[0] for item in batch]
+        replace_atoms(self.session, systems, [item[4] for item in batch],
+                      packed=packed)
+        self.atoms_cache.invalidate(systems)
+        if commit:
+            self.session.commit()
+
     def write_jobs(self, systems, jobname, subs=None, submit=False,
                    submitargs=None, overwrite=False, commit=True,
-                   write_struct=False, struct_fname='initial.traj'):
+                   write_struct=False, struct_fname='initial.traj',
+                   files=None, workers=8, dry_run=False):
         '''
         Render the template file into an input script for the job, write the
         file and submit the job (if requested).
 
+        The templates are parsed once per `DBTemplate` (see
+        :py:meth:`get_template`). Each job directory is built in a temporary
+        sibling directory by a pool of threads and, once all of them are
+        staged, swapped in place with a rename (see
+        :py:func:`swap_job_dir <asetools.db.model.swap_job_dir>`), a failure
+        for one system does not stop the others.
+
         Args:
             systems : list
                 List of `asetools.db.model.System` instances
@@ -404,49 +1118,62 @@ class JobManager(object):
                 template, they will overwrite the values obtained from the
                 calculator specified in the job
             submit : bool
-                A flag to specify whether to submit the job or not
+                A flag to specify whether to submit the job or not, only the
+                jobs written without errors are submitted
             submitargs : list of strings
                 A list of arguments for the batch program used to submit the
                 job
+            overwrite : bool
+                If True the previous the job dir will be replaced if it exists
             commit : bool
                 Flag to mark whether to commit changes or not
+            write_struct : bool
+                Also write the structure of the system to `struct_fname`
+            struct_fname : str
+                Name of the structure file in the job directory
+            files : dict
+                Extra files written to every job directory, with the names
+                relative to the job directory as keys and `str` or `bytes`
+                contents as values
+            workers : int
+                Number of threads writing the job directories
+            dry_run : bool
+                Do not write or submit anything, only report what would
+                change
+
+        Returns:
+            errors : dict
+                Error messages with the system names as keys, or with
+                `dry_run` the plans of each job directory (see
+                :py:func:`plan_job_dir <asetools.db.model.plan_job_dir>`)
+                with the `error` action for the jobs that cannot be rendered
         '''
 
-        for system in systems:
-            job = next(j for j in system.jobs if j.name == jobname)
-            atemp = AseTemplate(job.template.template)
-
-            # create a dictionary with replacements for the template by getting
-            # the matching values from the calculator attributes absed on keys
-            # from the template
-            subs2render = {k: job.calculator[k] for k in atemp.get_keys()['named'] \
-                           if k in job.calculator.attributes.keys()}
-
-            # update the values with the ones supplied by the user
-            if subs is not None:
-                subs2render.update(subs)
-
-            # check if all the template keys have values before rendering the
-            # tempate
-            if len(set(atemp.get_keys()['named']) - set(subs2render.keys())) == 0:
-                job.create_job(subs2render, overwrite)
-            else:
-                print('Not writing input for {0}, missing values for: {1}'.format(
-                    system.name, str(set(atemp.get_keys()['named']) - set(subs2render.keys()))))
-
-            if write_struct:
+        if write_struct:
+            structs = self.atoms_cache.get_many(systems)
 
-                path = job.abspath
+        errors = {}
+        tasks = []
+        jobs = jobs_by_name(self.session, systems, jobname, related=True)
+        for i, (system, job) in enumerate(zip(systems, jobs)):
+            text, missing = self._render_input(system, job, subs)
+            if text is None:
+                errors[system.name] = 'missing values for: {}'.format(
+                    ', '.join(sorted(missing)))
+                continue
 
-                atoms = get_atoms(self.session, system.id)
-                ase.io.write(os.path.join(path, struct_fname), atoms)
+            contents = job_files(job, text, files)
+            if write_struct:
+                contents[struct_fname] = partial(ase.io.write,
+                                                 images=structs[i])
+            tasks.append((system, job.abspath, contents))
 
-                log.info('wrote file {} in {}'.format(struct_fname, path))
-        if submit:
-            self.submit_jobs(systems, jobname, submitargs, commit)
+        return self._finish_write(tasks, errors, jobname, workers, overwrite,
+                                  dry_run, submit, submitargs, commit)
 
     def write_vibs(self, systems, subs, relaxname='relax', vibname='freq',
-                   submit=False, subargs=None, overwrite=False, commit=True):
+                   submit=False, subargs=None, overwrite=False, commit=True,
+                   files=None, workers=8, dry_run=False):
         '''
         Args:
             systems : list
@@ -461,37 +1188,67 @@ class JobManager(object):
             vibname : str
                 Name of the job (referencing `Job.name`) for the frequency calculation
             submit : bool
-                A flag to specify whether to submit the job or not
+                A flag to specify whether to submit the job or not, only the
+                jobs written without errors are submitted
             subargs : list of strings
                 A list of arguments for the batch program used to submit the job
             overwrite : bool
                 If True the previous the job dir will be overwritten if it exists
             commit : bool
                 Flag to mark whether to commit changes or not
+            files : dict
+                Extra files written to every job directory, see
+                :py:meth:`write_jobs`
+            workers : int
+                Number of threads writing the job directories
+            dry_run : bool
+                Do not write or submit anything, only report what would
+                change
+
+        Returns:
+            errors : dict
+                Error messages with the system names as keys, or the plans
+                with `dry_run`, see :py:meth:`write_jobs`
         '''
 
-        for system in systems:
-            relaxjob = next(j for j in system.jobs if j.name == relaxname)
-            vibjob = next(j for j in system.jobs if j.name == vibname)
-            atemp = AseTemplate(vibjob.template.template)
-
-            # create a dictionary with replacements for the template by getting the
-            # matching values from the calculator attributes absed on keys from the
-            # template
-            subs2render = {k: vibjob.calculator[k] for k in atemp.get_keys()['named'] \
-                           if k in vibjob.calculator.attributes.keys()}
+        errors = {}
+        tasks = []
+        relaxjobs = jobs_by_name(self.session, systems, relaxname)
+        vibjobs = jobs_by_name(self.session, systems, vibname, related=True)
+        for system, relaxjob, vibjob in zip(systems, relaxjobs, vibjobs):
 
-            # update the values with the ones supplied by the user
-            subs2render.update(subs)
             # use the relaxed geometry for calculating the frequency
-            subs2render['atoms'] = relaxjob.outpath
+            vibsubs = dict(subs)
+            vibsubs['atoms'] = relaxjob.outpath
 
-            # check if all the template keys have values before rendering the tempate
-            if len(set(atemp.get_keys()['named']) - set(subs2render.keys())) == 0:
-                vibjob.create_job(subs2render, overwrite)
-            else:
-                print('Not writing input for {0}, missing values for: {1}'.format(
-                    system.name, str(set(atemp.get_keys()['named']) - set(subs2render.keys()))))
+            text, missing = self._render_input(system, vibjob, vibsubs)
+            if text is None:
+                errors[system.name] = 'missing values for: {}'.format(
+                    ', '.join(sorted(missing)))
+                continue
+
+            tasks.append((system, vibjob.abspath,
+                          job_files(vibjob, text, files)))
+
+        return self._finish_write(tasks, errors, vibname, workers, overwrite,
+                                  dry_run, submit, subargs, commit)
+
+    def _finish_write(self, tasks, errors, jobname, workers, overwrite,
+                      dry_run, submit, subargs, commit):
+        'Write (or plan) the job directories and submit the written jobs'
+
+        if dry_run:
+            plans = self._write_inputs(tasks, errors, workers,
+                                       overwrite=overwrite, dry_run=True)
+            for name, error in errors.items():
+                plans[name] = {'action': 'error', 'error': error,
+                               'changed': [], 'removed': []}
+            return plans
+
+        written = self._write_inputs(tasks, errors, workers,
+                                     overwrite=overwrite)
 
         if submit:
-            self.submit_jobs(systems, vibname, subargs, commit)
+            self.submit_jobs(written, jobname, subargs, commit=commit)
+
+        return errors
@@ -6,10 +6,12 @@ import datetime
 import os
 import shutil
 import json
+import tempfile
 
 import numpy as np
-from sqlalchemy import (Column, Integer, String, Float,
-                        ForeignKey, DateTime, Unicode, UnicodeText, Boolean)
+from sqlalchemy import (Column, Integer, BigInteger, String, Float,
+                        LargeBinary, Index, ForeignKey, DateTime, Unicode,
+                        UnicodeText, Boolean)
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.ext.associationproxy import association_proxy
@@ -267,6 +269,9 @@ class DBAtom(Base):
     '''Atom ORM object'''
 
     __tablename__ = 'atoms'
+    __table_args__ = (
+        Index('ix_atoms_system_id_id', 'system_id', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     system_id = Column(Integer, ForeignKey('systems.id'))
@@ -297,11 +302,304 @@ class DBAtom(Base):
             self.atomic_number, self.mass, self.x, self.y, self.z)
 
 
+class DBAtomArrays(Base):
+    '''
+    Packed storage of all the atoms of a single system.
+
+    Instead of one :py:class:`DBAtom <asetools.db.model.DBAtom>` row per
+    atom the per-atom quantities are kept as raw little-endian NumPy
+    buffers, one binary column per array, in a single row keyed by
+    ``system_id``.
+    '''
+
+    __tablename__ = 'atomarrays'
+
+    # name of the array: (dtype, number of components per atom)
+    layout = {
+        'numbers': ('<i4', 1),
+        'positions': ('<f8', 3),
+        'momenta': ('<f8', 3),
+        'forces': ('<f8', 3),
+        'magmoms': ('<f8', 1),
+        'charges': ('<f8', 1),
+        'tags': ('<i4', 1),
+        'masses': ('<f8', 1),
+    }
+
+    system_id = Column(Integer, ForeignKey('systems.id'), primary_key=True)
+    natoms = Column(Integer, nullable=False)
+
+    numbers = Column(LargeBinary)
+    positions = Column(LargeBinary)
+    momenta = Column(LargeBinary)
+    forces = Column(LargeBinary)
+    magmoms = Column(LargeBinary)
+    charges = Column(LargeBinary)
+    tags = Column(LargeBinary)
+    masses = Column(LargeBinary)
+
+    @classmethod
+    def pack(cls, name, array):
+        '''
+        Return the bytes representation of `array` stored as column `name`
+        or ``None`` if `array` is ``None``
+        '''
+
+        if array is None:
+            return None
+        dtype, _ = cls.layout[name]
+        return np.ascontiguousarray(array, dtype=dtype).tobytes()
+
+    @classmethod
+    def unpack(cls, name, blob, natoms):
+        '''
+        Decode the bytes `blob` of column `name` into a numpy array with
+        `natoms` rows, ``None`` is returned for missing data
+        '''
+
+        if blob is None:
+            return None
+        dtype, ncomp = cls.layout[name]
+        array = np.frombuffer(blob, dtype=dtype).astype(dtype[1:])
+        if ncomp > 1:
+            array = array.reshape(natoms, ncomp)
+        return array
+
+    def get_array(self, name):
+        'Return the decoded array `name`'
+
+        return self.unpack(name, getattr(self, name), self.natoms)
+
+    def set_array(self, name, array):
+        'Encode and store the array `name`'
+
+        setattr(self, name, self.pack(name, array))
+
+    def __repr__(self):
+        return "<DBAtomArrays(system_id={0!s}, natoms={1!s})>".format(
+            self.system_id, self.natoms)
+
+
+def _write_file(path, content):
+    'Write `content` (str, bytes or a callable taking the path) to `path`'
+
+    if callable(content):
+        content(path)
+    elif isinstance(content, bytes):
+        with open(path, 'wb') as fout:
+            fout.write(content)
+    else:
+        with open(path, 'w') as fout:
+            fout.write(content)
+
+
+# the umask is read once, setting it is not thread safe
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def stage_job_dir(path, files):
+    '''
+    Build the contents of the job directory `path` in a temporary sibling
+    directory, nothing is written to `path` itself
+
+    Args:
+        path : str
+            Job directory
+        files : dict
+            File contents with the file names relative to `path` as keys,
+            the values can be `str`, `bytes` or callables writing the file
+            under the path they are given (e.g. a partial of
+            `ase.io.write`)
+
+    Returns:
+        staged : str
+            Path of the temporary directory, to be moved in place with
+            :py:func:`swap_job_dir`
+    '''
+
+    path = os.path.normpath(path)
+    parent = os.path.dirname(path)
+    if parent and not os.path.exists(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            if not os.path.isdir(parent):
+                raise
+
+    staged = tempfile.mkdtemp(prefix='.{}.stage-'.format(os.path.basename(path)),
+                              dir=parent or None)
+    try:
+        # mkdtemp creates the directory with mode 0700, the job directories
+        # get the usual permissions like with os.makedirs
+        os.chmod(staged, 0o777 & ~_UMASK)
+        for name, content in files.items():
+            fpath = os.path.join(staged, name)
+            if not os.path.exists(os.path.dirname(fpath)):
+                os.makedirs(os.path.dirname(fpath))
+            _write_file(fpath, content)
+    except Exception:
+        shutil.rmtree(staged, ignore_errors=True)
+        raise
+
+    return staged
+
+
+def swap_job_dir(staged, path, overwrite=False):
+    '''
+    Move the directory `staged` (see :py:func:`stage_job_dir`) to `path`
+
+    A new directory appears with a single atomic rename. An existing one is
+    first renamed aside, replaced by the staged one and only then removed,
+    so `path` is never left half written and the previous contents are
+    restored if the swap fails. Files already opened by running processes
+    stay readable until they are closed.
+
+    Args:
+        staged : str
+            Staged job directory
+        path : str
+            Job directory
+        overwrite : bool
+            If `True`, replace the directory if it exists, otherwise raise
+            `OSError`; `staged` is removed in both cases
+    '''
+
+    path = os.path.normpath(path)
+    try:
+        if not os.path.exists(path):
+            os.rename(staged, path)
+            return
+
+        if not overwrite:
+            raise OSError('path: {} exists'.format(path))
+
+        old = staged + '-old'
+        os.rename(path, old)
+        try:
+            os.rename(staged, path)
+        except OSError:
+            os.rename(old, path)
+            raise
+    except Exception:
+        shutil.rmtree(staged, ignore_errors=True)
+        raise
+
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def plan_job_dir(path, files, overwrite=False):
+    '''
+    Report what writing `files` into the job directory `path` would change
+    without touching the file system
+
+    Args:
+        path : str
+            Job directory
+        files : dict
+            File contents, see :py:func:`stage_job_dir`
+        overwrite : bool
+            Whether the existing directory would be replaced
+
+    Returns:
+        plan : dict
+            `action` (`create`, `replace`, `unchanged` or `exists` if the
+            directory exists and `overwrite` is `False`), `changed` (new or
+            different files, callables always count as changed) and `removed`
+            (files present now that would be deleted)
+    '''
+
+    if not os.path.exists(path):
+        return {'action': 'create', 'changed': sorted(files), 'removed': []}
+
+    present = set()
+    for root, _, fnames in os.walk(path):
+        for fname in fnames:
+            present.add(os.path.relpath(os.path.join(root, fname), path))
+
+    changed = []
+    for name, content in files.items():
+        fpath = os.path.join(path, name)
+        if callable(content) or name not in present:
+            changed.append(name)
+            continue
+        mode = 'rb' if isinstance(content, bytes) else 'r'
+        with open(fpath, mode) as fobj:
+            if fobj.read() != content:
+                changed.append(name)
+
+    removed = sorted(present - set(files))
+
+    if not overwrite:
+        action = 'exists'
+    elif changed or removed:
+        action = 'replace'
+    else:
+        action = 'unchanged'
+
+    return {'action': action, 'changed': sorted(changed), 'removed': removed}
+
+
+def write_job_input(path, inppath, text, overwrite=False, files=None):
+    '''
+    Write the rendered input `text` to `inppath` (and the extra `files`) in
+    the job directory `path`, the directory is staged next to `path` and
+    moved in place at once (see :py:func:`stage_job_dir` and
+    :py:func:`swap_job_dir`), touches only the file system so it can be run
+    from worker threads
+
+    Args:
+        path : str
+            Job directory
+        inppath : str
+            Full path of the input file
+        text : str
+            Rendered template
+        overwrite : bool
+            If `True`, overwrite any files already present
+        files : dict
+            Extra files, see :py:func:`stage_job_dir`
+    '''
+
+    if os.path.exists(path) and not overwrite:
+        raise OSError('path: {} exists'.format(path))
+
+    contents = {os.path.relpath(inppath, path): text}
+    if files is not None:
+        contents.update(files)
+
+    swap_job_dir(stage_job_dir(path, contents), path, overwrite=overwrite)
+
+
+class JobDependency(Base):
+
+    '''
+    Edge of the job dependency graph, the job `job_id` can only start after
+    the job `depends_on_id` is finished, see :py:mod:`asetools.db.workflow`
+    '''
+
+    __tablename__ = 'job_dependencies'
+    __table_args__ = (
+        Index('ix_job_dependencies_depends_on_id', 'depends_on_id'),
+    )
+
+    job_id = Column(Integer, ForeignKey('jobs.id'), primary_key=True)
+    depends_on_id = Column(Integer, ForeignKey('jobs.id'), primary_key=True)
+
+    def __repr__(self):
+        return "<JobDependency(job_id={0}, depends_on_id={1})>".format(
+            self.job_id, self.depends_on_id)
+
+
 class Job(Base):
 
     'Class for handling jobs'
 
     __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_system_id_name', 'system_id', 'name'),
+        Index('ix_jobs_name_status', 'name', 'status'),
+    )
 
     id = Column(Integer, primary_key=True)
     system_id = Column(Integer, ForeignKey('systems.id'))
@@ -314,12 +612,29 @@ class Job(Base):
     outname = Column(String)
     status = Column(String)
 
+    # job id assigned by the batch system and the time of the last change
+    # of the status
+    batchid = Column(String)
+    statustime = Column(DateTime)
+
+    # size, modification time and SHA1 digest of the output file at the
+    # last harvest, used to skip unchanged outputs
+    outsize = Column(BigInteger)
+    outmtime = Column(Float)
+    outhash = Column(String)
+
     calculator_id = Column(ForeignKey('calculators.id'))
     calculator = relationship('DBCalculator')
 
     template_id = Column(ForeignKey('asetemplates.id'))
     template = relationship('DBTemplate')
 
+    # jobs that have to finish before this one and the jobs waiting for it
+    upstream = relationship('Job', secondary='job_dependencies',
+                            primaryjoin='Job.id == JobDependency.job_id',
+                            secondaryjoin='Job.id == JobDependency.depends_on_id',
+                            backref='downstream')
+
     @hybrid_property
     def inppath(self):
         'Return the full path to the input file'
@@ -330,7 +645,7 @@ class Job(Base):
         'Return the full path to the outpath file'
         return os.path.join(self.abspath, self.outname)
 
-    def create_job(self, repl, overwrite=False):
+    def create_job(self, repl, overwrite=False, template=None, files=None):
         '''
         Create a directory for a job and write the job script to it based on
         the information from the Job instance.
@@ -340,17 +655,19 @@ class Job(Base):
                 Dictionary of items to be replaced in the template
             overwrite : bool
                 If `True`, overwrite any files already present
+            template : CompiledTemplate
+                Already parsed template of the job, compiled from
+                `self.template` if `None`
+            files : dict
+                Extra files written to the job directory, see
+                :py:func:`stage_job_dir`
         '''
 
-        if os.path.exists(self.abspath):
-            if overwrite:
-                shutil.rmtree(self.abspath)
-            else:
-                raise OSError('path: {} exists'.format(self.abspath))
-        os.makedirs(self.abspath)
+        if template is None:
+            template = AseTemplate(self.template.template).compile()
 
-        t = AseTemplate(self.template.template)
-        t.render_and_write(repl, output=self.inppath)
+        write_job_input(self.abspath, self.inppath, template.render(repl),
+                        overwrite=overwrite, files=files)
 
     def __repr__(self):
         return "%s(\n%s)" % (
@@ -365,6 +682,9 @@ class Vibration(Base):
     '''A single vibration'''
 
     __tablename__ = 'vibrations'
+    __table_args__ = (
+        Index('ix_vibrations_vibrationset_id', 'vibrationset_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     energy_real = Column(Float, nullable=False)
@@ -380,15 +700,27 @@ class Vibration(Base):
 class VibrationSet(Base):
 
     __tablename__ = 'vibrationsets'
+    __table_args__ = (
+        Index('ix_vibrationsets_system_id_name', 'system_id', 'name'),
+        Index('ix_vibrationsets_name', 'name'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
     atom_ids = Column(String)
+    # packed complex128 vibrational energies, alternative to `vibrations`
+    energies = Column(LargeBinary)
 
     system_id = Column(Integer, ForeignKey('systems.id'), nullable=False)
 
     vibrations = relationship('Vibration', cascade="all, delete-orphan")
 
+    @staticmethod
+    def pack(vibenergies):
+        'Return the bytes representation of the complex vibrational energies'
+
+        return np.ascontiguousarray(vibenergies, dtype='<c16').tobytes()
+
     @hybrid_property
     def atom_indices(self):
         '''
@@ -401,7 +733,21 @@ class VibrationSet(Base):
 
     @hybrid_property
     def vibenergies(self):
-        '''Return a numpy array with the vibration energies'''
+        '''
+        Return a numpy array with the vibration energies
+
+        Packed energies are decoded once and cached until the `energies`
+        column changes, the returned array is read-only.
+        '''
+
+        if self.energies is not None:
+            cached = getattr(self, '_vibcache', None)
+            if cached is None or cached[0] is not self.energies:
+                array = np.frombuffer(self.energies, dtype='<c16').\
+                    astype(np.complex128)
+                array.flags.writeable = False
+                cached = self._vibcache = (self.energies, array)
+            return cached[1]
 
         values = [v.energy_real + 1j * v.energy_imag for v in self.vibrations]
         if len(values) > 0:
@@ -414,10 +760,55 @@ class VibrationSet(Base):
                 self.id, self.name, self.system_id, self.atom_ids)
 
 
+class ThermoData(Base):
+
+    '''
+    Thermochemistry of a system evaluated from a vibration set at a single
+    temperature and pressure, see
+    :py:meth:`JobManager.update_thermo <asetools.db.jobmanager.JobManager.update_thermo>`
+
+    Attributes:
+        model : str
+            Thermochemical model, `HarmonicThermo` or `IdealGasThermo`
+        temperature : float
+            Temperature in K
+        pressure : float
+            Pressure in Pa, `None` for `HarmonicThermo`
+        free_energy : float
+            Helmholtz free energy for `HarmonicThermo` and Gibbs free energy
+            for `IdealGasThermo` in eV
+    '''
+
+    __tablename__ = 'thermodata'
+    __table_args__ = (
+        Index('ix_thermodata_system_id_model', 'system_id', 'model'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    system_id = Column(Integer, ForeignKey('systems.id'), nullable=False)
+    vibrationset_id = Column(Integer, ForeignKey('vibrationsets.id'))
+    model = Column(String, nullable=False)
+    temperature = Column(Float, nullable=False)
+    pressure = Column(Float)
+    zpe = Column(Float)
+    internal_energy = Column(Float)
+    enthalpy = Column(Float)
+    entropy = Column(Float)
+    free_energy = Column(Float)
+
+    def __repr__(self):
+        return "<ThermoData(system_id={0!s}, model={1!s}, T={2!s}, p={3!s}, free_energy={4!s})>".format(
+                self.system_id, self.model, self.temperature, self.pressure,
+                self.free_energy)
+
+
 class SystemNote(PolymorphicVerticalProperty, Base):
     '''class to handle storing key-value pairs for the system'''
 
     __tablename__ = 'system_notes'
+    __table_args__ = (
+        Index('ix_system_notes_key', 'key'),
+    )
 
     system_id = Column(ForeignKey('systems.id'), primary_key=True)
     key = Column(Unicode(64), primary_key=True)
@@ -447,6 +838,10 @@ class System(ProxiedDictMixin, Base):
     '''
 
     __tablename__ = 'systems'
+    __table_args__ = (
+        Index('ix_systems_name', 'name'),
+        Index('ix_systems_topology_formula', 'topology', 'formula'),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -490,8 +885,13 @@ class System(ProxiedDictMixin, Base):
 
     atoms = relationship('DBAtom', cascade="all, delete-orphan")
 
+    atomarrays = relationship('DBAtomArrays', uselist=False,
+                              cascade="all, delete-orphan")
+
     vibrationsets = relationship('VibrationSet', cascade="all, delete-orphan")
 
+    thermodata = relationship('ThermoData', cascade="all, delete-orphan")
+
 
     notes = relationship('SystemNote',
                 collection_class=attribute_mapped_collection('key'),
@@ -506,10 +906,39 @@ class System(ProxiedDictMixin, Base):
         'Convenience method for querying'
         return self.notes.any(key=key, value=value)
 
+    @property
+    def jobmap(self):
+        '''
+        Return the jobs as a dictionary keyed on `Job.name`, the first job is
+        kept if there are more with the same name'''
+
+        jobmap = {}
+        for job in self.jobs:
+            jobmap.setdefault(job.name, job)
+        return jobmap
+
+    def get_job(self, jobname):
+        '''
+        Return the job named `jobname`
+
+        Raises:
+          ValueError:
+            when the system has no such job
+        '''
+
+        for job in self.jobs:
+            if job.name == jobname:
+                return job
+        raise ValueError('No job named "{0}" for system: {1}'.format(
+            jobname, self.name))
+
     @hybrid_property
     def forces(self):
         '''Return a numpy array with the forces'''
 
+        if self.atomarrays is not None:
+            return self.atomarrays.get_array('forces')
+
         values = [[a.force_x, a.force_y, a.force_z] for a in self.atoms]
         if len(values) > 0:
             return np.asarray(values)
@@ -2,6 +2,8 @@
 
 'useful tools'
 
+import hashlib
+
 
 def sanitizestr(value, repd=None, keepchars=None):
     'Sanitize the string to get a workable filename'
@@ -16,3 +18,21 @@ def sanitizestr(value, repd=None, keepchars=None):
 
     value = "".join(c for c in value if c.isalnum() or c in keepchars).rstrip()
     return value
+
+
+def chunks(seq, size):
+    'Yield successive chunks of `size` items from the sequence `seq`'
+
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def file_digest(path, blocksize=1 << 20):
+    'Return the SHA1 hex digest of the file `path` read in blocks'
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as fobj:
+        for block in iter(lambda: fobj.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+
+'''
+Dependency graph over the jobs and a loop driving it
+
+A workflow is a list of :py:class:`Step` instances, e.g. relaxation,
+frequencies and thermochemistry, each naming the step it depends on. The
+dependencies between the jobs of every system are stored in the
+`job_dependencies` table (see :py:meth:`Workflow.link`) and
+:py:meth:`Workflow.run` repeatedly syncs the job statuses with the batch
+system, harvests the completed jobs and writes and submits the jobs whose
+upstream jobs are finished::
+
+    steps = [Step('relax'),
+             Step('freq', after='relax', writer='vibs', harvester='vibs',
+                  subs={'fmax': 0.01})]
+    wf = Workflow(JobManager(session), steps)
+    wf.link(systems)
+    wf.run(interval=600)
+
+With `afterok=True` the downstream jobs are submitted as soon as their
+upstream jobs are submitted, with the scheduler dependency
+``--dependency=afterok:<ids>`` so the cluster starts them right after the
+upstream jobs end successfully.
+'''
+
+import logging
+import time
+
+from collections import OrderedDict
+
+from sqlalchemy import and_, exists, false, or_
+from sqlalchemy.orm import aliased
+
+from ..asetools import get_config
+from ..scheduler import (CANCELLED, COMPLETED, FAILED, FAILED_STATES,
+                         cancel_jobs)
+from ..submit import main as sub
+from .dbinterface import CHUNKSIZE, jobs_by_name
+from .jobmanager import TRACKED_STATES
+from .model import Job, JobDependency, System
+from .utils import chunks
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+NOT_STARTED = 'not started'
+FINISHED = 'finished'
+
+
+class Step(object):
+    '''
+    Single step of a :py:class:`Workflow`
+
+    Args:
+        name : str
+            Name of the jobs of this step, referencing `Job.name`
+        after : str
+            Name of the step this one depends on, `None` for the first step
+        writer : str
+            `jobs` to write the inputs with
+            :py:meth:`JobManager.write_jobs <asetools.db.jobmanager.JobManager.write_jobs>`
+            or `vibs` with
+            :py:meth:`JobManager.write_vibs <asetools.db.jobmanager.JobManager.write_vibs>`
+            using the output of the `after` job
+        harvester : str
+            `geoms` to harvest with
+            :py:meth:`JobManager.harvest_geoms <asetools.db.jobmanager.JobManager.harvest_geoms>`,
+            `vibs` with
+            :py:meth:`JobManager.update_vibs <asetools.db.jobmanager.JobManager.update_vibs>`
+            or `None` to only mark the completed jobs as finished
+        subs : dict
+            Substitutions rendered into the job template
+        subargs : list of str
+            Arguments for the submission, see
+            :py:func:`asetools.submit.main`
+        write_options : dict
+            Extra keyword arguments for the writer
+        harvest_options : dict
+            Extra keyword arguments for the harvester
+    '''
+
+    writers = ('jobs', 'vibs')
+    harvesters = ('geoms', 'vibs', None)
+
+    def __init__(self, name, after=None, writer='jobs', harvester='geoms',
+                 subs=None, subargs=None, write_options=None,
+                 harvest_options=None):
+
+        if writer not in self.writers:
+            raise ValueError('Unknown writer: {}'.format(writer))
+        if harvester not in self.harvesters:
+            raise ValueError('Unknown harvester: {}'.format(harvester))
+        if writer == 'vibs' and after is None:
+            raise ValueError('Step "{}" with the vibs writer needs the '
+                             'after step'.format(name))
+
+        self.name = name
+        self.after = after
+        self.writer = writer
+        self.harvester = harvester
+        self.subs = subs
+        self.subargs = subargs
+        self.write_options = write_options or {}
+        self.harvest_options = harvest_options or {}
+
+    def write(self, jobmanager, systems):
+        'Write the inputs of the `systems`, return the errors per system'
+
+        if self.writer == 'vibs':
+            return jobmanager.write_vibs(systems, self.subs or {},
+                                         relaxname=self.after,
+                                         vibname=self.name,
+                                         **self.write_options)
+        return jobmanager.write_jobs(systems, self.name, subs=self.subs,
+                                     **self.write_options)
+
+    def harvest(self, jobmanager, systems):
+        '''
+        Store the results of the completed jobs of the `systems`, return
+        the errors with the names of the systems that failed as keys
+        '''
+
+        if self.harvester == 'geoms':
+            report = jobmanager.harvest_geoms(systems, self.name,
+                                              jobstatus=FINISHED,
+                                              **self.harvest_options)
+            failed = dict(report['failed'])
+            failed.update((name, 'missing output')
+                          for name in report['missing'])
+            return failed
+
+        if self.harvester == 'vibs':
+            try:
+                jobmanager.update_vibs(systems, self.name, jobstatus=FINISHED,
+                                       **self.harvest_options)
+                return {}
+            except Exception:
+                jobmanager.session.rollback()
+
+            # find the culprits one by one
+            failed = {}
+            for system in systems:
+                try:
+                    jobmanager.update_vibs([system], self.name,
+                                           jobstatus=FINISHED,
+                                           **self.harvest_options)
+                except Exception as exc:
+                    jobmanager.session.rollback()
+                    failed[system.name] = '{0}: {1}'.format(
+                        exc.__class__.__name__, exc)
+            return failed
+
+        return {}
+
+    def __repr__(self):
+        return "Step(name='{0}', after={1!r}, writer='{2}', harvester={3!r})".format(
+            self.name, self.after, self.writer, self.harvester)
+
+
+def add_dependencies(session, systems, jobname, upstream, commit=True):
+    '''
+    Make the jobs `jobname` of the `systems` depend on their jobs
+    `upstream`, existing dependencies are kept
+
+    Returns:
+        count : int
+            Number of the new dependencies
+    '''
+
+    jobs = jobs_by_name(session, systems, jobname)
+    upjobs = jobs_by_name(session, systems, upstream)
+
+    existing = set()
+    for chunk in chunks([job.id for job in jobs], CHUNKSIZE):
+        existing.update(session.query(JobDependency.job_id,
+                                      JobDependency.depends_on_id).
+                        filter(JobDependency.job_id.in_(chunk)))
+
+    new = [JobDependency(job_id=job.id, depends_on_id=upjob.id)
+           for job, upjob in zip(jobs, upjobs)
+           if (job.id, upjob.id) not in existing]
+    session.add_all(new)
+
+    # the upstream/downstream collections loaded so far are stale
+    for job in jobs + upjobs:
+        session.expire(job, ['upstream', 'downstream'])
+
+    if commit:
+        session.commit()
+
+    return len(new)
+
+
+class Workflow(object):
+    '''
+    Drive the jobs of a list of steps through the batch system
+
+    Args:
+        jobmanager : JobManager
+            :py:class:`JobManager <asetools.db.jobmanager.JobManager>`
+            instance
+        steps : list
+            List of :py:class:`Step` instances, every step has to be listed
+            after the step it depends on
+        afterok : bool
+            Submit the downstream jobs right after their upstream jobs with
+            the scheduler dependency `afterok` instead of waiting for the
+            upstream jobs to be harvested, not supported by the `local`
+            batch system
+        batch : str
+            Batch system, `slurm` or `pbs`, by default taken from the site
+            configuration
+        command : list of str
+            Replacement for the scheduler executable, see
+            :py:func:`asetools.scheduler.query_states`
+        cancel_command : list of str
+            Replacement for the cancel command, see
+            :py:func:`asetools.scheduler.cancel_jobs`
+    '''
+
+    def __init__(self, jobmanager, steps, afterok=False, batch=None,
+                 command=None, cancel_command=None):
+
+        if afterok and (batch or get_config()['batch']) == 'local':
+            raise ValueError('afterok is not supported by the local batch '
+                             'system')
+
+        self.jobmanager = jobmanager
+        self.session = jobmanager.session
+        self.afterok = afterok
+        self.batch = batch
+        self.command = command
+        self.cancel_command = cancel_command
+
+        self.steps = OrderedDict()
+        for step in steps:
+            if step.name in self.steps:
+                raise ValueError('Duplicate step: {}'.format(step.name))
+            if step.after is not None and step.after not in self.steps:
+                raise ValueError('Step "{0}" depends on "{1}" which is not '
+                                 'defined before it'.format(step.name,
+                                                            step.after))
+            self.steps[step.name] = step
+
+    def link(self, systems, commit=True):
+        '''
+        Store the dependencies between the jobs of the `systems` following
+        the steps, the jobs have to be inserted already (see
+        :py:meth:`JobManager.insert_jobs <asetools.db.jobmanager.JobManager.insert_jobs>`)
+
+        Returns:
+            count : int
+                Number of the new dependencies
+        '''
+
+        count = 0
+        for step in self.steps.values():
+            if step.after is not None:
+                count += add_dependencies(self.session, systems, step.name,
+                                          step.after, commit=False)
+        if commit:
+            self.session.commit()
+        return count
+
+    def _systems(self, jobs):
+        'Return the systems of the `jobs` in the same order'
+
+        ids = set(job.system_id for job in jobs)
+        systems = {}
+        for chunk in chunks(ids, CHUNKSIZE):
+            systems.update((s.id, s) for s in
+                           self.session.query(System).filter(System.id.in_(chunk)))
+        return [systems[job.system_id] for job in jobs]
+
+    def _set_status(self, jobs, status):
+        'Set the `status` of the `jobs` and commit'
+
+        for job in jobs:
+            job.status = status
+        self.session.commit()
+
+    def ready(self, stepname):
+        '''
+        Return the jobs of the step `stepname` that are not started and can
+        be submitted: all their upstream jobs are finished, or with
+        `afterok` also submitted or completed
+        '''
+
+        upjob = aliased(Job)
+        if self.afterok:
+            allowed = (FINISHED, COMPLETED) + TRACKED_STATES
+            unsubmitted = and_(upjob.status.in_(TRACKED_STATES),
+                               upjob.batchid.is_(None))
+        else:
+            allowed = (FINISHED,)
+            unsubmitted = false()
+
+        blocking = exists().where(and_(
+            JobDependency.job_id == Job.id,
+            JobDependency.depends_on_id == upjob.id,
+            or_(upjob.status.is_(None), ~upjob.status.in_(allowed),
+                unsubmitted)))
+
+        return self.session.query(Job).\
+            filter(Job.name == stepname, Job.status == NOT_STARTED).\
+            filter(~blocking).order_by(Job.id).all()
+
+    def sync(self):
+        'Update the status of the submitted jobs of all the steps'
+
+        changed = {}
+        for name in self.steps:
+            changed.update(self.jobmanager.sync_status(
+                jobname=name, batch=self.batch, command=self.command))
+        return changed
+
+    def harvest(self):
+        '''
+        Harvest the jobs completed in the batch system, they are marked as
+        `finished` or `failed`
+
+        Returns:
+            counts : tuple
+                Number of the harvested and failed jobs
+        '''
+
+        nharvested = nfailed = 0
+        for step in self.steps.values():
+            jobs = self.session.query(Job).\
+                filter(Job.name == step.name, Job.status == COMPLETED).\
+                order_by(Job.id).all()
+            if not jobs:
+                continue
+
+            systems = self._systems(jobs)
+            failed = step.harvest(self.jobmanager, systems)
+
+            bad = [job for job, system in zip(jobs, systems)
+                   if system.name in failed]
+            good = [job for job, system in zip(jobs, systems)
+                    if system.name not in failed]
+            for name, error in failed.items():
+                log.warning('harvesting {0} of {1} failed: {2}'.format(
+                    step.name, name, error))
+            self._set_status(bad, FAILED)
+            self._set_status(good, FINISHED)
+
+            nharvested += len(good)
+            nfailed += len(bad)
+
+        return nharvested, nfailed
+
+    def _dependency_ids(self, job):
+        'Return the batch ids of the upstream jobs still in the batch system'
+
+        return [up.batchid for up in job.upstream
+                if up.status in TRACKED_STATES and up.batchid is not None]
+
+    def advance(self):
+        '''
+        Write and submit the jobs that are ready (see :py:meth:`ready`), the
+        jobs whose inputs cannot be written or that cannot be submitted are
+        marked as `failed`
+
+        Returns:
+            counts : tuple
+                Number of the submitted and failed jobs
+        '''
+
+        nsubmitted = nfailed = 0
+        for step in self.steps.values():
+            jobs = self.ready(step.name)
+            if not jobs:
+                continue
+
+            systems = self._systems(jobs)
+            errors = step.write(self.jobmanager, systems)
+
+            bad = [job for job, system in zip(jobs, systems)
+                   if system.name in errors]
+            for job, system in zip(jobs, systems):
+                if system.name in errors:
+                    log.warning('writing {0} of {1} failed: {2}'.format(
+                        step.name, system.name, errors[system.name]))
+            self._set_status(bad, FAILED)
+            nfailed += len(bad)
+
+            written = [(job, system) for job, system in zip(jobs, systems)
+                       if system.name not in errors]
+            suberrors = self._submit(step, written)
+
+            bad = [job for job, system in written if system.name in suberrors]
+            for name, error in suberrors.items():
+                log.warning('submitting {0} of {1} failed: {2}'.format(
+                    step.name, name, error))
+            self._set_status(bad, FAILED)
+            nfailed += len(bad)
+            nsubmitted += len(written) - len(bad)
+
+        return nsubmitted, nfailed
+
+    def _submit(self, step, items):
+        '''
+        Submit the `(job, system)` pairs `items` one by one, the jobs with
+        upstream jobs still in the batch system get the `afterok` dependency
+        on them, the batch id of every job is recorded as soon as it is
+        submitted
+
+        Returns:
+            errors : dict
+                Submission errors with the system names as keys
+        '''
+
+        subargs = step.subargs
+        if subargs is None:
+            subargs = ['-t', '120:00:00', '-n', '2']
+
+        errors = {}
+        for job, system in items:
+            depids = self._dependency_ids(job) if self.afterok else []
+            args = [job.inpname] + subargs
+            if depids:
+                args += ['--dependency', 'afterok:' + ':'.join(depids)]
+            try:
+                taskid = sub(args, workdir=job.abspath)
+            except Exception as exc:
+                errors[system.name] = '{0}: {1}'.format(
+                    exc.__class__.__name__, exc)
+                continue
+            if taskid is None:
+                # not submitted (e.g. --nosubmit) or no batch id returned,
+                # sync_status could never follow the job
+                errors[system.name] = 'no batch id returned by the ' \
+                    'submission'
+                continue
+            self.jobmanager._record_submission([job], [taskid])
+
+        return errors
+
+    def cancel_orphans(self):
+        '''
+        Cancel the jobs in the batch system whose upstream jobs ended
+        unsuccessfully (`failed`, `timeout` or `cancelled`), with `afterok`
+        the scheduler would keep them queued forever, they are marked as
+        `cancelled` and so are their own downstream jobs in turn
+
+        Returns:
+            count : int
+                Number of the cancelled jobs
+        '''
+
+        upjob = aliased(Job)
+        orphaned = exists().where(and_(
+            JobDependency.job_id == Job.id,
+            JobDependency.depends_on_id == upjob.id,
+            upjob.status.in_(FAILED_STATES)))
+
+        count = 0
+        while True:
+            jobs = self.session.query(Job).\
+                filter(Job.name.in_(list(self.steps)),
+                       Job.status.in_(TRACKED_STATES)).\
+                filter(orphaned).order_by(Job.id).all()
+            if not jobs:
+                break
+
+            batchids = [job.batchid for job in jobs if job.batchid is not None]
+            if batchids:
+                cancel_jobs(batchids,
+                            batch=self.batch or get_config()['batch'],
+                            command=self.cancel_command)
+            for job in jobs:
+                log.warning('cancelled {0} (id={1}), an upstream job '
+                            'failed'.format(job.name, job.id))
+            self._set_status(jobs, CANCELLED)
+            count += len(jobs)
+
+        return count
+
+    def pending(self):
+        '''
+        Return the number of jobs of the steps that are still in the batch
+        system, completed but not harvested or ready to be submitted, the
+        jobs without a batch id are not followed by the sync and are ignored
+        '''
+
+        active = self.session.query(Job).\
+            filter(Job.name.in_(list(self.steps))).\
+            filter(or_(Job.status == COMPLETED,
+                       and_(Job.status.in_(TRACKED_STATES),
+                            Job.batchid.isnot(None)))).count()
+        return active + sum(len(self.ready(name)) for name in self.steps)
+
+    def tick(self):
+        '''
+        Run a single iteration: sync the statuses, harvest the completed
+        jobs, cancel the orphaned ones (with `afterok`) and submit the ready
+        ones
+
+        Returns:
+            summary : dict
+                Number of the `changed`, `harvested`, `cancelled`,
+                `submitted` and `failed` jobs
+        '''
+
+        changed = self.sync()
+        harvested, hfailed = self.harvest()
+        cancelled = self.cancel_orphans() if self.afterok else 0
+        submitted, sfailed = self.advance()
+
+        summary = {'changed': len(changed), 'harvested': harvested,
+                   'cancelled': cancelled, 'submitted': submitted,
+                   'failed': hfailed + sfailed}
+        log.info('workflow tick: {}'.format(summary))
+        return summary
+
+    def run(self, interval=300, maxiter=None):
+        '''
+        Run :py:meth:`tick` every `interval` seconds until no job is pending
+        or `maxiter` iterations are done, the jobs depending on failed jobs
+        are never submitted or, with `afterok`, cancelled in the batch system
+        (see :py:meth:`cancel_orphans`)
+
+        Returns:
+            niter : int
+                Number of the iterations done
+        '''
+
+        niter = 0
+        while maxiter is None or niter < maxiter:
+            self.tick()
+            niter += 1
+            if not self.pending():
+                break
+            time.sleep(interval)
+        return niter
@@ -0,0 +1,374 @@
+
+'''
+Minimal batch system running the job scripts on the local machine
+
+The jobs are kept as JSON records in a spool directory and executed by a
+single background worker process that runs at most `maxprocs` scripts at a
+time, the worker is started on demand by :py:func:`submit` and exits once
+the queue is empty. The standard output and error of every job are written
+to ``local-<id>.out`` and ``local-<id>.err`` in its working directory.
+
+The command line interface mimics the cluster tools so that the local
+backend plugs into :py:mod:`asetools.submit` and :py:mod:`asetools.scheduler`
+as any other batch system::
+
+    python localbatch.py submit run.relax   # Submitted batch job 1
+    python localbatch.py status 1 2         # 1|RUNNING (sacct like)
+    python localbatch.py cancel 2
+
+The spool directory is taken from the `ASETOOLS_LOCAL_SPOOL` environment
+variable or the `local_spool` entry of the site configuration (default
+``~/.asetools_local``) and the number of processes from `local_maxprocs`
+(default: number of CPUs). Requires a POSIX system.
+
+The module only uses the standard library and is executed by its path (see
+:py:data:`COMMAND`) so the commands start without importing the rest of
+the package.
+'''
+
+from __future__ import print_function, absolute_import
+
+import argparse
+import datetime
+import fcntl
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+CANCELLED = 'CANCELLED'
+
+FINAL = (COMPLETED, FAILED, CANCELLED)
+
+# command running this module
+COMMAND = [sys.executable, os.path.abspath(__file__)]
+
+
+def read_site_config():
+    '''
+    Return the site configuration from ``$HOME/.asetools_site_config.py``
+    (same as :py:func:`asetools.asetools.get_config`) or an empty dict if
+    there is none
+    '''
+
+    fpath = os.path.join(os.path.expanduser('~'), '.asetools_site_config.py')
+    if not os.path.exists(fpath):
+        return {}
+
+    siteinfo = {}
+    with open(fpath) as fobj:
+        exec(fobj.read(), siteinfo)
+    return siteinfo.get('config', {})
+
+
+def get_settings(spool=None, maxprocs=None):
+    '''
+    Return the spool directory and the maximal number of processes, the
+    values not given are taken from the environment or the site
+    configuration
+    '''
+
+    config = read_site_config()
+
+    if spool is None:
+        spool = os.getenv('ASETOOLS_LOCAL_SPOOL',
+                          config.get('local_spool',
+                                     os.path.join(os.path.expanduser('~'),
+                                                  '.asetools_local')))
+    if maxprocs is None:
+        maxprocs = config.get('local_maxprocs', os.cpu_count() or 1)
+
+    if not os.path.exists(spool):
+        try:
+            os.makedirs(spool)
+        except OSError:
+            if not os.path.isdir(spool):
+                raise
+
+    return spool, int(maxprocs)
+
+
+def _record_path(spool, jobid):
+    return os.path.join(spool, '{0:d}.json'.format(int(jobid)))
+
+
+def read_record(spool, jobid):
+    'Return the record of the job `jobid` or `None` if not known'
+
+    try:
+        with open(_record_path(spool, jobid)) as fobj:
+            return json.load(fobj)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_record(spool, record):
+    'Write the job `record` atomically'
+
+    fd, tmp = tempfile.mkstemp(dir=spool, prefix='.record-')
+    with os.fdopen(fd, 'w') as fobj:
+        json.dump(record, fobj)
+    os.replace(tmp, _record_path(spool, record['id']))
+
+
+def list_records(spool, states=None):
+    'Return the records (with the `states`) sorted by the job id'
+
+    records = []
+    for fname in os.listdir(spool):
+        if fname.endswith('.json') and fname[:-5].isdigit():
+            record = read_record(spool, fname[:-5])
+            if record is not None and (states is None or
+                                       record['state'] in states):
+                records.append(record)
+    return sorted(records, key=lambda r: r['id'])
+
+
+def _now():
+    return datetime.datetime.now().isoformat()
+
+
+def _new_id(spool):
+    'Reserve a new job id by creating its record file exclusively'
+
+    ids = [int(f[:-5]) for f in os.listdir(spool)
+           if f.endswith('.json') and f[:-5].isdigit()]
+    jobid = max(ids + [0]) + 1
+    while True:
+        try:
+            fd = os.open(_record_path(spool, jobid),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            jobid += 1
+            continue
+        os.close(fd)
+        return jobid
+
+
+def submit(script, workdir=None, spool=None, maxprocs=None, start=True):
+    '''
+    Queue the job `script` and make sure the worker is running
+
+    Args:
+      script : str
+        Path to the job script, run with ``bash``
+      workdir : str
+        Working directory of the job, default is the current directory
+      spool : str
+        Spool directory, see :py:func:`get_settings`
+      maxprocs : int
+        Maximal number of jobs running at the same time
+      start : bool
+        Start the worker if it is not running
+
+    Returns:
+      jobid : int
+        Identifier of the job
+    '''
+
+    spool, maxprocs = get_settings(spool, maxprocs)
+    workdir = os.path.abspath(os.getcwd() if workdir is None else workdir)
+
+    jobid = _new_id(spool)
+    write_record(spool, {
+        'id': jobid,
+        'name': os.path.basename(script),
+        'script': os.path.join(workdir, script),
+        'workdir': workdir,
+        'state': PENDING,
+        'returncode': None,
+        'pid': None,
+        'submitted': _now(),
+        'started': None,
+        'ended': None,
+    })
+
+    if start:
+        start_worker(spool, maxprocs)
+
+    return jobid
+
+
+def start_worker(spool, maxprocs):
+    'Start the worker in the background, it exits if one is running already'
+
+    with open(os.devnull, 'r+') as devnull:
+        subprocess.Popen(COMMAND + ['worker', '--spool', spool,
+                                    '--maxprocs', str(maxprocs)],
+                         stdin=devnull, stdout=devnull, stderr=devnull,
+                         close_fds=True, start_new_session=True)
+
+
+def query(jobids, spool=None):
+    '''
+    Return the states of the jobs `jobids` as a dictionary, unknown jobs
+    are skipped
+    '''
+
+    spool, _ = get_settings(spool)
+    states = {}
+    for jobid in jobids:
+        record = read_record(spool, jobid)
+        if record is not None:
+            states[str(record['id'])] = record['state']
+    return states
+
+
+def cancel(jobids, spool=None):
+    '''
+    Cancel the jobs `jobids`, pending jobs are dropped from the queue and
+    the running ones are terminated by the worker
+    '''
+
+    spool, _ = get_settings(spool)
+    for jobid in jobids:
+        record = read_record(spool, jobid)
+        if record is None or record['state'] in FINAL:
+            continue
+        if record['state'] == PENDING:
+            record['state'] = CANCELLED
+            record['ended'] = _now()
+            write_record(spool, record)
+        else:
+            open(os.path.join(spool, '{0:d}.cancel'.format(record['id'])),
+                 'w').close()
+
+
+def _start(spool, record):
+    'Start the job of `record` and return the process and the log files'
+
+    out = open(os.path.join(record['workdir'],
+                            'local-{0:d}.out'.format(record['id'])), 'w')
+    err = open(os.path.join(record['workdir'],
+                            'local-{0:d}.err'.format(record['id'])), 'w')
+    env = dict(os.environ, LOCAL_JOB_ID=str(record['id']))
+    try:
+        proc = subprocess.Popen(['bash', record['script']],
+                                cwd=record['workdir'], stdout=out,
+                                stderr=err, env=env, start_new_session=True)
+    except OSError as exc:
+        err.write('{0}\n'.format(exc))
+        out.close()
+        err.close()
+        record.update(state=FAILED, returncode=None, ended=_now())
+        write_record(spool, record)
+        return None
+
+    record.update(state=RUNNING, pid=proc.pid, started=_now())
+    write_record(spool, record)
+    return proc, out, err
+
+
+def worker(spool, maxprocs, idle=2.0, poll=0.2):
+    '''
+    Run the queued jobs, at most `maxprocs` at a time, until the queue has
+    been empty for `idle` seconds, only a single worker runs per spool
+    directory
+    '''
+
+    lock = open(os.path.join(spool, 'worker.lock'), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        lock.close()
+        return
+
+    # jobs left running by a worker that died cannot be followed anymore
+    for record in list_records(spool, states=[RUNNING]):
+        record.update(state=FAILED, ended=_now())
+        write_record(spool, record)
+
+    running = {}
+    last = time.time()
+    try:
+        while True:
+            for jobid, (record, proc, out, err) in list(running.items()):
+                flag = os.path.join(spool, '{0:d}.cancel'.format(jobid))
+                if os.path.exists(flag) and proc.poll() is None:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                    proc.wait()
+                    record['state'] = CANCELLED
+                elif proc.poll() is None:
+                    continue
+                else:
+                    record['state'] = COMPLETED if proc.returncode == 0 \
+                        else FAILED
+                out.close()
+                err.close()
+                if os.path.exists(flag):
+                    os.remove(flag)
+                record.update(returncode=proc.returncode, ended=_now())
+                write_record(spool, record)
+                del running[jobid]
+
+            pending = list_records(spool, states=[PENDING])
+            for record in pending[:max(0, maxprocs - len(running))]:
+                started = _start(spool, record)
+                if started is not None:
+                    running[record['id']] = (record,) + started
+
+            if running or pending:
+                last = time.time()
+            elif time.time() - last > idle:
+                break
+
+            time.sleep(poll)
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    # a job submitted while exiting would wait for the next submission
+    if list_records(spool, states=[PENDING]):
+        worker(spool, maxprocs, idle=idle, poll=poll)
+
+
+def main(args=None):
+    'Command line interface, see the module documentation'
+
+    parser = argparse.ArgumentParser(description='local batch system')
+    parser.add_argument('--spool', default=None, help='spool directory')
+    parser.add_argument('--maxprocs', type=int, default=None,
+                        help='maximal number of jobs running at once')
+    subparsers = parser.add_subparsers(dest='command')
+    psub = subparsers.add_parser('submit', help='queue a job script')
+    psub.add_argument('script')
+    pstat = subparsers.add_parser('status', help='print the job states')
+    pstat.add_argument('jobids', nargs='*')
+    pcancel = subparsers.add_parser('cancel', help='cancel jobs')
+    pcancel.add_argument('jobids', nargs='+')
+    pwork = subparsers.add_parser('worker', help='run the queued jobs')
+    pwork.add_argument('--spool', default=None, dest='wspool')
+    pwork.add_argument('--maxprocs', type=int, default=None, dest='wmaxprocs')
+    args = parser.parse_args(args)
+
+    if args.command == 'submit':
+        jobid = submit(args.script, spool=args.spool, maxprocs=args.maxprocs)
+        print('Submitted batch job {0:d}'.format(jobid))
+    elif args.command == 'status':
+        if args.jobids:
+            states = query(args.jobids, spool=args.spool)
+        else:
+            spool, _ = get_settings(args.spool)
+            states = {str(r['id']): r['state'] for r in list_records(spool)}
+        for jobid in sorted(states, key=int):
+            print('{0}|{1}'.format(jobid, states[jobid]))
+    elif args.command == 'cancel':
+        cancel(args.jobids, spool=args.spool)
+    elif args.command == 'worker':
+        spool, maxprocs = get_settings(args.wspool or args.spool,
+                                       args.wmaxprocs or args.maxprocs)
+        worker(spool, maxprocs)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
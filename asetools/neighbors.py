@@ -0,0 +1,424 @@
+
+'''
+Neighbor searches with the minimum image convention
+
+:py:class:`NeighborIndex` is built once per `ase.Atoms` and answers the
+k-nearest and radius queries for many reference atoms (or points) at once.
+The periodic images of the atoms lying within `cutoff` of the unit cell are
+added to a KD-tree, so any (also triclinic) cell is supported and the
+distances are the minimum image ones as long as they do not exceed the
+`cutoff`, the index grows the cutoff by itself when a k-nearest query needs
+more.
+'''
+
+from __future__ import print_function, division, absolute_import
+
+import itertools
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class NeighborIndex(object):
+    '''
+    Periodic neighbor index of an `ase.Atoms`
+
+    Args:
+      atoms : ase.Atoms
+        Structure, the positions are copied so later changes of `atoms` are
+        not reflected
+      cutoff : float
+        Initial padding of the cell with the periodic images in Angstrom,
+        the largest distance the radius queries can return without
+        rebuilding the trees
+
+    Example::
+
+        index = NeighborIndex(atoms)
+        dist, idx = index.nearest(al_indices, k=4, symbols='O')
+        for idx, dist in index.within(al_indices, 3.5, symbols=['Si', 'Al']):
+            ...
+    '''
+
+    def __init__(self, atoms, cutoff=6.0):
+
+        self.symbols = np.array(atoms.get_chemical_symbols())
+        self.pbc = np.asarray(atoms.get_pbc(), dtype=bool)
+        self.cell = np.asarray(atoms.get_cell(), dtype=float)
+        self.cutoff = float(cutoff)
+
+        if self.pbc.any():
+            if np.any(np.linalg.norm(self.cell[self.pbc], axis=1) == 0.0):
+                raise ValueError('Periodic direction with a zero cell vector')
+            self.scaled = np.linalg.solve(self.cell.T,
+                                          atoms.get_positions().T).T
+            self.scaled[:, self.pbc] %= 1.0
+            self.positions = self.scaled.dot(self.cell)
+            # distances between the opposite faces of the cell
+            volume = abs(np.linalg.det(self.cell))
+            self.spacings = np.array([
+                volume / np.linalg.norm(np.cross(self.cell[(i + 1) % 3],
+                                                 self.cell[(i + 2) % 3]))
+                for i in range(3)])
+        else:
+            self.scaled = None
+            self.positions = atoms.get_positions()
+            self.spacings = None
+
+        self._trees = {}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _select(self, symbols):
+        'Return the indices of the atoms with `symbols` (all if `None`)'
+
+        if symbols is None:
+            return np.arange(len(self.symbols))
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        return np.flatnonzero(np.isin(self.symbols, list(symbols)))
+
+    def _images(self, indices, cutoff):
+        '''
+        Return the positions of the periodic images of the atoms `indices`
+        lying within `cutoff` of the cell and the atom index of each image
+        '''
+
+        if self.scaled is None:
+            return self.positions[indices], indices
+
+        pad = np.where(self.pbc, cutoff / self.spacings, 0.0)
+        ranges = [range(-int(np.ceil(p)), int(np.ceil(p)) + 1) if periodic
+                  else [0] for p, periodic in zip(pad, self.pbc)]
+
+        scaled = self.scaled[indices]
+        positions = []
+        owners = []
+        for shift in itertools.product(*ranges):
+            shifted = scaled + shift
+            inside = np.all((shifted >= -pad) & (shifted <= 1.0 + pad) |
+                            ~self.pbc, axis=1)
+            positions.append(shifted[inside].dot(self.cell))
+            owners.append(indices[inside])
+
+        return np.concatenate(positions), np.concatenate(owners)
+
+    def _tree(self, symbols, cutoff):
+        'Return the KD-tree with the images of the atoms with `symbols`'
+
+        key = (None if symbols is None else
+               frozenset([symbols] if isinstance(symbols, str) else symbols),
+               cutoff)
+        if key not in self._trees:
+            positions, owners = self._images(self._select(symbols), cutoff)
+            self._trees[key] = (cKDTree(positions) if len(positions) else None,
+                                owners)
+        return self._trees[key]
+
+    def _points(self, refs):
+        '''
+        Return the positions of `refs` (atom indices or an array of
+        Cartesian positions) in the cell and the atom excluded for each
+        '''
+
+        refs = np.asarray(refs)
+        if refs.ndim == 2:
+            points = refs.astype(float)
+            if self.scaled is not None:
+                scaled = np.linalg.solve(self.cell.T, points.T).T
+                scaled[:, self.pbc] %= 1.0
+                points = scaled.dot(self.cell)
+            return points, np.full(len(points), -1)
+
+        refs = np.atleast_1d(refs).astype(int)
+        return self.positions[refs], refs
+
+    def nearest(self, refs, k=1, symbols=None):
+        '''
+        Return the `k` nearest atoms (optionally only with the `symbols`) of
+        every reference, a reference atom is never its own neighbor
+
+        Args:
+          refs : int, list of int or array_like
+            Indices of the reference atoms or Cartesian positions with shape
+            (m, 3)
+          k : int
+            Number of neighbors
+          symbols : str or list of str
+            Chemical symbols of the neighbors to consider
+
+        Returns:
+          dist : numpy.array
+            Minimum image distances with shape (m, k) sorted in ascending
+            order, padded with `inf` if there are less than `k` candidates
+          idx : numpy.array
+            Indices of the neighbors with shape (m, k), padded with -1
+        '''
+
+        points, exclude = self._points(refs)
+        dist = np.full((len(points), k), np.inf)
+        idx = np.full((len(points), k), -1, dtype=int)
+        candidates = np.zeros(len(self.symbols), dtype=bool)
+        candidates[self._select(symbols)] = True
+        navail = int(candidates.sum())
+        # number of neighbors each reference can have
+        limit = np.minimum(k, navail - np.where(exclude >= 0,
+                                                candidates[exclude], False))
+
+        todo = np.arange(len(points))
+        cutoff = self.cutoff
+        while len(todo):
+            tree, owners = self._tree(symbols, cutoff)
+            if tree is None:
+                break
+
+            # images of the same atom and the reference itself are skipped
+            nquery = min(tree.n, (k + 1) * max(1, tree.n // max(1, navail)))
+            rows = todo
+            while len(rows):
+                dq, iq = tree.query(points[rows], k=nquery)
+                dq, iq = self._unique(dq.reshape(len(rows), -1),
+                                      owners[iq.reshape(len(rows), -1)],
+                                      exclude[rows], k)
+                dist[rows, :dq.shape[1]] = dq
+                idx[rows, :iq.shape[1]] = iq
+                if nquery >= tree.n:
+                    break
+                rows = rows[(iq >= 0).sum(axis=1) < limit[rows]]
+                nquery = min(tree.n, 2 * nquery)
+
+            if self.scaled is None:
+                break
+            # results beyond the padding might miss closer images
+            kth = np.where(np.isfinite(dist[todo]), dist[todo], 0.0).max(axis=1)
+            todo = todo[kth > cutoff]
+            cutoff *= 2.0
+
+        return dist, idx
+
+    @staticmethod
+    def _unique(dist, owners, exclude, k):
+        '''
+        Return the distances and the owners of the first `k` distinct owners
+        other than `exclude` in every row, padded with `inf` and -1
+        '''
+
+        rows = np.arange(len(owners))[:, np.newaxis]
+        order = np.argsort(owners, axis=1, kind='stable')
+        ordered = owners[rows, order]
+        repeated = np.zeros(owners.shape, dtype=bool)
+        repeated[rows, order[:, 1:]] = ordered[:, 1:] == ordered[:, :-1]
+
+        keep = ~repeated & (owners != exclude[:, np.newaxis]) & \
+            np.isfinite(dist)
+        first = np.argsort(~keep, axis=1, kind='stable')[:, :k]
+        kept = keep[rows, first]
+        return (np.where(kept, dist[rows, first], np.inf),
+                np.where(kept, owners[rows, first], -1))
+
+    def within(self, refs, radius, symbols=None):
+        '''
+        Return the atoms (optionally only with the `symbols`) within
+        `radius` of every reference, a reference atom is never its own
+        neighbor
+
+        Args:
+          refs : int, list of int or array_like
+            Indices of the reference atoms or Cartesian positions with shape
+            (m, 3)
+          radius : float
+            Search radius in Angstrom
+          symbols : str or list of str
+            Chemical symbols of the neighbors to consider
+
+        Returns:
+          out : list of tuple
+            For every reference the indices of the neighbors and their
+            minimum image distances sorted by the distance
+        '''
+
+        points, exclude = self._points(refs)
+        cutoff = max(self.cutoff, radius)
+        tree, owners = self._tree(symbols, cutoff)
+
+        out = []
+        if tree is None:
+            return [(np.zeros(0, dtype=int), np.zeros(0))
+                    for _ in range(len(points))]
+
+        for point, excl, hits in zip(points, exclude,
+                                     tree.query_ball_point(points, radius)):
+            hits = np.asarray(hits, dtype=int)
+            d = np.linalg.norm(tree.data[hits] - point, axis=1)
+            o = owners[hits]
+            order = np.argsort(d, kind='stable')
+            d, o = d[order], o[order]
+            # keep the closest image of every atom
+            _, first = np.unique(o, return_index=True)
+            first = np.sort(first)
+            d, o = d[first], o[first]
+            keep = o != excl
+            out.append((o[keep], d[keep]))
+
+        return out
+
+
+def match_points(x, y, k=4, cell=None, pbc=False, method='greedy',
+                 index=None):
+    '''
+    Assign to every point of `x` a distinct point of `y`
+
+    With the ``'greedy'`` method the closest pairs are matched first, each
+    round pairs every unmatched point of `x` with its nearest free point of
+    `y` unless a closer point of `x` claims the same partner. Only the `k`
+    nearest candidates are considered and `k` is doubled for the points
+    left without a partner. The ``'optimal'`` method minimizes the sum of
+    the distances with ``scipy.optimize.linear_sum_assignment`` on the full
+    distance matrix, which is much slower for thousands of points.
+
+    Args:
+      x : array_like
+        Positions with shape (n, 3) or a batch of frames with shape
+        (nframes, n, 3), each frame is matched separately
+      y : array_like
+        Positions with shape (m, 3)
+      k : int
+        Initial number of candidates per point
+      cell : array_like
+        Unit cell for the minimum image distances
+      pbc : bool or list of bool
+        Periodic directions of the `cell`
+      method : str
+        ``'greedy'`` or ``'optimal'``
+      index : NeighborIndex
+        Prebuilt index of `y`, to reuse for many calls
+
+    Returns:
+      out : numpy.array
+        Indices of the partners in `y` with shape (n,) or (nframes, n), -1
+        for the points left over when `x` has more points than `y`
+    '''
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    single = x.ndim == 2
+    if single:
+        x = x[np.newaxis]
+    nframes, npoints = x.shape[:2]
+    ny = len(y)
+
+    out = np.full(nframes * npoints, -1, dtype=int)
+    if ny == 0 or npoints == 0:
+        return out.reshape(nframes, npoints)[0] if single \
+            else out.reshape(nframes, npoints)
+
+    if method == 'optimal':
+        from ase.geometry import get_distances
+        from scipy.optimize import linear_sum_assignment
+
+        out = out.reshape(nframes, npoints)
+        for frame, positions in zip(out, x):
+            if cell is None or not np.any(pbc):
+                _, dist = get_distances(positions, y)
+            else:
+                _, dist = get_distances(positions, y, cell=cell, pbc=pbc)
+            rows, cols = linear_sum_assignment(dist)
+            frame[rows] = cols
+        return out[0] if single else out
+
+    if method != 'greedy':
+        raise ValueError('Unknown method: {0}'.format(method))
+
+    if index is None:
+        from ase import Atoms
+        index = NeighborIndex(Atoms(numbers=np.zeros(ny, dtype=int),
+                                    positions=y, cell=cell, pbc=pbc))
+
+    points = x.reshape(-1, 3)
+    frames = np.repeat(np.arange(nframes), npoints)
+    # the partners are taken per frame
+    used = np.zeros(nframes * ny, dtype=bool)
+
+    todo = np.arange(len(points))
+    k = max(1, min(k, ny))
+    while len(todo):
+        dist, idx = index.nearest(points[todo], k=k)
+        keys = frames[todo][:, np.newaxis] * ny + idx
+        open_ = idx >= 0
+        while True:
+            free = np.where(open_ & ~used[np.where(open_, keys, 0)], dist,
+                            np.inf)
+            best = free.argmin(axis=1)
+            rows = np.flatnonzero(np.isfinite(free[np.arange(len(free)),
+                                                   best]))
+            if not len(rows):
+                break
+            cols = best[rows]
+            claims = keys[rows, cols]
+            order = np.lexsort((free[rows, cols], claims))
+            _, first = np.unique(claims[order], return_index=True)
+            winners = rows[order[first]]
+            wcols = best[winners]
+            out[todo[winners]] = idx[winners, wcols]
+            used[keys[winners, wcols]] = True
+            open_[winners] = False
+
+        todo = todo[out[todo] < 0]
+        if k >= ny:
+            break
+        k = min(ny, 2 * k)
+
+    return out.reshape(nframes, npoints)[0] if single \
+        else out.reshape(nframes, npoints)
+
+
+def match_atoms(atoms, reference, k=4, method='greedy'):
+    '''
+    Map the atoms onto the atoms of the same element in `reference`, e.g.
+    between two relaxed structures or for every frame of a trajectory
+
+    The distances follow the minimum image convention in the cell of the
+    `reference`.
+
+    Args:
+      atoms : ase.Atoms or list of ase.Atoms
+        Structure or frames with the same chemical symbols in the same order,
+        ValueError is raised otherwise
+      reference : ase.Atoms
+        Structure to map onto
+      k : int
+        See :py:func:`match_points`
+      method : str
+        See :py:func:`match_points`
+
+    Returns:
+      out : numpy.array
+        Index in `reference` of every atom with shape (n,) or (nframes, n),
+        -1 for the atoms without a partner
+    '''
+
+    single = not isinstance(atoms, (list, tuple))
+    frames = [atoms] if single else atoms
+
+    symbols = frames[0].get_chemical_symbols()
+    if any(frame.get_chemical_symbols() != symbols for frame in frames[1:]):
+        raise ValueError('Frames have different atom orders, match them '
+                         'separately')
+    symbols = np.array(symbols)
+    refsymbols = np.array(reference.get_chemical_symbols())
+    positions = np.array([frame.get_positions() for frame in frames])
+    cell = reference.get_cell()
+    pbc = reference.get_pbc()
+
+    out = np.full(positions.shape[:2], -1, dtype=int)
+    for symbol in np.unique(symbols):
+        mine = np.flatnonzero(symbols == symbol)
+        theirs = np.flatnonzero(refsymbols == symbol)
+        if not len(theirs):
+            continue
+        matched = match_points(positions[:, mine], reference.positions[theirs],
+                               k=k, cell=cell, pbc=pbc, method=method)
+        out[:, mine] = np.where(matched >= 0, theirs[matched], -1)
+
+    return out[0] if single else out
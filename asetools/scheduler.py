@@ -0,0 +1,314 @@
+
+'''Query the state of the jobs submitted to the batch systems'''
+
+from __future__ import print_function, absolute_import
+
+import subprocess
+
+from . import localbatch
+
+
+# maximal number of job ids passed to a single scheduler call
+MAXIDS = 5000
+
+# normalized states used in `Job.status`
+QUEUED = 'queued'
+RUNNING = 'running'
+SUSPENDED = 'suspended'
+COMPLETED = 'completed'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+
+# states after which the job will not change anymore
+FINAL_STATES = (COMPLETED, FAILED, TIMEOUT, CANCELLED)
+
+# final states of the jobs that did not end successfully
+FAILED_STATES = (FAILED, TIMEOUT, CANCELLED)
+
+SLURM_STATES = {
+    'PENDING': QUEUED,
+    'REQUEUED': QUEUED,
+    'REQUEUE_HOLD': QUEUED,
+    'REQUEUE_FED': QUEUED,
+    'CONFIGURING': RUNNING,
+    'RUNNING': RUNNING,
+    'COMPLETING': RUNNING,
+    'STAGE_OUT': RUNNING,
+    'RESIZING': RUNNING,
+    'SIGNALING': RUNNING,
+    'SUSPENDED': SUSPENDED,
+    'STOPPED': SUSPENDED,
+    'PREEMPTED': FAILED,
+    'COMPLETED': COMPLETED,
+    'FAILED': FAILED,
+    'BOOT_FAIL': FAILED,
+    'NODE_FAIL': FAILED,
+    'OUT_OF_MEMORY': FAILED,
+    'DEADLINE': TIMEOUT,
+    'TIMEOUT': TIMEOUT,
+    'CANCELLED': CANCELLED,
+    'REVOKED': CANCELLED,
+}
+
+PBS_STATES = {
+    'Q': QUEUED,
+    'H': QUEUED,
+    'W': QUEUED,
+    'T': QUEUED,
+    'B': RUNNING,
+    'R': RUNNING,
+    'E': RUNNING,
+    'S': SUSPENDED,
+    'U': SUSPENDED,
+}
+
+# PBS states of the jobs that ended, the outcome is taken from the exit status
+PBS_FINAL = ('X', 'F', 'C')
+
+# negative PBS exit statuses of the jobs killed for exceeding the walltime
+# (PBS Pro JOB_EXEC_KILL_WALLTIME and Torque JOB_EXEC_OVERLIMIT_WT)
+PBS_WALLTIME_EXITS = (-29, -11)
+
+# batch systems exiting with non zero status when some of the queried jobs
+# are unknown (e.g. purged from the history), the output is parsed anyway
+PARTIAL_EXIT = ('pbs',)
+
+
+def slurm_command(batchids):
+    '''
+    Return the executable and the arguments of the `sacct` command reporting
+    the state of `batchids`
+    '''
+
+    # all the tasks of an array are reported for the array job id
+    jobids = sorted(set(b.split('_')[0] for b in batchids))
+    return ['sacct'], ['--noheader', '--parsable2', '--allocations',
+                       '--format=JobID,State', '--jobs=' + ','.join(jobids)]
+
+
+def parse_slurm(output):
+    '''
+    Parse the output of ``sacct --parsable2 --format=JobID,State``
+
+    Returns:
+      states : dict
+        Normalized states with the job ids as keys
+    '''
+
+    states = {}
+    for line in output.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) < 2 or not fields[0]:
+            continue
+        # e.g. "CANCELLED by 1234"
+        state = fields[1].split()[0].rstrip('+') if fields[1].strip() else ''
+        state = SLURM_STATES.get(state, state.lower())
+        for jobid in expand_slurm_array(fields[0]):
+            states[jobid] = state
+    return states
+
+
+def expand_slurm_array(jobid):
+    '''
+    Expand the pending array tasks reported by Slurm in the compressed
+    form, e.g. ``123_[0-3,7%2]``, into the individual task ids
+    '''
+
+    if '_[' not in jobid:
+        return [jobid]
+
+    base, spec = jobid.split('_[', 1)
+    spec = spec.rstrip(']').split('%')[0]
+    taskids = []
+    for part in spec.split(','):
+        if '-' in part:
+            start, stop = part.split('-')
+            taskids.extend(range(int(start), int(stop) + 1))
+        elif part:
+            taskids.append(int(part))
+    return ['{0}_{1:d}'.format(base, t) for t in taskids]
+
+
+def pbs_command(batchids):
+    '''
+    Return the executable and the arguments of the `qstat` command reporting
+    the state of `batchids`
+    '''
+
+    return ['qstat'], ['-x', '-f', '-t'] + list(batchids)
+
+
+def pbs_state(state, exit_status):
+    '''
+    Return the normalized state of a PBS job from its `job_state` and
+    `Exit_status` (None when not reported)
+
+    A job that ended is completed only with zero exit status, it timed out
+    when killed for the walltime, it was cancelled when deleted before
+    running (no exit status) and failed otherwise.
+    '''
+
+    if state not in PBS_FINAL:
+        return PBS_STATES.get(state, state.lower())
+
+    if exit_status is None:
+        return CANCELLED
+
+    try:
+        code = int(exit_status)
+    except ValueError:
+        return FAILED
+
+    if code == 0:
+        return COMPLETED
+    elif code in PBS_WALLTIME_EXITS:
+        return TIMEOUT
+    return FAILED
+
+
+def parse_pbs(output):
+    '''
+    Parse the full output of ``qstat -x -f -t``, array subjobs are reported
+    as ``1234[5]``
+
+    Returns:
+      states : dict
+        Normalized states with the job ids (without the server name) as keys
+    '''
+
+    jobs = []
+    for line in output.splitlines():
+        if line.startswith('Job Id:'):
+            jobid = line.split(':', 1)[1].strip().split('.')[0]
+            jobs.append([jobid, None, None])
+        elif jobs and '=' in line:
+            key, value = [x.strip() for x in line.split('=', 1)]
+            if key == 'job_state':
+                jobs[-1][1] = value
+            elif key.lower() == 'exit_status':
+                jobs[-1][2] = value
+
+    return {jobid: pbs_state(state, exit_status)
+            for jobid, state, exit_status in jobs if state}
+
+
+def local_command(batchids):
+    '''
+    Return the executable and the arguments of the command reporting the
+    state of `batchids` in the local batch system
+    (:py:mod:`asetools.localbatch`), the output has the same format as the
+    one of `sacct` and is parsed with :py:func:`parse_slurm`
+    '''
+
+    return list(localbatch.COMMAND), ['status'] + list(batchids)
+
+
+SCHEDULERS = {
+    'slurm': (slurm_command, parse_slurm),
+    'pbs': (pbs_command, parse_pbs),
+    'local': (local_command, parse_slurm),
+}
+
+
+# commands cancelling jobs, followed by the job ids
+CANCEL_COMMANDS = {
+    'slurm': ['scancel'],
+    'pbs': ['qdel'],
+    'local': localbatch.COMMAND + ['cancel'],
+}
+
+
+def cancel_jobs(batchids, batch='slurm', command=None):
+    '''
+    Cancel the jobs `batchids` in the batch system, the jobs that ended
+    already are ignored
+
+    Args:
+      batchids : list of str
+        Job identifiers assigned by the batch system
+      batch : str
+        Batch system, `slurm`, `pbs` or `local`
+      command : list of str
+        Replacement for the cancel command, e.g. ``['ssh', 'host',
+        'scancel']``
+    '''
+
+    if batch.lower() not in CANCEL_COMMANDS:
+        raise NotImplementedError("support for '{0:s}' is not implemented, supported batch "
+            "systems are: {1:s}".format(batch, ", ".join(CANCEL_COMMANDS.keys())))
+
+    if command is None:
+        command = CANCEL_COMMANDS[batch.lower()]
+
+    batchids = [str(b) for b in batchids]
+    for i in range(0, len(batchids), MAXIDS):
+        # non zero exit status for the jobs no longer known is expected
+        subprocess.call(list(command) + batchids[i:i + MAXIDS])
+
+
+def scheduler_calls(batchids, batch='slurm', command=None):
+    '''
+    Return the scheduler commands (one per `MAXIDS` jobs) reporting the
+    state of `batchids` together with the parser of their output, see
+    :py:func:`query_states` for the arguments
+
+    Returns:
+      calls : list of tuple
+        Pairs of the command (list of str) and the output parser
+    '''
+
+    if batch.lower() not in SCHEDULERS:
+        raise NotImplementedError("support for '{0:s}' is not implemented, supported batch "
+            "systems are: {1:s}".format(batch, ", ".join(SCHEDULERS.keys())))
+
+    builder, parser = SCHEDULERS[batch.lower()]
+
+    batchids = [str(b) for b in batchids]
+    calls = []
+    for i in range(0, len(batchids), MAXIDS):
+        executable, args = builder(batchids[i:i + MAXIDS])
+        if command is not None:
+            executable = list(command)
+        calls.append((executable + args, parser))
+
+    return calls
+
+
+def query_states(batchids, batch='slurm', command=None):
+    '''
+    Return the normalized states of the jobs `batchids` with a single call
+    to the batch system (per `MAXIDS` jobs)
+
+    Args:
+      batchids : list of str
+        Job identifiers assigned by the batch system
+      batch : str
+        Batch system, `slurm`, `pbs` or `local`
+      command : list of str
+        Executable (with optional leading arguments) replacing the default
+        ``sacct``/``qstat`` (or the local batch system command), e.g. a script printing canned output for
+        testing
+
+    Returns:
+      states : dict
+        Normalized states with the job ids as keys, jobs unknown to the
+        scheduler are not included
+
+    Raises:
+      subprocess.CalledProcessError:
+        when the scheduler call fails, except for the batch systems in
+        `PARTIAL_EXIT` whose output is parsed regardless of the exit status
+    '''
+
+    states = {}
+    for cmd, parser in scheduler_calls(batchids, batch=batch, command=command):
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        output, _ = proc.communicate()
+        if proc.returncode != 0 and batch.lower() not in PARTIAL_EXIT:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', 'replace')
+        states.update(parser(output))
+
+    return states
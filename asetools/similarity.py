@@ -0,0 +1,267 @@
+
+'''
+Root mean square deviations between many structures
+
+The deviations are evaluated on blocks of frames with NumPy, so memory
+stays bounded by `block` frames at a time while whole trajectories
+(:py:func:`rmsd_to_reference`) or all pairs of a set of structures
+(:py:func:`rmsd_matrix`) are compared. Optionally the displacements follow
+the minimum image convention, the atoms are matched element-wise before
+comparing (for structures with a different atom order) and the structures
+are superimposed with the Kabsch algorithm.
+'''
+
+from __future__ import print_function, division, absolute_import
+
+import numpy as np
+from ase.geometry import find_mic
+
+from .neighbors import match_atoms
+
+
+def _check(structures, reference):
+    'Raise ValueError if the `structures` do not match the `reference`'
+
+    natoms = len(reference)
+    symbols = sorted(reference.get_chemical_symbols())
+    for atoms in structures:
+        if len(atoms) != natoms:
+            raise ValueError('Atoms have different sizes {0:d} != {1:d}'.format(
+                len(atoms), natoms))
+        if sorted(atoms.get_chemical_symbols()) != symbols:
+            raise ValueError('Atoms have different compositions: {0} != '
+                             '{1}'.format(atoms.get_chemical_formula(),
+                                          reference.get_chemical_formula()))
+
+
+def kabsch_rmsd(displaced, reference):
+    '''
+    Return the RMSD of every frame after the optimal superposition on the
+    `reference`
+
+    Args:
+      displaced : numpy.array
+        Positions of the frames with shape (nframes, n, 3)
+      reference : numpy.array
+        Positions of the reference with shape (n, 3)
+
+    Returns:
+      out : numpy.array
+        RMSD of every frame
+    '''
+
+    p = displaced - displaced.mean(axis=1)[:, np.newaxis]
+    q = reference - reference.mean(axis=0)
+    # covariance matrices of all frames at once
+    h = np.einsum('fni,nj->fij', p, q)
+    u, s, vt = np.linalg.svd(h)
+    # proper rotations only
+    sign = np.sign(np.linalg.det(np.matmul(u, vt)))
+    s[:, -1] *= sign
+
+    squared = (p ** 2).sum(axis=(1, 2)) + (q ** 2).sum() - 2.0 * s.sum(axis=1)
+    return np.sqrt(np.maximum(squared, 0.0) / len(q))
+
+
+def _kabsch_rotations(displaced, reference):
+    '''
+    Return the rotation matrices (nframes, 3, 3) superimposing the centered
+    frames `displaced` on the centered `reference` as ``p @ r``
+    '''
+
+    p = displaced - displaced.mean(axis=1)[:, np.newaxis]
+    q = reference - reference.mean(axis=0)
+    u, _, vt = np.linalg.svd(np.einsum('fni,nj->fij', p, q))
+    # proper rotations only
+    u[:, :, -1] *= np.sign(np.linalg.det(np.matmul(u, vt)))[:, np.newaxis]
+    return np.matmul(u, vt)
+
+
+def _principal_rotations(centered, refcentered):
+    '''
+    Return the proper rotations (nframes, 3, 3) bringing the principal axes
+    of the `centered` frames onto the ones of `refcentered`, one for each
+    of the 4 orientations of the axes
+    '''
+
+    _, vf = np.linalg.eigh(np.einsum('fni,fnj->fij', centered, centered))
+    _, vr = np.linalg.eigh(np.dot(refcentered.T, refcentered))
+    handedness = np.sign(np.linalg.det(vf) * np.linalg.det(vr))
+
+    rotations = []
+    for signs in [(1, 1, 1), (1, -1, -1), (-1, 1, -1), (-1, -1, 1)]:
+        d = np.tile(np.array(signs, dtype=float), (len(centered), 1))
+        d[:, 2] *= handedness
+        rotations.append(np.matmul(vf * d[:, np.newaxis, :], vr.T))
+    return rotations
+
+
+def _align_match(frames, reference, method, maxiter=20):
+    '''
+    Match the atoms of the `frames` (all with the same atom order) onto
+    `reference` after the superposition, alternating the superposition and
+    the matching until the permutation stops changing
+
+    The iterations start from the frames as they are, from their principal
+    axes orientations and (for the atom order of the reference) from the
+    given order, the permutation with the lowest RMSD is kept.
+    '''
+
+    refpos = reference.get_positions()
+    positions = np.array([atoms.get_positions() for atoms in frames])
+    centered = positions - positions.mean(axis=1)[:, np.newaxis]
+    refcentered = refpos - refpos.mean(axis=0)
+    rows = np.arange(len(frames))[:, np.newaxis]
+    moved = [atoms.copy() for atoms in frames]
+
+    def superpose(mapping):
+        ordered = np.empty_like(positions)
+        ordered[rows, mapping] = positions
+        return _kabsch_rotations(ordered, refpos)
+
+    starts = [np.tile(np.eye(3), (len(frames), 1, 1))]
+    starts.extend(_principal_rotations(centered, refcentered))
+    if frames[0].get_chemical_symbols() == reference.get_chemical_symbols():
+        starts.append(superpose(np.tile(np.arange(len(reference)),
+                                        (len(frames), 1))))
+
+    best = np.full((len(frames), len(reference)), -1, dtype=int)
+    bestrmsd = np.full(len(frames), np.inf)
+    for rotations in starts:
+        mapping = None
+        for _ in range(maxiter):
+            aligned = np.matmul(centered, rotations) + refpos.mean(axis=0)
+            for atoms, pos in zip(moved, aligned):
+                atoms.set_positions(pos)
+            matched = match_atoms(moved, reference, method=method)
+            if np.any(matched < 0) or np.array_equal(matched, mapping):
+                break
+            mapping = matched
+            rotations = superpose(mapping)
+
+        if mapping is None or np.any(mapping < 0):
+            continue
+        ordered = np.empty_like(positions)
+        ordered[rows, mapping] = positions
+        rmsd = kabsch_rmsd(ordered, refpos)
+        better = rmsd < bestrmsd
+        best[better] = mapping[better]
+        bestrmsd[better] = rmsd[better]
+
+    return best
+
+
+def _block_rmsd(frames, reference, align, mic, permute, method):
+    'Return the RMSD of the list of `frames` against `reference`'
+
+    positions = np.array([atoms.get_positions() for atoms in frames])
+    refpos = reference.get_positions()
+
+    if permute:
+        # position of every atom in the reference order, the frames are
+        # matched in groups with the same atom order
+        groups = {}
+        for i, atoms in enumerate(frames):
+            groups.setdefault(tuple(atoms.get_chemical_symbols()),
+                              []).append(i)
+
+        reordered = np.empty_like(positions)
+        for members in groups.values():
+            group = [frames[i] for i in members]
+            if align:
+                mapping = _align_match(group, reference, method)
+            else:
+                mapping = match_atoms(group, reference, method=method)
+            if np.any(mapping < 0):
+                raise ValueError('Atoms could not be matched to the '
+                                 'reference')
+            rows = np.array(members)[:, np.newaxis]
+            reordered[rows, mapping] = positions[members]
+        positions = reordered
+
+    disp = positions - refpos
+    if mic:
+        shape = disp.shape
+        disp, _ = find_mic(disp.reshape(-1, 3), reference.get_cell(),
+                           reference.get_pbc())
+        disp = disp.reshape(shape)
+
+    if align:
+        # unwrapped positions next to the reference before the superposition
+        return kabsch_rmsd(refpos + disp, refpos)
+
+    return np.sqrt((disp ** 2).sum(axis=(1, 2)) / len(refpos))
+
+
+def rmsd_to_reference(frames, reference, align=False, mic=False,
+                      permute=False, method='greedy', block=256):
+    '''
+    Calculate the RMSD of every frame against the `reference`
+
+    Args:
+      frames : list of ase.Atoms
+        Structures (e.g. a trajectory) with the same composition as
+        `reference`
+      reference : ase.Atoms
+        Reference structure, its cell is used for the minimum image
+        convention
+      align : bool
+        Superimpose every frame on the reference (Kabsch) first
+      mic : bool
+        Use the minimum image displacements
+      permute : bool
+        Match the atoms of the same element between the frames and the
+        reference by distance instead of relying on the atom order, with
+        `align` the matching and the superposition are repeated in turn
+        until the matching stops changing
+      method : str
+        Matching method, ``'greedy'`` or ``'optimal'``, see
+        :py:func:`asetools.neighbors.match_points`
+      block : int
+        Number of frames processed at once
+
+    Returns:
+      out : numpy.array
+        RMSD of every frame in Angstrom
+    '''
+
+    frames = list(frames)
+    _check(frames, reference)
+
+    out = np.zeros(len(frames))
+    for start in range(0, len(frames), block):
+        out[start:start + block] = _block_rmsd(frames[start:start + block],
+                                               reference, align, mic,
+                                               permute, method)
+    return out
+
+
+def rmsd_matrix(structures, align=False, mic=False, permute=False,
+                method='greedy', block=64):
+    '''
+    Calculate the symmetric matrix of the RMSD between all pairs of
+    `structures`, see :py:func:`rmsd_to_reference` for the arguments
+
+    The element ``[i, j]`` is computed with the structure `i` as the
+    reference, which decides the cell for `mic` and the atom order for
+    `permute`.
+
+    Returns:
+      out : numpy.array
+        RMSD matrix with shape (n, n) in Angstrom
+    '''
+
+    structures = list(structures)
+    if structures:
+        _check(structures, structures[0])
+
+    n = len(structures)
+    out = np.zeros((n, n))
+    for i in range(n - 1):
+        for start in range(i + 1, n, block):
+            stop = min(n, start + block)
+            values = _block_rmsd(structures[start:stop], structures[i],
+                                 align, mic, permute, method)
+            out[i, start:stop] = values
+            out[start:stop, i] = values
+    return out
@@ -11,6 +11,7 @@ import subprocess
 from argparse import ArgumentParser
 from datetime import datetime
 
+from . import localbatch
 from .asetools import get_config
 
 # keep backwards compatibility with python2
@@ -51,7 +52,8 @@ def query_yes_no(question, default="yes"):
                              "(or 'y' or 'n').\n")
 
 
-def main(args=None):
+def get_parser():
+    'Return the argument parser for the job submission options'
 
     parser = ArgumentParser(usage='script used to generate submission script for batch systems')
     group = parser.add_mutually_exclusive_group()
@@ -66,6 +68,10 @@ def main(args=None):
                        type=int,
                        default="1",
                        help="number of nodes, default=1")
+    parser.add_argument('--dependency',
+                        default=None,
+                        help='Dependency on other jobs in the Slurm syntax, e.g. afterok:123:124, '
+                        'translated to "-W depend=" for PBS. Default: none.')
     parser.add_argument('-d', '--nosubmit',
                         action='store_true',
                         help='Create job script, but do not submit.')
@@ -102,17 +108,38 @@ def main(args=None):
                         default="120:00:00",
                         help="walltime in the format HH:MM:SS, default=120:00:00")
 
+    return parser
+
+
+def main(args=None, workdir=None):
+    '''
+    Write and submit the job script for a single input
+
+    Args:
+        args: (list)
+            command line arguments, taken from `sys.argv` if `None`
+        workdir: (str)
+            directory with the input where the job script is written and
+            submitted from, default is the current directory
+
+    Returns:
+        pid: (str)
+            the job id assigned by the batch system or `None`
+    '''
+
+    parser = get_parser()
+
     if args:  # arguments passed from other python code
         args = vars(parser.parse_args(args))
     else:     # run from command line
         args = vars(parser.parse_args())
 
-    args['workdir'] = os.getcwd()
+    args['workdir'] = os.getcwd() if workdir is None else workdir
     args['jobname'] = os.path.splitext(args["input"])[0]
     args['outfile'] = args['jobname'] + ".out"
     args['script_name'] = "run." + args['jobname']
 
-    submit(args)
+    return submit(args)
 
 
 def submit(args):
@@ -122,13 +149,11 @@ def submit(args):
 
     args: (dict)
         arguments specifying the job
-    '''
 
-    submitters = {"pbs": {'directives_writer': create_pbs_directives,
-                          'executable': 'qsub'},
-                  "slurm": {'directives_writer': create_slurm_directives,
-                            'executable': 'sbatch'}
-                  }
+    Returns:
+        pid: (str)
+            the job id assigned by the batch system or `None`
+    '''
 
     # get the site configuration from the $HOME/.asetools_site_config.py file
     # and merge it into the args dictionary
@@ -138,7 +163,7 @@ def submit(args):
 
     submitter = submitters.get(args['batch'].lower(), None)
     if submitter is not None:
-        write_and_submit_script(args, submitter)
+        return write_and_submit_script(args, submitter)
     else:
         raise NotImplementedError("support for '{0:s}' is not implemented, supported batch "
             "systems are: {1:s}".format(args['batch'], ", ".join(submitters.keys())))
@@ -157,9 +182,14 @@ def write_and_submit_script(args, submitter):
             'directives_writer': name of function to write the batch
             directives, and  'executable': the command responsible for
             submission.
+
+    Returns:
+        pid: (str)
+            the job id assigned by the batch system or `None` if the job was
+            not submitted
     '''
 
-    if os.path.exists(args['script_name']):
+    if os.path.exists(os.path.join(args['workdir'], args['script_name'])):
         message = 'Job script: {} exists, overwrite?'.format(args['script_name'])
         if query_yes_no(message):
             write_job_script(args,submitter['directives_writer'])
@@ -170,24 +200,43 @@ def write_and_submit_script(args, submitter):
         write_job_script(args,submitter['directives_writer'])
 
     # submit the job to the queue if requested
+    pid = None
     if args['nosubmit']:
         print("NOT submitting {} to the queue\nbye...".format(args['script_name']))
     else:
-        output = subprocess.check_output([submitter['executable'], args['script_name']])
-        patt = re.compile(r"[a-zA-Z\.]*(\d+)[a-zA-Z\.]*")
-        match = patt.search(str(output))
-        if match:
-            pid = str(match.group(1))
+        output = subprocess.check_output(submit_command(submitter, args['script_name']),
+                                         cwd=args['workdir'])
+        pid = parse_pid(output)
+        if pid is not None:
             with open(os.path.join(args['home'], "submitted_jobs.dat"), "a") as dat:
                 dat.write('{0} {1:>12s} {2:>20s}\n'.format(
-                    pid, os.getcwd(), str(datetime.now().strftime("%Y-%m-%d+%H:%M:%S"))))
-        else:
-            pid = None
+                    pid, args['workdir'], str(datetime.now().strftime("%Y-%m-%d+%H:%M:%S"))))
 
         print("Submitted batch job {0}".format(pid))
 
+    return pid
+
+
+def submit_command(submitter, script_name):
+    'Return the command submitting `script_name` with the `submitter`'
 
-def write_job_script(args, directives_writer):
+    executable = submitter['executable']
+    if isinstance(executable, (list, tuple)):
+        return list(executable) + [script_name]
+    return [executable, script_name]
+
+
+def parse_pid(output):
+    'Return the job id from the output of the submission command or `None`'
+
+    patt = re.compile(r"[a-zA-Z\.]*(\d+)[a-zA-Z\.]*")
+    match = patt.search(str(output))
+    if match:
+        return str(match.group(1))
+    return None
+
+
+def write_job_script(args, directives_writer, preamble=None, cmdargs=None):
     '''
     Writes the job script for the batch system.
 
@@ -196,15 +245,24 @@ def write_job_script(args, directives_writer):
             arguments specifying the job.
         directives_writer: (function)
             function creating a string of directives for the batch system.
+        preamble: (str)
+            shell code written right after the directives
+        cmdargs: (dict)
+            values overriding `args` when formatting the commands
     '''
 
     if not args['program'] in args['jobspec']:
         sys.exit('Dont know the job specifications for program: {0}. Exiting...'.format(args['program']))
     else:
         jobspec = args['jobspec'][args['program']]
-        with open(args['script_name'], 'w') as script:
+        fmtargs = dict(args, **cmdargs) if cmdargs else args
+        # may raise for unsupported options, before the script is created
+        directives = directives_writer(args)
+        with open(os.path.join(args['workdir'], args['script_name']), 'w') as script:
             script.write("#!/bin/bash\n")
-            script.write(directives_writer(args) + '\n')
+            script.write(directives + '\n')
+            if preamble is not None:
+                script.write(preamble + '\n')
             if 'lib_paths' in args and args['lib_paths'] != "":
                 script.write('export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:{0:<s}\n\n'.format(":".join(args['lib_paths'])))
             if 'modules' in jobspec:
@@ -213,17 +271,17 @@ def write_job_script(args, directives_writer):
                 for name, value in args['vars']:
                     script.write("export {n}={v}\n".format(n=name, v=value))
             if 'precmd' in jobspec:
-                script.write('\n' + jobspec['precmd'].format(**args) + '\n')
+                script.write('\n' + jobspec['precmd'].format(**fmtargs) + '\n')
             if args['scratch']:
-                wrkdir = os.path.join(args['scratch'], args['jobname'])
+                wrkdir = os.path.join(args['scratch'], fmtargs['jobname'])
                 script.write("mkdir -p {}\n".format(wrkdir))
-                files = args['input']
+                files = fmtargs['input']
                 if args['extrafiles']:
                     files += ' ' + ' '.join(args['extrafiles'])
                 script.write('cp -t {0} {1}\n'.format(wrkdir, files))
                 script.write('cd {0}\n'.format(wrkdir))
             script.write("\n# Do the work\n")
-            script.write(jobspec['cmd'].format(**args) + '\n')
+            script.write(jobspec['cmd'].format(**fmtargs) + '\n')
             if 'postcmd' in jobspec:
                 script.write(jobspec['postcmd'])
 
@@ -256,6 +314,9 @@ def create_pbs_directives(args):
 
     directives += "#PBS -j oe\n"
 
+    if args.get('dependency'):
+        directives += "#PBS -W depend={}\n".format(args['dependency'])
+
     return directives
 
 
@@ -280,7 +341,167 @@ def create_slurm_directives(args):
                             "#SBATCH --mail-type=FAIL\n"
                             ])
 
+    if args.get('dependency'):
+        directives += "#SBATCH --dependency={}\n".format(args['dependency'])
+
+    return directives
+
+def create_slurm_array_directives(args):
+    '''
+    Creates the SLURM directives for an array job script with
+    `args['ntasks']` tasks, at most `args['maxrun']` running at a time.
+    '''
+
+    array = "#SBATCH --array=0-{0:d}".format(args['ntasks'] - 1)
+    if args.get('maxrun'):
+        array += "%{0:d}".format(args['maxrun'])
+    directives = create_slurm_directives(args)
+    directives += array + "\n"
+    directives += "#SBATCH --output={0}_%A_%a.out\n".format(args['jobname'])
+
     return directives
 
+
+def create_pbs_array_directives(args):
+    '''
+    Creates the PBS directives for an array job script with `args['ntasks']`
+    subjobs.
+    '''
+
+    directives = create_pbs_directives(args)
+    directives += "#PBS -J 0-{0:d}\n".format(args['ntasks'] - 1)
+
+    return directives
+
+
+def create_local_directives(args):
+    '''
+    Creates the comments describing the job for the local batch system, see
+    :py:mod:`asetools.localbatch`, the jobs run on the current machine so
+    no resources are requested.
+
+    Args:
+        args: (dict)
+            arguments specifying the job.
+
+    Returns:
+        directives: (str)
+            the comment lines that can be written to a job script.
+    '''
+
+    directives = '\n'.join(["# local job: {}".format(args['jobname']),
+                            "# submitted from: {}\n".format(args['workdir'])])
+
+    # the local jobs start as soon as a slot is free
+    if args.get('dependency'):
+        raise NotImplementedError('The local batch system does not support '
+                                  'job dependencies: {}'.format(
+                                      args['dependency']))
+
+    return directives
+
+
+# the batch systems, for array jobs 'taskvar' is the environment variable
+# with the task index and 'taskid' the format of the id of a single task
+submitters = {"pbs": {'directives_writer': create_pbs_directives,
+                      'array_directives_writer': create_pbs_array_directives,
+                      'executable': 'qsub',
+                      'taskvar': 'PBS_ARRAY_INDEX',
+                      'taskid': '{pid}[{task:d}]'},
+              "slurm": {'directives_writer': create_slurm_directives,
+                        'array_directives_writer': create_slurm_array_directives,
+                        'executable': 'sbatch',
+                        'taskvar': 'SLURM_ARRAY_TASK_ID',
+                        'taskid': '{pid}_{task:d}'},
+              "local": {'directives_writer': create_local_directives,
+                        'executable': localbatch.COMMAND + ['submit']},
+              }
+
+# select the line of the index file for the task and go to its directory
+ARRAY_PREAMBLE = '''
+IFS=$'\\t' read -r TASK JOBDIR INPUT <<< "$(sed -n "$((${taskvar} + 1))p" {index})"
+JOBNAME="${{INPUT%.*}}"
+cd "$JOBDIR"
+'''
+
+
+def submit_array(jobs, args=None, workdir=None, name='array', maxrun=None):
+    '''
+    Write a single array job script together with an index file mapping the
+    task ids to the job directories and submit it with one call to the batch
+    system.
+
+    Args:
+        jobs: (list)
+            tuples with the job directory and the name of the input file
+        args: (list)
+            command line arguments as for :py:func:`main` without the input
+        workdir: (str)
+            directory where the array script and the index file are written
+            and submitted from, default is the current directory
+        name: (str)
+            name of the array, the script is `run.<name>` and the index file
+            `<name>.idx`
+        maxrun: (int)
+            maximal number of tasks running at the same time (Slurm only)
+
+    Returns:
+        pid: (str)
+            the job id assigned by the batch system or `None`
+        taskids: (list)
+            ids of the individual tasks in the order of `jobs`
+    '''
+
+    if len(jobs) == 0:
+        raise ValueError('No jobs to submit')
+
+    args = vars(get_parser().parse_args([name] + list(args or [])))
+    args['workdir'] = os.getcwd() if workdir is None else workdir
+    args['jobname'] = name
+    args['script_name'] = "run." + name
+    args['ntasks'] = len(jobs)
+    args['maxrun'] = maxrun
+    args.update(get_config())
+
+    submitter = submitters.get(args['batch'].lower(), None)
+    if submitter is None or 'array_directives_writer' not in submitter:
+        raise NotImplementedError("array jobs are not supported for '{0:s}', supported batch "
+            "systems are: {1:s}".format(args['batch'], ", ".join(
+                k for k, v in submitters.items() if 'array_directives_writer' in v)))
+
+    index = os.path.join(args['workdir'], name + '.idx')
+    with open(index, 'w') as fidx:
+        for task, (jobdir, inpname) in enumerate(jobs):
+            fidx.write('{0:d}\t{1}\t{2}\n'.format(task, jobdir, inpname))
+
+    # the job specific values are resolved by the script at runtime
+    cmdargs = {'input': '"$INPUT"', 'jobname': '"$JOBNAME"',
+               'outfile': '"$JOBNAME".out', 'workdir': '"$JOBDIR"'}
+    preamble = ARRAY_PREAMBLE.format(taskvar=submitter['taskvar'], index=index)
+
+    print('Creating array job script: {0} with {1:d} tasks'.format(
+        args['script_name'], len(jobs)))
+    write_job_script(args, submitter['array_directives_writer'],
+                     preamble=preamble, cmdargs=cmdargs)
+
+    if args['nosubmit']:
+        print("NOT submitting {} to the queue\nbye...".format(args['script_name']))
+        return None, [None] * len(jobs)
+
+    output = subprocess.check_output(submit_command(submitter, args['script_name']),
+                                     cwd=args['workdir'])
+    pid = parse_pid(output)
+    if pid is None:
+        return None, [None] * len(jobs)
+
+    with open(os.path.join(args['home'], "submitted_jobs.dat"), "a") as dat:
+        dat.write('{0} {1:>12s} {2:>20s}\n'.format(
+            pid, args['workdir'], str(datetime.now().strftime("%Y-%m-%d+%H:%M:%S"))))
+    print("Submitted array job {0} with {1:d} tasks".format(pid, len(jobs)))
+
+    return pid, [submitter['taskid'].format(pid=pid, task=i)
+                 for i in range(len(jobs))]
+
+
 if __name__ == "__main__":
     main(None)
@@ -0,0 +1,312 @@
+
+'''
+Vectorized thermochemistry in the harmonic and ideal gas approximations
+
+The functions evaluate the same expressions as
+:py:class:`ase.thermochemistry.HarmonicThermo` and
+:py:class:`ase.thermochemistry.IdealGasThermo` but for a whole batch of
+vibration sets over arrays of temperatures (and pressures) at once. The
+vibrational energies of the batch are stored in a single two dimensional
+array padded with `NaN` so that sets with different number of modes can be
+evaluated together.
+'''
+
+from __future__ import print_function, division, absolute_import
+
+import numpy as np
+
+from ase import units
+
+
+# reference pressure of the translational entropy in Pa
+REFERENCE_PRESSURE = 1.0e5
+
+# maximal number of elements in the intermediate (sets, modes, temperatures)
+# arrays
+BLOCKSIZE = 2 ** 22
+
+
+def pad_energies(vibenergies_list, ignore_imag=False):
+    '''
+    Convert a list of vibrational energies into a `NaN` padded array
+
+    Args:
+      vibenergies_list : list of array_like
+        Vibrational energies in eV of each set, may be complex
+      ignore_imag : bool
+        Drop the imaginary modes instead of raising `ValueError`
+
+    Returns:
+      energies : numpy.array
+        Real energies with shape (nsets, nmodes)
+    '''
+
+    sets = []
+    for i, vibenergies in enumerate(vibenergies_list):
+        e = np.asarray(vibenergies)
+        if np.iscomplexobj(e):
+            imag = e.imag != 0.0
+            if imag.any():
+                if not ignore_imag:
+                    raise ValueError('Imaginary vibrational energies present '
+                                     'in set {0:d}'.format(i))
+                e = e[~imag]
+            e = e.real
+        if ignore_imag:
+            e = e[e > 0.0]
+        sets.append(e.astype(float))
+
+    nmodes = max([len(e) for e in sets] + [0])
+    energies = np.full((len(sets), nmodes), np.nan)
+    for i, e in enumerate(sets):
+        energies[i, :len(e)] = e
+
+    return energies
+
+
+def select_vibrations(vibenergies, natoms, geometry):
+    '''
+    Return the highest ``3N - 6`` (``3N - 5`` for linear, none for
+    monatomic) vibrational energies, same as the default
+    `vib_selection='highest'` of `IdealGasThermo`
+    '''
+
+    if geometry == 'nonlinear':
+        nvibs = 3 * natoms - 6
+    elif geometry == 'linear':
+        nvibs = 3 * natoms - 5
+    elif geometry == 'monatomic':
+        nvibs = 0
+    else:
+        raise ValueError('Unsupported geometry: {}'.format(geometry))
+
+    e = np.asarray(vibenergies)
+    e = e[np.argsort((e ** 2).real, kind='stable')]
+    if nvibs == 0:
+        return e[:0]
+    if len(e) < nvibs:
+        raise ValueError('Too few vibrations ({0:d}), {1:d} expected'.format(
+            len(e), nvibs))
+    return e[-nvibs:]
+
+
+def zero_point_energy(energies):
+    '''
+    Zero point energy in eV, shape (nsets,)
+
+    Args:
+      energies : numpy.array
+        Padded vibrational energies with shape (nsets, nmodes)
+    '''
+
+    return 0.5 * np.nansum(energies, axis=1)
+
+
+def vibrational_terms(energies, temperatures):
+    '''
+    Vibrational contribution to the internal energy from 0 K to T in eV and
+    the vibrational entropy in eV/K, both with shape (nsets, ntemps)
+
+    The intermediate (nsets, nmodes, ntemps) arrays are evaluated in blocks
+    of sets with at most `BLOCKSIZE` elements to bound the memory.
+    '''
+
+    temperatures = np.atleast_1d(np.asarray(temperatures, dtype=float))
+    nsets, nmodes = energies.shape
+
+    du = np.zeros((nsets, len(temperatures)))
+    s = np.zeros((nsets, len(temperatures)))
+
+    step = max(1, BLOCKSIZE // max(1, nmodes * len(temperatures)))
+    for i in range(0, nsets, step):
+        e = energies[i:i + step, :, np.newaxis]
+        x = e / (units.kB * temperatures)
+        with np.errstate(over='ignore'):
+            em1 = np.expm1(x)
+            du[i:i + step] = np.nansum(e / em1, axis=1)
+            s[i:i + step] = units.kB * np.nansum(
+                x / em1 - np.log(-np.expm1(-x)), axis=1)
+
+    return du, s
+
+
+def harmonic(energies, temperatures, potentialenergy=0.0):
+    '''
+    Thermochemistry of a batch of vibration sets in the harmonic
+    approximation
+
+    Args:
+      energies : numpy.array
+        Padded vibrational energies with shape (nsets, nmodes), see
+        :py:func:`pad_energies`
+      temperatures : array_like
+        Temperatures in K
+      potentialenergy : float or array_like
+        Potential energies in eV of each set
+
+    Returns:
+      out : dict
+        `zpe` with shape (nsets,), `internal_energy`, `entropy` and
+        `free_energy` (Helmholtz) with shape (nsets, ntemps)
+    '''
+
+    temperatures = np.atleast_1d(np.asarray(temperatures, dtype=float))
+    epot = np.broadcast_to(np.asarray(potentialenergy, dtype=float),
+                           (energies.shape[0],))
+
+    zpe = zero_point_energy(energies)
+    du, s = vibrational_terms(energies, temperatures)
+    u = (epot + zpe)[:, np.newaxis] + du
+
+    return {
+        'zpe': zpe,
+        'internal_energy': u,
+        'entropy': s,
+        'free_energy': u - temperatures * s,
+    }
+
+
+def ideal_gas(energies, temperatures, pressures, masses, inertias, geometry,
+              symmetrynumber, spin, potentialenergy=0.0):
+    '''
+    Thermochemistry of a batch of molecules in the ideal gas approximation
+
+    Args:
+      energies : numpy.array
+        Padded vibrational energies with shape (nsets, nmodes), only the
+        true vibrations (see :py:func:`select_vibrations`)
+      temperatures : array_like
+        Temperatures in K
+      pressures : array_like
+        Pressures in Pa
+      masses : array_like
+        Total mass of each molecule in amu
+      inertias : array_like
+        Principal moments of inertia in amu*Angstrom**2 with shape (nsets, 3)
+      geometry : str or list of str
+        `monatomic`, `linear` or `nonlinear`
+      symmetrynumber : int or array_like
+        Rotational symmetry numbers
+      spin : float or array_like
+        Total electronic spins
+      potentialenergy : float or array_like
+        Potential energies in eV
+
+    Returns:
+      out : dict
+        `zpe` with shape (nsets,), `internal_energy` and `enthalpy` with
+        shape (nsets, ntemps), `entropy` and `free_energy` (Gibbs) with
+        shape (nsets, ntemps, npressures)
+    '''
+
+    nsets = energies.shape[0]
+    temperatures = np.atleast_1d(np.asarray(temperatures, dtype=float))
+    pressures = np.atleast_1d(np.asarray(pressures, dtype=float))
+
+    def batch(value, dtype=float):
+        return np.broadcast_to(np.asarray(value, dtype=dtype), (nsets,))
+
+    epot = batch(potentialenergy)
+    masses = batch(masses)
+    sigma = batch(symmetrynumber)
+    spin = batch(spin)
+    geometry = batch(geometry, dtype=object)
+    inertias = np.asarray(inertias, dtype=float).reshape(nsets, 3)
+
+    unknown = set(geometry) - set(['monatomic', 'linear', 'nonlinear'])
+    if unknown:
+        raise ValueError('Unsupported geometry: {}'.format(', '.join(unknown)))
+
+    linear = (geometry == 'linear')
+    nonlinear = (geometry == 'nonlinear')
+
+    kT = units.kB * temperatures
+
+    # rotational heat capacity in units of kB
+    cvrot = np.where(nonlinear, 1.5, np.where(linear, 1.0, 0.0))
+
+    zpe = zero_point_energy(energies)
+    du, sv = vibrational_terms(energies, temperatures)
+    u = (epot + zpe)[:, np.newaxis] + (1.5 + cvrot)[:, np.newaxis] * kT + du
+    h = u + kT
+
+    # translational entropy at the reference pressure
+    m = masses[:, np.newaxis] * units._amu
+    st = (2 * np.pi * m * units._k * temperatures /
+          units._hplanck ** 2) ** 1.5
+    st *= units._k * temperatures / REFERENCE_PRESSURE
+    st = units.kB * (np.log(st) + 2.5)
+
+    # rotational entropy, moments of inertia in kg m^2
+    inertias = inertias * units._amu / 1e10 ** 2
+    srot = np.zeros((nsets, len(temperatures)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fac = 8.0 * np.pi ** 2 * units._k * temperatures / units._hplanck ** 2
+        snl = np.sqrt(np.pi * np.prod(inertias, axis=1))[:, np.newaxis] /\
+            sigma[:, np.newaxis] * fac ** 1.5
+        snl = units.kB * (np.log(snl) + 1.5)
+        sl = inertias.max(axis=1)[:, np.newaxis] * fac / sigma[:, np.newaxis]
+        sl = units.kB * (np.log(sl) + 1.0)
+    srot = np.where(nonlinear[:, np.newaxis], snl, srot)
+    srot = np.where(linear[:, np.newaxis], sl, srot)
+
+    se = units.kB * np.log(2 * spin + 1)
+
+    s = st + srot + se[:, np.newaxis] + sv
+    # pressure correction of the translational entropy
+    s = s[:, :, np.newaxis] -\
+        units.kB * np.log(pressures / REFERENCE_PRESSURE)
+
+    return {
+        'zpe': zpe,
+        'internal_energy': u,
+        'enthalpy': h,
+        'entropy': s,
+        'free_energy': h[:, :, np.newaxis] -
+        temperatures[:, np.newaxis] * s,
+    }
+
+
+def ideal_gas_atoms(vibenergies_list, atoms_list, temperatures, pressures,
+                    geometry, symmetrynumber, spin, potentialenergy=0.0,
+                    ignore_imag=False):
+    '''
+    Convenience wrapper around :py:func:`ideal_gas` taking the masses and
+    moments of inertia from the `ase.Atoms` instances and selecting the true
+    vibrations from the vibrational energies
+
+    Args:
+      vibenergies_list : list of array_like
+        Vibrational energies in eV of each molecule
+      atoms_list : list of ase.Atoms
+        Molecules
+      temperatures : array_like
+        Temperatures in K
+      pressures : array_like
+        Pressures in Pa
+      geometry : str or list of str
+        `monatomic`, `linear` or `nonlinear`
+      symmetrynumber : int or array_like
+        Rotational symmetry numbers
+      spin : float or array_like
+        Total electronic spins
+      potentialenergy : float or array_like
+        Potential energies in eV
+      ignore_imag : bool
+        Drop the imaginary modes instead of raising `ValueError`
+    '''
+
+    geometries = np.broadcast_to(np.asarray(geometry, dtype=object),
+                                 (len(atoms_list),))
+
+    selected = [select_vibrations(e, len(atoms), geom)
+                for e, atoms, geom in zip(vibenergies_list, atoms_list,
+                                          geometries)]
+
+    return ideal_gas(pad_energies(selected, ignore_imag=ignore_imag),
+                     temperatures, pressures,
+                     masses=[atoms.get_masses().sum() for atoms in atoms_list],
+                     inertias=[atoms.get_moments_of_inertia()
+                               for atoms in atoms_list],
+                     geometry=geometries, symmetrynumber=symmetrynumber,
+                     spin=spin, potentialenergy=potentialenergy)
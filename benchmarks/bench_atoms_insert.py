@@ -0,0 +1,118 @@
+'''
+Benchmark writing atoms rows into the database: the per atom ORM path
+(as ``atoms2db`` used to work) against the bulk executemany path of
+:py:func:`asetools.db.dbinterface.bulk_insert_atoms`.
+
+Usage::
+
+    $ python benchmarks/bench_atoms_insert.py --natoms 10000 --repeat 3
+'''
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from ase.build import bulk
+from ase.calculators.emt import EMT
+
+from asetools.db.model import Base, DBAtom, System
+from asetools.db.dbinterface import (get_forces, atoms2system, add_systems,
+                                     get_session)
+
+
+def legacy_atoms2db(atoms):
+    'The original implementation going through ase.Atom proxies'
+
+    dbatoms = []
+
+    inimagm = atoms.get_initial_magnetic_moments()
+    inichar = atoms.get_initial_charges()
+    forces = get_forces(atoms)
+    if forces is None:
+        forces = [[None] * 3 for _ in range(len(atoms))]
+
+    for atom, imagm, icharge, force in zip(atoms, inimagm, inichar, forces):
+
+        dbatoms.append(DBAtom(
+            atomic_number=int(atom.number),
+            mass=atom.mass,
+            tag=int(atom.tag),
+            x=atom.position[0],
+            y=atom.position[1],
+            z=atom.position[2],
+            force_x=force[0],
+            force_y=force[1],
+            force_z=force[2],
+            momentum_x=atom.momentum[0],
+            momentum_y=atom.momentum[1],
+            momentum_z=atom.momentum[2],
+            charge=atom.charge,
+            magmom=atom.magmom,
+            initial_magmom=imagm,
+            initial_charge=icharge,
+        ))
+
+    return dbatoms
+
+
+def make_atoms(natoms):
+    'Return a Cu supercell with approximately `natoms` atoms and forces'
+
+    n = max(1, int(round((natoms / 4.0) ** (1.0 / 3.0))))
+    atoms = bulk('Cu', cubic=True).repeat((n, n, n))
+    atoms.rattle(stdev=0.05, seed=42)
+    atoms.calc = EMT()
+    atoms.get_forces()
+    return atoms
+
+
+def legacy(session, atoms):
+    system = atoms2system(atoms, name='legacy', bulk=True)
+    system.atoms = legacy_atoms2db(atoms)
+    session.add(system)
+    session.commit()
+
+
+def bulkpath(session, atoms):
+    system = atoms2system(atoms, name='bulk', bulk=True)
+    add_systems(session, [system], [atoms])
+    session.commit()
+
+
+def timeit(func, session, atoms, repeat):
+    'Return the best time out of `repeat` runs'
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(session, atoms)
+        times.append(time.perf_counter() - start)
+        session.query(DBAtom).delete()
+        session.query(System).delete()
+        session.commit()
+    return min(times)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--natoms', type=int, default=10000,
+                        help='approximate number of atoms per batch')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--db', default=':memory:', help='sqlite database')
+    args = parser.parse_args()
+
+    atoms = make_atoms(args.natoms)
+    session = get_session(args.db)
+    Base.metadata.create_all(session.get_bind())
+
+    print('batch of {0:d} atoms'.format(len(atoms)))
+    for label, func in [('orm per atom', legacy), ('bulk insert', bulkpath)]:
+        t = timeit(func, session, atoms, args.repeat)
+        print('{0:15s} {1:10.4f} s {2:15.0f} rows/s'.format(label, t,
+                                                           len(atoms) / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+'''
+Benchmark the hot lookup queries on a synthetic SQLite database with and
+without the lookup indexes defined on the models.
+
+Usage::
+
+    $ python benchmarks/bench_queries.py --nsystems 50000 --db bench.db
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import time
+
+from sqlalchemy import bindparam, create_engine, select, text
+
+from asetools.db.model import (Base, DBAtom, Job, System, SystemNote,
+                               VibrationSet, Vibration)
+
+
+TOPOLOGIES = ['MFI', 'CHA', 'FAU', 'BEA', 'MOR', 'TON', 'AFI', 'LTA']
+JOBNAMES = ['relax', 'freq', 'thermo']
+STATUSES = ['not started', 'submitted', 'running', 'finished', 'failed']
+
+
+def populate(engine, nsystems, natoms, seed=42):
+    'Fill the database with `nsystems` synthetic systems'
+
+    rnd = random.Random(seed)
+
+    systems, jobs, atoms, vibsets, vibs, notes = [], [], [], [], [], []
+    jobid = atomid = vibsetid = vibid = 0
+
+    for sid in range(1, nsystems + 1):
+        topo = rnd.choice(TOPOLOGIES)
+        systems.append({'id': sid, 'name': 'system-{0:06d}'.format(sid),
+                        'topology': topo,
+                        'formula': 'Al{0:d}O{1:d}Si{2:d}'.format(
+                            rnd.randint(1, 4), 96, rnd.randint(40, 48))})
+        notes.append({'system_id': sid, 'key': 'point_group',
+                      'type': 'string', 'char_value': rnd.choice(['C1', 'Cs'])})
+        for name in JOBNAMES:
+            jobid += 1
+            jobs.append({'id': jobid, 'system_id': sid, 'name': name,
+                         'status': rnd.choice(STATUSES)})
+        for _ in range(natoms):
+            atomid += 1
+            atoms.append({'id': atomid, 'system_id': sid, 'atomic_number': 14,
+                          'x': rnd.random(), 'y': rnd.random(),
+                          'z': rnd.random()})
+        vibsetid += 1
+        vibsets.append({'id': vibsetid, 'system_id': sid, 'name': 'PHVA'})
+        for _ in range(3):
+            vibid += 1
+            vibs.append({'id': vibid, 'vibrationset_id': vibsetid,
+                         'energy_real': rnd.random(), 'energy_imag': 0.0})
+
+    with engine.begin() as conn:
+        for model, rows in [(System, systems), (Job, jobs), (DBAtom, atoms),
+                            (VibrationSet, vibsets), (Vibration, vibs),
+                            (SystemNote, notes)]:
+            conn.execute(model.__table__.insert(), rows)
+
+
+def queries(nsystems, nrepeat, seed=7):
+    'Return a list of (label, statement, list of parameters) to benchmark'
+
+    rnd = random.Random(seed)
+    ids = [rnd.randint(1, nsystems) for _ in range(nrepeat)]
+
+    s, j, a = System.__table__, Job.__table__, DBAtom.__table__
+    v, n = VibrationSet.__table__, SystemNote.__table__
+
+    return [
+        ('System.name ==', select(s.c.id).where(s.c.name == bindparam('p')),
+         [{'p': 'system-{0:06d}'.format(i)} for i in ids]),
+        ('System.topology, formula',
+         select(s.c.id).where(s.c.topology == bindparam('p')).
+         where(s.c.formula == 'Al2O96Si44'),
+         [{'p': rnd.choice(TOPOLOGIES)} for _ in ids]),
+        ('Job by system_id, name',
+         select(j.c.id).where(j.c.system_id == bindparam('p')).
+         where(j.c.name == 'relax'),
+         [{'p': i} for i in ids]),
+        ('Job.status ==',
+         select(j.c.id).where(j.c.name == 'freq').
+         where(j.c.status == bindparam('p')),
+         [{'p': rnd.choice(STATUSES)} for _ in ids[:max(1, nrepeat // 10)]]),
+        ('DBAtom by system_id',
+         select(a.c.x, a.c.y, a.c.z).where(a.c.system_id == bindparam('p')).
+         order_by(a.c.id),
+         [{'p': i} for i in ids]),
+        ('VibrationSet by name, system',
+         select(v.c.id).where(v.c.name == 'PHVA').
+         where(v.c.system_id == bindparam('p')),
+         [{'p': i} for i in ids]),
+        ('system_notes.key ==',
+         select(n.c.system_id).where(n.c.key == 'point_group').
+         where(n.c.char_value == bindparam('p')),
+         [{'p': 'Cs'} for _ in ids[:max(1, nrepeat // 10)]]),
+    ]
+
+
+def run(engine, stmts):
+    'Return the average time per execution of each statement'
+
+    out = []
+    with engine.connect() as conn:
+        for label, stmt, params in stmts:
+            start = time.perf_counter()
+            for p in params:
+                conn.execute(stmt, p).fetchall()
+            out.append((label, (time.perf_counter() - start) / len(params)))
+    return out
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nsystems', type=int, default=50000)
+    parser.add_argument('--natoms', type=int, default=10,
+                        help='number of atom rows per system')
+    parser.add_argument('--nrepeat', type=int, default=200,
+                        help='number of executions per query')
+    parser.add_argument('--db', default='bench_queries.db',
+                        help='sqlite database file, recreated')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+
+    engine = create_engine('sqlite:///{0:s}'.format(args.db))
+    Base.metadata.create_all(engine)
+
+    indexes = [ix for table in Base.metadata.sorted_tables
+               for ix in table.indexes]
+
+    start = time.perf_counter()
+    populate(engine, args.nsystems, args.natoms)
+    print('populated {0:d} systems in {1:.1f} s'.format(
+        args.nsystems, time.perf_counter() - start))
+
+    stmts = queries(args.nsystems, args.nrepeat)
+
+    for ix in indexes:
+        ix.drop(engine)
+    without = run(engine, stmts)
+
+    for ix in indexes:
+        ix.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text('ANALYZE'))
+    withidx = run(engine, stmts)
+
+    print('{0:30s} {1:>14s} {2:>14s} {3:>9s}'.format(
+        'query', 'no index [ms]', 'indexed [ms]', 'speedup'))
+    for (label, t0), (_, t1) in zip(without, withidx):
+        print('{0:30s} {1:14.3f} {2:14.3f} {3:9.1f}'.format(
+            label, t0 * 1e3, t1 * 1e3, t0 / t1))
+
+
+if __name__ == '__main__':
+    main()
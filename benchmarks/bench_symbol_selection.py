@@ -0,0 +1,131 @@
+
+'''
+Benchmark the symbol based selection helpers of :py:mod:`asetools.asetools`
+on a large zeolite-like supercell: the original implementations iterating
+over ase.Atom proxies against the vectorized ones built on
+:py:func:`asetools.asetools.symbol_indices`.
+
+Usage::
+
+    $ python benchmarks/bench_symbol_selection.py --natoms 20000 --repeat 3
+'''
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+from ase.build import bulk
+
+from asetools.asetools import (get_indices_by_symbols, remove_atom_by_symbols,
+                               substitute_atom, set_init_magmoms,
+                               assign_magnetic_moments_by_symbols)
+
+
+def legacy_get_indices_by_symbols(atoms, symbollist, mode='include'):
+    if mode == 'include':
+        return [atom.index for atom in atoms if atom.symbol in symbollist]
+    elif mode == 'exclude':
+        return [atom.index for atom in atoms if atom.symbol not in symbollist]
+
+
+def legacy_remove_atom_by_symbols(atoms, symbollist):
+    del atoms[[atom.index for atom in atoms if atom.symbol in symbollist]]
+
+
+def legacy_substitute_atom(atoms, a1, a2):
+    for i in legacy_get_indices_by_symbols(atoms, [a1]):
+        atoms[i].symbol = a2
+
+
+def legacy_set_init_magmoms(atoms, magset):
+    new_magmoms = [0.0] * len(atoms)
+    for name, magmom in magset:
+        for i in legacy_get_indices_by_symbols(atoms, [name]):
+            new_magmoms[i] = magmom
+    atoms.set_initial_magnetic_moments(new_magmoms)
+
+
+def legacy_assign_magnetic_moments_by_symbols(atoms, magdict):
+    magmoms = np.zeros(len(atoms), dtype=float)
+    for symbol, magm in magdict.items():
+        mask = np.array([s == symbol for s in atoms.get_chemical_symbols()])
+        magmoms[mask] = magm
+        atoms.set_initial_magnetic_moments(magmoms)
+
+
+MAGMOMS = {'Fe': 4.0, 'Cu': 1.0}
+
+CASES = [
+    ('get_indices_by_symbols',
+     lambda a: legacy_get_indices_by_symbols(a, ['Al', 'O']),
+     lambda a: get_indices_by_symbols(a, ['Al', 'O'])),
+    ('remove_atom_by_symbols',
+     lambda a: legacy_remove_atom_by_symbols(a, ['Cu']),
+     lambda a: remove_atom_by_symbols(a, ['Cu'])),
+    ('substitute_atom',
+     lambda a: legacy_substitute_atom(a, 'Al', 'Ga'),
+     lambda a: substitute_atom(a, 'Al', 'Ga')),
+    ('set_init_magmoms',
+     lambda a: legacy_set_init_magmoms(a, list(MAGMOMS.items())),
+     lambda a: set_init_magmoms(a, list(MAGMOMS.items()))),
+    ('assign_magmoms',
+     lambda a: legacy_assign_magnetic_moments_by_symbols(a, MAGMOMS),
+     lambda a: assign_magnetic_moments_by_symbols(a, MAGMOMS, clear=True)),
+]
+
+
+def make_atoms(natoms, seed=42):
+    'Return a Si/O supercell with approximately `natoms` atoms and dopants'
+
+    n = max(1, int(round((natoms / 8.0) ** (1.0 / 3.0))))
+    atoms = bulk('Si', 'diamond', a=5.43, cubic=True).repeat((n, n, n))
+    rng = np.random.RandomState(seed)
+    symbols = np.array(atoms.get_chemical_symbols())
+    symbols[rng.rand(len(atoms)) < 0.6] = 'O'
+    for symbol, fraction in [('Al', 0.05), ('Fe', 0.01), ('Cu', 0.01)]:
+        symbols[rng.rand(len(atoms)) < fraction] = symbol
+    atoms.set_chemical_symbols(symbols)
+    return atoms
+
+
+def timeit(func, atoms, repeat):
+    'Return the best time out of `repeat` runs and the last result'
+
+    times = []
+    for _ in range(repeat):
+        copy = atoms.copy()
+        start = time.perf_counter()
+        result = func(copy)
+        times.append(time.perf_counter() - start)
+    return min(times), copy, result
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--natoms', type=int, default=20000,
+                        help='approximate number of atoms')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    atoms = make_atoms(args.natoms)
+    print('supercell of {0:d} atoms'.format(len(atoms)))
+    print('{0:25s} {1:>10s} {2:>10s} {3:>8s}'.format('helper', 'legacy [s]',
+                                                      'new [s]', 'speedup'))
+
+    for label, legacy, new in CASES:
+        told, aold, rold = timeit(legacy, atoms, args.repeat)
+        tnew, anew, rnew = timeit(new, atoms, args.repeat)
+
+        same = (rold == rnew and
+                aold.get_chemical_symbols() == anew.get_chemical_symbols() and
+                np.allclose(aold.get_initial_magnetic_moments(),
+                            anew.get_initial_magnetic_moments()))
+        print('{0:25s} {1:10.4f} {2:10.4f} {3:8.1f}{4}'.format(
+            label, told, tnew, told / tnew, '' if same else '  MISMATCH'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""pack atoms into atomarrays
+
+Revision ID: 3c9e1f4b7a21
+Revises: a4af2b0e5ca5
+Create Date: 2026-10-18 09:12:41.207311
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1f4b7a21'
+down_revision = 'a4af2b0e5ca5'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+
+# number of systems converted per transaction chunk
+CHUNKSIZE = 500
+
+atoms = sa.sql.table('atoms',
+        sa.Column('id', sa.Integer),
+        sa.Column('system_id', sa.Integer),
+        sa.Column('atomic_number', sa.Integer),
+        sa.Column('initial_magmom', sa.Float),
+        sa.Column('initial_charge', sa.Float),
+        sa.Column('mass', sa.Float),
+        sa.Column('tag', sa.Integer),
+        sa.Column('x', sa.Float),
+        sa.Column('y', sa.Float),
+        sa.Column('z', sa.Float),
+        sa.Column('momentum_x', sa.Float),
+        sa.Column('momentum_y', sa.Float),
+        sa.Column('momentum_z', sa.Float),
+        sa.Column('charge', sa.Float),
+        sa.Column('force_x', sa.Float),
+        sa.Column('force_y', sa.Float),
+        sa.Column('force_z', sa.Float),
+        sa.Column('magmom', sa.Float),
+        )
+
+atomarrays = sa.sql.table('atomarrays',
+        sa.Column('system_id', sa.Integer),
+        sa.Column('natoms', sa.Integer),
+        sa.Column('numbers', sa.LargeBinary),
+        sa.Column('positions', sa.LargeBinary),
+        sa.Column('momenta', sa.LargeBinary),
+        sa.Column('forces', sa.LargeBinary),
+        sa.Column('magmoms', sa.LargeBinary),
+        sa.Column('charges', sa.LargeBinary),
+        sa.Column('tags', sa.LargeBinary),
+        sa.Column('masses', sa.LargeBinary),
+        )
+
+# packed array name: (dtype, source columns in the atoms table)
+LAYOUT = [
+    ('numbers', '<i4', ['atomic_number']),
+    ('positions', '<f8', ['x', 'y', 'z']),
+    ('momenta', '<f8', ['momentum_x', 'momentum_y', 'momentum_z']),
+    ('forces', '<f8', ['force_x', 'force_y', 'force_z']),
+    ('magmoms', '<f8', ['magmom']),
+    ('charges', '<f8', ['charge']),
+    ('tags', '<i4', ['tag']),
+    ('masses', '<f8', ['mass']),
+]
+
+
+def chunks(seq, size):
+    'Yield successive chunks of `size` items from `seq`'
+
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def upgrade():
+
+    op.create_table(
+        'atomarrays',
+        sa.Column('system_id', sa.Integer, sa.ForeignKey('systems.id'),
+                  primary_key=True),
+        sa.Column('natoms', sa.Integer, nullable=False),
+        sa.Column('numbers', sa.LargeBinary),
+        sa.Column('positions', sa.LargeBinary),
+        sa.Column('momenta', sa.LargeBinary),
+        sa.Column('forces', sa.LargeBinary),
+        sa.Column('magmoms', sa.LargeBinary),
+        sa.Column('charges', sa.LargeBinary),
+        sa.Column('tags', sa.LargeBinary),
+        sa.Column('masses', sa.LargeBinary),
+        )
+
+    conn = op.get_bind()
+
+    sysids = [r[0] for r in conn.execute(
+        sa.select(atoms.c.system_id).distinct().
+        where(atoms.c.system_id.isnot(None)).
+        order_by(atoms.c.system_id))]
+
+    for chunk in chunks(sysids, CHUNKSIZE):
+
+        rows = conn.execute(
+            sa.select(atoms.c.system_id,
+                      *[atoms.c[c] for _, _, cols in LAYOUT for c in cols]).
+            where(atoms.c.system_id.in_(chunk)).
+            order_by(atoms.c.system_id, atoms.c.id)).fetchall()
+
+        data = np.array(rows, dtype=object)
+        ids = data[:, 0].astype(int)
+        bounds = np.flatnonzero(np.diff(ids)) + 1
+        starts = np.concatenate(([0], bounds))
+        stops = np.concatenate((bounds, [len(ids)]))
+
+        records = []
+        for start, stop in zip(starts, stops):
+            record = {'system_id': int(ids[start]), 'natoms': int(stop - start)}
+            col = 1
+            for name, dtype, cols in LAYOUT:
+                block = data[start:stop, col:col + len(cols)]
+                col += len(cols)
+                if any(v is None for v in block.flat):
+                    record[name] = None
+                else:
+                    record[name] = np.ascontiguousarray(
+                        block.astype(dtype)).tobytes()
+            records.append(record)
+
+        op.bulk_insert(atomarrays, records)
+        conn.execute(atoms.delete().where(atoms.c.system_id.in_(chunk)))
+
+
+def downgrade():
+
+    conn = op.get_bind()
+
+    sysids = [r[0] for r in conn.execute(
+        sa.select(atomarrays.c.system_id).order_by(atomarrays.c.system_id))]
+
+    for chunk in chunks(sysids, CHUNKSIZE):
+
+        rows = conn.execute(
+            sa.select(atomarrays).
+            where(atomarrays.c.system_id.in_(chunk))).fetchall()
+
+        records = []
+        for row in rows:
+            natoms = row.natoms
+            arrays = {}
+            for name, dtype, cols in LAYOUT:
+                blob = getattr(row, name)
+                if blob is None:
+                    arrays[name] = np.full((natoms, len(cols)), None)
+                else:
+                    arrays[name] = np.frombuffer(blob, dtype=dtype).\
+                        reshape(natoms, len(cols)).tolist()
+            for i in range(natoms):
+                record = {'system_id': row.system_id}
+                for name, _, cols in LAYOUT:
+                    for j, c in enumerate(cols):
+                        record[c] = arrays[name][i][j]
+                record['initial_magmom'] = record['magmom']
+                record['initial_charge'] = record['charge']
+                records.append(record)
+
+        op.bulk_insert(atoms, records)
+
+    op.drop_table('atomarrays')
@@ -0,0 +1,98 @@
+"""pack vibrations into vibrationsets
+
+Revision ID: 7d2a5c0e9b14
+Revises: 3c9e1f4b7a21
+Create Date: 2026-10-18 10:03:27.514902
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7d2a5c0e9b14'
+down_revision = '3c9e1f4b7a21'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+
+# number of vibration sets converted per chunk
+CHUNKSIZE = 1000
+
+vibrations = sa.sql.table('vibrations',
+        sa.Column('id', sa.Integer),
+        sa.Column('energy_real', sa.Float),
+        sa.Column('energy_imag', sa.Float),
+        sa.Column('vibrationset_id', sa.Integer),
+        )
+
+vibrationsets = sa.sql.table('vibrationsets',
+        sa.Column('id', sa.Integer),
+        sa.Column('energies', sa.LargeBinary),
+        )
+
+
+def chunks(seq, size):
+    'Yield successive chunks of `size` items from `seq`'
+
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def upgrade():
+
+    op.add_column('vibrationsets', sa.Column('energies', sa.LargeBinary))
+
+    conn = op.get_bind()
+
+    setids = [r[0] for r in conn.execute(
+        sa.select(vibrations.c.vibrationset_id).distinct().
+        order_by(vibrations.c.vibrationset_id))]
+
+    update = vibrationsets.update().\
+        where(vibrationsets.c.id == sa.bindparam('setid')).\
+        values(energies=sa.bindparam('blob'))
+
+    for chunk in chunks(setids, CHUNKSIZE):
+
+        rows = conn.execute(
+            sa.select(vibrations.c.vibrationset_id, vibrations.c.energy_real,
+                      vibrations.c.energy_imag).
+            where(vibrations.c.vibrationset_id.in_(chunk)).
+            order_by(vibrations.c.vibrationset_id, vibrations.c.id)).fetchall()
+
+        data = np.array(rows, dtype=float)
+        ids = data[:, 0].astype(int)
+        energies = data[:, 1] + 1j * data[:, 2]
+        bounds = np.flatnonzero(np.diff(ids)) + 1
+
+        params = []
+        for setid, block in zip(ids[np.concatenate(([0], bounds))],
+                                np.split(energies, bounds)):
+            params.append({'setid': int(setid),
+                           'blob': block.astype('<c16').tobytes()})
+
+        conn.execute(update, params)
+        conn.execute(vibrations.delete().
+                     where(vibrations.c.vibrationset_id.in_(chunk)))
+
+
+def downgrade():
+
+    conn = op.get_bind()
+
+    rows = conn.execute(
+        sa.select(vibrationsets.c.id, vibrationsets.c.energies).
+        where(vibrationsets.c.energies.isnot(None))).fetchall()
+
+    for chunk in chunks(rows, CHUNKSIZE):
+        records = []
+        for setid, blob in chunk:
+            energies = np.frombuffer(blob, dtype='<c16')
+            records.extend({'vibrationset_id': setid, 'energy_real': r,
+                            'energy_imag': i}
+                           for r, i in zip(energies.real.tolist(),
+                                           energies.imag.tolist()))
+        op.bulk_insert(vibrations, records)
+
+    op.drop_column('vibrationsets', 'energies')
@@ -0,0 +1,57 @@
+"""add lookup indexes
+
+Revision ID: b81f3d6a2c57
+Revises: 7d2a5c0e9b14
+Create Date: 2026-10-18 11:20:54.038167
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b81f3d6a2c57'
+down_revision = '7d2a5c0e9b14'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+# name of the index: (table, columns)
+INDEXES = [
+    ('ix_systems_name', 'systems', ['name']),
+    ('ix_systems_topology_formula', 'systems', ['topology', 'formula']),
+    ('ix_jobs_system_id_name', 'jobs', ['system_id', 'name']),
+    ('ix_jobs_name_status', 'jobs', ['name', 'status']),
+    ('ix_atoms_system_id_id', 'atoms', ['system_id', 'id']),
+    ('ix_vibrations_vibrationset_id', 'vibrations', ['vibrationset_id']),
+    ('ix_vibrationsets_system_id_name', 'vibrationsets', ['system_id', 'name']),
+    ('ix_vibrationsets_name', 'vibrationsets', ['name']),
+    ('ix_system_notes_key', 'system_notes', ['key']),
+]
+
+
+def existing():
+    'Return the indexes from INDEXES whose tables and columns exist'
+
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    out = []
+    for name, table, columns in INDEXES:
+        if table not in tables:
+            continue
+        names = set(c['name'] for c in inspector.get_columns(table))
+        if set(columns) <= names:
+            out.append((name, table, columns))
+    return out
+
+
+def upgrade():
+
+    for name, table, columns in existing():
+        op.create_index(name, table, columns)
+
+
+def downgrade():
+
+    for name, table, columns in existing():
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,45 @@
+"""add thermodata table
+
+Revision ID: c4f18e2a9d03
+Revises: b81f3d6a2c57
+Create Date: 2026-10-18 13:41:08.652390
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c4f18e2a9d03'
+down_revision = 'b81f3d6a2c57'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.create_table(
+        'thermodata',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('system_id', sa.Integer, sa.ForeignKey('systems.id'),
+                  nullable=False),
+        sa.Column('vibrationset_id', sa.Integer,
+                  sa.ForeignKey('vibrationsets.id')),
+        sa.Column('model', sa.String, nullable=False),
+        sa.Column('temperature', sa.Float, nullable=False),
+        sa.Column('pressure', sa.Float),
+        sa.Column('zpe', sa.Float),
+        sa.Column('internal_energy', sa.Float),
+        sa.Column('enthalpy', sa.Float),
+        sa.Column('entropy', sa.Float),
+        sa.Column('free_energy', sa.Float),
+        )
+
+    op.create_index('ix_thermodata_system_id_model', 'thermodata',
+                    ['system_id', 'model'])
+
+
+def downgrade():
+
+    op.drop_index('ix_thermodata_system_id_model', table_name='thermodata')
+    op.drop_table('thermodata')
@@ -0,0 +1,30 @@
+"""add output stamps to jobs
+
+Revision ID: d92b7e4c1f58
+Revises: c4f18e2a9d03
+Create Date: 2026-10-18 14:26:37.118205
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd92b7e4c1f58'
+down_revision = 'c4f18e2a9d03'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.add_column('jobs', sa.Column('outsize', sa.BigInteger))
+    op.add_column('jobs', sa.Column('outmtime', sa.Float))
+    op.add_column('jobs', sa.Column('outhash', sa.String))
+
+
+def downgrade():
+
+    op.drop_column('jobs', 'outhash')
+    op.drop_column('jobs', 'outmtime')
+    op.drop_column('jobs', 'outsize')
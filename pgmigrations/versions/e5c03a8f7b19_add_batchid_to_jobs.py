@@ -0,0 +1,28 @@
+"""add batchid to jobs
+
+Revision ID: e5c03a8f7b19
+Revises: d92b7e4c1f58
+Create Date: 2026-10-18 15:02:44.903516
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e5c03a8f7b19'
+down_revision = 'd92b7e4c1f58'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.add_column('jobs', sa.Column('batchid', sa.String))
+    op.add_column('jobs', sa.Column('statustime', sa.DateTime))
+
+
+def downgrade():
+
+    op.drop_column('jobs', 'statustime')
+    op.drop_column('jobs', 'batchid')
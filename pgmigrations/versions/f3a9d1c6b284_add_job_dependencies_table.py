@@ -0,0 +1,37 @@
+"""add job dependencies table
+
+Revision ID: f3a9d1c6b284
+Revises: e5c03a8f7b19
+Create Date: 2026-10-18 16:27:31.208645
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d1c6b284'
+down_revision = 'e5c03a8f7b19'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.create_table(
+        'job_dependencies',
+        sa.Column('job_id', sa.Integer, sa.ForeignKey('jobs.id'),
+                  primary_key=True),
+        sa.Column('depends_on_id', sa.Integer, sa.ForeignKey('jobs.id'),
+                  primary_key=True),
+        )
+
+    op.create_index('ix_job_dependencies_depends_on_id', 'job_dependencies',
+                    ['depends_on_id'])
+
+
+def downgrade():
+
+    op.drop_index('ix_job_dependencies_depends_on_id',
+                  table_name='job_dependencies')
+    op.drop_table('job_dependencies')
@@ -15,10 +15,12 @@ setup(
                         'alembic',
                         'ase',
                         'matplotlib'],
+    extras_require={'export': ['pyarrow']},
     entry_points={
         'console_scripts': [
             'submitQE = asetools.submit:main',
             'dbadd = asetools.db.dbinterface:add_system',
+            'dbexport = asetools.db.export:main',
             'trajextract = asetools.cli:trajextract',
             'traj2car = asetools.cli:traj_to_car',
             'aseconvert = asetools.cli:aseconvert',
@@ -0,0 +1,165 @@
+
+'''
+Tests of the scheduler queries against fake scheduler commands printing
+canned output
+'''
+
+import os
+import stat
+import subprocess
+
+import pytest
+
+from asetools.db import JobManager
+from asetools.db.dbinterface import get_session
+from asetools.db.model import Base, Job, System
+from asetools.scheduler import (CANCELLED, COMPLETED, FAILED, QUEUED, RUNNING,
+                                TIMEOUT, query_states, scheduler_calls)
+
+
+SACCT_OUTPUT = '''\
+123_[0-3,7%2]|PENDING
+124_1|RUNNING
+124_2|COMPLETED
+125|COMPLETED
+126|CANCELLED by 1000
+127|TIMEOUT
+'''
+
+QSTAT_OUTPUT = '''\
+Job Id: 201.pbsserver
+    Job_Name = run.relax
+    job_state = F
+    Exit_status = 0
+Job Id: 202.pbsserver
+    Job_Name = run.relax
+    job_state = F
+    Exit_status = 1
+Job Id: 203.pbsserver
+    job_state = F
+    Exit_status = -29
+Job Id: 204.pbsserver
+    job_state = F
+Job Id: 205[2].pbsserver
+    job_state = R
+Job Id: 206.pbsserver
+    job_state = Q
+'''
+
+
+def fake_command(tmpdir, output, status=0):
+    'Write a script printing `output` and exiting with `status`'
+
+    with open(os.path.join(tmpdir, 'output.txt'), 'w') as fobj:
+        fobj.write(output)
+
+    path = os.path.join(tmpdir, 'fake')
+    with open(path, 'w') as fobj:
+        fobj.write('#!/bin/sh\ncat "{0}"\nexit {1:d}\n'.format(
+            os.path.join(tmpdir, 'output.txt'), status))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return [path]
+
+
+def test_slurm_states(tmpdir):
+
+    command = fake_command(str(tmpdir), SACCT_OUTPUT)
+    states = query_states(['123_0', '123_7', '124_1', '124_2', '125', '126',
+                           '127'], batch='slurm', command=command)
+
+    for taskid in [0, 1, 2, 3, 7]:
+        assert states['123_{0:d}'.format(taskid)] == QUEUED
+    assert '123_4' not in states
+    assert states['124_1'] == RUNNING
+    assert states['124_2'] == COMPLETED
+    assert states['125'] == COMPLETED
+    assert states['126'] == CANCELLED
+    assert states['127'] == TIMEOUT
+
+
+def test_pbs_exit_status(tmpdir):
+
+    command = fake_command(str(tmpdir), QSTAT_OUTPUT)
+    states = query_states(['201', '202', '203', '204', '205[2]', '206'],
+                          batch='pbs', command=command)
+
+    assert states == {'201': COMPLETED, '202': FAILED, '203': TIMEOUT,
+                      '204': CANCELLED, '205[2]': RUNNING, '206': QUEUED}
+
+
+def test_pbs_purged_jobs(tmpdir):
+
+    # qstat exits with non zero status when any of the ids is unknown
+    command = fake_command(str(tmpdir), QSTAT_OUTPUT, status=35)
+    states = query_states(['201', '206', '999'], batch='pbs', command=command)
+
+    assert states['201'] == COMPLETED
+    assert states['206'] == QUEUED
+    assert '999' not in states
+
+
+def test_slurm_failure_raises(tmpdir):
+
+    command = fake_command(str(tmpdir), '', status=1)
+    with pytest.raises(subprocess.CalledProcessError):
+        query_states(['125'], batch='slurm', command=command)
+
+
+def test_command_replaces_executable():
+
+    for batch in ['slurm', 'pbs', 'local']:
+        cmd, _ = scheduler_calls(['11', '12'], batch=batch,
+                                 command=['ssh', 'host', 'fake'])[0]
+        assert cmd[:3] == ['ssh', 'host', 'fake']
+        assert cmd[3] != 'ssh' and not cmd[3].endswith('.py')
+
+    cmd, _ = scheduler_calls(['11'], batch='local', command=['fake'])[0]
+    assert cmd == ['fake', 'status', '11']
+
+
+def test_sync_status(tmpdir):
+
+    session = get_session(str(tmpdir.join('jobs.db')))
+    Base.metadata.create_all(session.get_bind())
+
+    batchids = ['123_1', '124_1', '125', '126', '999', None]
+    systems = [System(name='s{0:d}'.format(i)) for i in range(len(batchids))]
+    for system, batchid in zip(systems, batchids):
+        system.jobs.append(Job(name='relax', status='submitted',
+                               batchid=batchid))
+    session.add_all(systems)
+    session.commit()
+
+    command = fake_command(str(tmpdir), SACCT_OUTPUT)
+    jobmanager = JobManager(session)
+    changed = jobmanager.sync_status(batch='slurm', command=command)
+
+    assert len(changed) == 4
+    statuses = [system.jobs[0].status for system in systems]
+    assert statuses == [QUEUED, RUNNING, COMPLETED, CANCELLED, 'submitted',
+                        'submitted']
+
+
+
+def test_sync_status_systems(tmpdir, monkeypatch):
+
+    session = get_session(str(tmpdir.join('jobs.db')))
+    Base.metadata.create_all(session.get_bind())
+
+    batchids = ['123_1', '124_1', '125', '126', '127']
+    systems = [System(name='s{0:d}'.format(i)) for i in range(len(batchids))]
+    for system, batchid in zip(systems, batchids):
+        system.jobs.append(Job(name='relax', status='submitted',
+                               batchid=batchid))
+    session.add_all(systems)
+    session.commit()
+
+    # the systems are queried in several chunks
+    monkeypatch.setattr('asetools.db.jobmanager.CHUNKSIZE', 2)
+    command = fake_command(str(tmpdir), SACCT_OUTPUT)
+    changed = JobManager(session).sync_status(systems=systems[1:],
+                                              batch='slurm', command=command)
+
+    assert len(changed) == 4
+    statuses = [system.jobs[0].status for system in systems]
+    assert statuses == ['submitted', RUNNING, COMPLETED, CANCELLED, TIMEOUT]